@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""Time the Python orchestration of every wrapper, and the
+planning of a large batch, with ffmpeg and ffprobe replaced
+by stub_backend. Nothing is encoded, so the times are the
+overhead webmify adds to every job, and the launch counts
+are the processes a real run would start.
+
+Usage: python benchmarks/orchestration.py [files]
+"""
+import io
+import sys
+import time
+import tempfile
+import statistics
+import contextlib
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir / 'webmify'))
+
+import planner  # noqa: E402
+import settings  # noqa: E402
+import wrapper  # noqa: E402
+import ffmpeg_runner  # noqa: E402
+import input_parser  # noqa: E402
+import stream_helpers  # noqa: E402
+from stub_backend import StubBackend  # noqa: E402
+
+fixture_dir = repo_dir / 'tests' / 'fixtures'
+
+cases = {'tv_stereo': (wrapper.TVStereoWrapper, {}),
+         'tv_stereo_direct_mux': (wrapper.TVStereoWrapper, {'direct_mux': True}),
+         'tv_stereo_segmented': (wrapper.TVStereoWrapper, {'segments': 8}),
+         'tv_surround_subs': (wrapper.TVMultiChannelSubtitleWrapper, {'subs': True}),
+         'chromecast': (wrapper.ChromecastWrapper, {})}
+
+
+def fresh_caches(run_dir: Path) -> None:
+    """Point every cache at an empty run_dir."""
+    settings.probe_cache_file = run_dir / 'probe.sqlite'
+    settings.passlog_cache_dir = run_dir / 'passlog'
+    settings.artifact_cache_dir = run_dir / 'artifacts'
+    settings.journal_dir = run_dir / 'journal'
+    stream_helpers._probe_memo.clear()
+
+
+def time_case(work_dir: Path, name: str, repeat: int = 5) -> tuple:
+    """Return (wall times, launches of the last run) of a
+    wrapper case, each run with empty caches.
+    """
+    wrapper_class, kwargs = cases[name]
+    kwargs = dict(kwargs)
+    subs = kwargs.pop('subs', False)
+
+    times = []
+    for num in range(repeat):
+        run_dir = work_dir / f'{name}.{num}'
+        run_dir.mkdir()
+        fresh_caches(run_dir)
+        in_file = run_dir / 'surround.mkv'
+        in_file.touch()
+
+        backend = StubBackend.from_fixtures(fixture_dir)
+        ffmpeg_runner.backend = backend
+        start = time.perf_counter()
+        wrapper_class(in_file=in_file,
+                      out_file=run_dir / 'out' / in_file.name,
+                      file_title='Benchmark',
+                      file_summary='Stub backend',
+                      sub_file=in_file if subs else '',
+                      **kwargs)
+        times.append(time.perf_counter() - start)
+
+    return times, backend.launches()
+
+
+def time_planning(work_dir: Path, files: int) -> tuple:
+    """Return (cold wall time, cached wall time, launches)
+    probing and grouping a batch of files.
+    """
+    run_dir = work_dir / 'planning'
+    run_dir.mkdir()
+    fresh_caches(run_dir)
+    in_files = []
+    for num in range(files):
+        in_file = run_dir / f'Show {num // 100:03d}.s01e{num % 100:02d}.mkv'
+        in_file.touch()
+        in_files.append(in_file)
+
+    backend = StubBackend.from_fixtures(fixture_dir)
+    ffmpeg_runner.backend = backend
+
+    def plan() -> float:
+        stream_helpers._probe_memo.clear()
+        start = time.perf_counter()
+        planner.group_plans([planner.FilePlan(file=in_file,
+                                              media_info=stream_helpers.probe(in_file),
+                                              title=input_parser.get_title(in_file),
+                                              is_movie=input_parser.is_movie(in_file),
+                                              season=input_parser.get_season(in_file),
+                                              episode=input_parser.get_episode(in_file))
+                             for in_file in in_files])
+        return time.perf_counter() - start
+
+    return plan(), plan(), backend.launches()
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = []
+        for name in cases:
+            # stages print every command they run
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                results.append((name, *time_case(Path(tmp_dir), name)))
+
+        print(f"{'Case':<24} {'Median ms':>10} {'Max ms':>8} {'Launches':>9}")
+        for name, times, launches in results:
+            print(f'{name:<24} {statistics.median(times) * 1000:10.1f} '
+                  f'{max(times) * 1000:8.1f} {launches:9d}')
+
+        cold, cached, launches = time_planning(Path(tmp_dir), files)
+        print(f'\nPlanning {files} files: {cold * 1000:.0f} ms cold, '
+              f'{cached * 1000:.0f} ms cached, {launches} launches')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+"""Time every encode path against deterministic sources
+generated with ffmpeg's lavfi, and store the results as
+JSON for comparison across commits.
+
+Sources combine testsrc2 video, sine or aevalsrc audio
+(stereo and 5.1), letterboxing, bt2020 tagging and
+embedded SRT or ASS subtitles, at several durations and
+resolutions. They are generated once into the work
+directory and reused. Every timed run uses empty caches.
+
+Usage: python benchmarks/pipeline.py [options]
+       python benchmarks/pipeline.py --compare baseline.json [options]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import statistics
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+from optparse import OptionParser
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir / 'webmify'))
+
+import settings  # noqa: E402
+import encode_object  # noqa: E402
+import stream_helpers  # noqa: E402
+import wrapper  # noqa: E402
+
+
+@dataclass(frozen=True)
+class Source:
+    """A synthetic source.
+
+    Attributes:
+        kind: stereo, hdr, surround_srt or letterbox_ass
+        duration: seconds
+        width: frame width
+        height: frame height
+    """
+    kind: str
+    duration: int
+    width: int
+    height: int
+
+    @property
+    def name(self) -> str:
+        return f'{self.kind}_{self.height}p_{self.duration}s.mkv'
+
+
+subtitle_srt = """1
+00:00:01,000 --> 00:00:04,000
+Benchmark subtitle one
+
+2
+00:00:05,000 --> 00:00:08,000
+Benchmark subtitle two
+"""
+
+subtitle_ass = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 384
+PlayResY: 288
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,16,&Hffffff,&Hffffff,&H0,&H0,0,0,0,0,100,100,0,0,1,1,0,2,10,10,10,0
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Dialogue: 0,0:00:01.00,0:00:04.00,Default,,0,0,0,,Benchmark subtitle one
+Dialogue: 0,0:00:05.00,0:00:08.00,Default,,0,0,0,,Benchmark subtitle two
+"""
+
+
+def generate(source: Source, work_dir: Path) -> Path:
+    """Write source to work_dir, unless already there,
+    and return its path.
+    """
+    out_file = work_dir / source.name
+    if out_file.exists():
+        return out_file
+
+    video_size = f'{source.width}x{source.height}'
+    if source.kind == 'letterbox_ass':
+        # 2.39:1 picture padded to the frame, for crop detection
+        video_size = f'{source.width}x{int(source.width / 2.39) // 2 * 2}'
+
+    cmd = [settings.ffmpeg_bin, '-y', '-loglevel', 'error',
+           '-f', 'lavfi', '-i', f'testsrc2=size={video_size}:rate=24:duration={source.duration}']
+
+    if source.kind.startswith('surround'):
+        channels = '|'.join(f'0.1*sin({220 * (num + 1)}*2*PI*t)' for num in range(6))
+        cmd += ['-f', 'lavfi', '-i',
+                f'aevalsrc={channels}:channel_layout=5.1:sample_rate=48000:duration={source.duration}']
+    else:
+        cmd += ['-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={source.duration}']
+
+    maps = ['-map', '0:v', '-map', '1:a']
+    if source.kind.endswith(('_srt', '_ass')):
+        sub_suffix = source.kind[-3:]
+        sub_file = work_dir / f'{source.name}.{sub_suffix}'
+        sub_file.write_text(subtitle_srt if sub_suffix == 'srt' else subtitle_ass)
+        cmd += ['-i', f'{sub_file}']
+        maps += ['-map', '2:s', '-c:s', 'srt' if sub_suffix == 'srt' else 'ass',
+                 '-metadata:s:s:0', 'language=eng']
+
+    video_flags = ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '23', '-pix_fmt', 'yuv420p']
+    if source.kind == 'letterbox_ass':
+        video_flags += ['-vf', f'pad={source.width}:{source.height}:(ow-iw)/2:(oh-ih)/2']
+    if source.kind == 'hdr':
+        video_flags += ['-color_primaries', 'bt2020', '-color_trc', 'smpte2084',
+                        '-colorspace', 'bt2020nc']
+
+    audio_flags = ['-c:a', 'flac', '-metadata:s:a:0', 'language=eng']
+    if not source.kind.startswith('surround'):
+        audio_flags += ['-ac', '2']
+
+    cmd += maps + video_flags + audio_flags + [f'{out_file}']
+    subprocess.run(cmd, stdin=subprocess.DEVNULL, check=True)
+
+    return out_file
+
+
+def fresh_caches(run_dir: Path) -> None:
+    """Point every cache at an empty run_dir, so each timed
+    run does the full work.
+    """
+    settings.probe_cache_file = run_dir / 'probe.sqlite'
+    settings.passlog_cache_dir = run_dir / 'passlog'
+    settings.artifact_cache_dir = run_dir / 'artifacts'
+    settings.journal_dir = run_dir / 'journal'
+    stream_helpers._probe_memo.clear()
+
+
+def wrapper_case(wrapper_class: Callable, subs: bool = False) -> Callable:
+    """Return a case running wrapper_class, with the
+    source's embedded subtitles if subs.
+    """
+    def case(in_file: Path, out_dir: Path, cpu_threads: str) -> None:
+        wrapper_class(in_file=in_file,
+                      out_file=out_dir / in_file.name,
+                      file_title='Benchmark',
+                      file_summary='Synthetic benchmark source',
+                      cpu_threads=cpu_threads,
+                      sub_file=in_file if subs else '',
+                      media_info=stream_helpers.probe(in_file))
+    return case
+
+
+def normalize_case(in_file: Path, out_dir: Path, cpu_threads: str) -> None:
+    encode_object.OpusNormalizedDownmixEncode(in_file=in_file,
+                                              out_file=out_dir / in_file.name,
+                                              media_info=stream_helpers.probe(in_file))
+
+
+def crop_case(in_file: Path, out_dir: Path, cpu_threads: str) -> None:
+    stream_helpers.get_crop_dimns(in_file)
+
+
+def probe_case(in_file: Path, out_dir: Path, cpu_threads: str) -> None:
+    stream_helpers.probe(in_file)
+
+
+# case name: (source kinds, case)
+cases: Dict[str, tuple] = {
+    'probe': (('stereo', 'hdr', 'surround_srt', 'letterbox_ass'), probe_case),
+    'crop_detect': (('letterbox_ass',), crop_case),
+    'normalize': (('surround_srt',), normalize_case),
+    'tv_stereo': (('stereo', 'hdr'), wrapper_case(wrapper.TVStereoWrapper)),
+    'tv_surround_subs': (('surround_srt',),
+                         wrapper_case(wrapper.TVMultiChannelSubtitleWrapper, subs=True)),
+    'chromecast': (('letterbox_ass',), wrapper_case(wrapper.ChromecastWrapper, subs=True)),
+}
+
+
+def run_case(case: Callable, in_file: Path, work_dir: Path, cpu_threads: str) -> Dict:
+    """Run case once on empty caches and return its wall
+    time and the cpu time of its child processes.
+    """
+    run_dir = work_dir / 'run'
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir(parents=True)
+    fresh_caches(run_dir)
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    case(in_file, run_dir, cpu_threads)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return {'wall': wall,
+            'cpu': (after.ru_utime - children.ru_utime) + (after.ru_stime - children.ru_stime)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def ffmpeg_version() -> str:
+    return subprocess.check_output([settings.ffmpeg_bin, '-version'], text=True).splitlines()[0]
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Print the change of every median wall time from the
+    baseline and return the keys of those slower by more
+    than threshold, a fraction.
+    """
+    before = {(entry['case'], entry['source']): entry['median'] for entry in baseline['results']}
+    regressions = []
+
+    print(f"\n{'Case':<18} {'Source':<32} {'Base s':>8} {'Now s':>8} {'Change':>8}")
+    for entry in results['results']:
+        key = (entry['case'], entry['source'])
+        if key not in before:
+            continue
+        change = entry['median'] / before[key] - 1 if before[key] else 0.0
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{entry['case']:<18} {entry['source']:<32} {before[key]:8.2f} "
+              f"{entry['median']:8.2f} {change:+8.1%}{flag}")
+        if flag:
+            regressions.append(f"{entry['case']} {entry['source']}")
+
+    return regressions
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+
+    parser.add_option('--cases',
+                      action='store', type='string', dest='cases',
+                      default=','.join(cases),
+                      help='comma separated cases to run, default = all')
+
+    parser.add_option('--compare',
+                      action='store', type='string', dest='baseline',
+                      default='',
+                      help='results file to compare against')
+
+    parser.add_option('--durations',
+                      action='store', type='string', dest='durations',
+                      default='10,60',
+                      help='comma separated source durations, seconds, default = 10,60')
+
+    parser.add_option('--heights',
+                      action='store', type='string', dest='heights',
+                      default='360,1080',
+                      help='comma separated source heights, 16:9, default = 360,1080')
+
+    parser.add_option('--quick',
+                      action='store_true', dest='quick',
+                      default=False,
+                      help='only 10 second 360p sources, default = false')
+
+    parser.add_option('-o', '--out',
+                      action='store', type='string', dest='out_file',
+                      default='',
+                      help='results file, default = benchmarks/results/<date>-<commit>.json')
+
+    parser.add_option('--repeat',
+                      action='store', type='int', dest='repeat',
+                      default=3,
+                      help='runs per case and source, default = 3')
+
+    parser.add_option('--threads',
+                      action='store', type='string', dest='cpu_threads',
+                      default=str(os.cpu_count()),
+                      help=f'cpu threads for the encodes, default = {os.cpu_count()}')
+
+    parser.add_option('--threshold',
+                      action='store', type='float', dest='threshold',
+                      default=0.1,
+                      help='slowdown reported as a regression, default = 0.1')
+
+    parser.add_option('--work-dir',
+                      action='store', type='string', dest='work_dir',
+                      default=str(repo_dir / 'benchmarks' / 'media'),
+                      help='where sources are generated and encoded')
+
+    (options, args) = parser.parse_args()
+
+    if shutil.which(settings.ffmpeg_bin) is None:
+        sys.exit(f'{settings.ffmpeg_bin} not found, it is needed to generate the sources')
+
+    durations = [10] if options.quick else [int(num) for num in options.durations.split(',')]
+    heights = [360] if options.quick else [int(num) for num in options.heights.split(',')]
+    work_dir = Path(options.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {'commit': git_commit(),
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'ffmpeg': ffmpeg_version(),
+               'cpu_count': os.cpu_count(),
+               'cpu_threads': options.cpu_threads,
+               'results': []}
+
+    for case_name in options.cases.split(','):
+        kinds, case = cases[case_name]
+        for kind in kinds:
+            for duration in durations:
+                for height in heights:
+                    source = Source(kind, duration, height * 16 // 9 // 2 * 2, height)
+                    in_file = generate(source, work_dir)
+
+                    runs = [run_case(case, in_file, work_dir, options.cpu_threads)
+                            for _ in range(options.repeat)]
+                    walls = [run['wall'] for run in runs]
+                    entry = {'case': case_name,
+                             'source': source.name,
+                             'duration': duration,
+                             'resolution': f'{source.width}x{height}',
+                             'wall': walls,
+                             'cpu': [run['cpu'] for run in runs],
+                             'best': min(walls),
+                             'median': statistics.median(walls),
+                             'speed': duration / statistics.median(walls)}
+                    results['results'].append(entry)
+                    print(f"{case_name:<18} {source.name:<32} median {entry['median']:8.2f}s "
+                          f"({entry['speed']:.2f}x realtime)")
+
+    out_file = Path(options.out_file or repo_dir / 'benchmarks' / 'results' /
+                    f"{time.strftime('%Y%m%d-%H%M%S')}-{results['commit']}.json")
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_file, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f'\nResults: {out_file}')
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), options.threshold)
+        if regressions:
+            sys.exit(f'\n{len(regressions)} regressions over {options.threshold:.0%}')
+
+
+if __name__ == '__main__':
+    main()
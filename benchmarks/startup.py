@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""Time `webmify.py --help`, the floor for every invocation
+from a watch script, and list the slowest imports.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import sys
+import time
+import statistics
+import subprocess
+from pathlib import Path
+
+
+webmify_dir = Path(__file__).resolve().parent.parent / 'webmify'
+
+
+def time_startup(runs: int) -> list:
+    """Return the wall time of each of runs invocations."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'webmify.py', '--help'],
+                       cwd=webmify_dir, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def slowest_imports(count: int = 10) -> list:
+    """Return (cumulative us, module) for the top level
+    imports of webmify.py, slowest first.
+    """
+    comp_proc = subprocess.run([sys.executable, '-X', 'importtime', 'webmify.py', '--help'],
+                               cwd=webmify_dir, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+
+    imports = []
+    for line in comp_proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    times = time_startup(runs)
+    print(f'webmify.py --help, {runs} runs:')
+    print(f'  min {min(times) * 1000:.1f} ms, median {statistics.median(times) * 1000:.1f} ms, '
+          f'max {max(times) * 1000:.1f} ms')
+
+    print('\nSlowest imports (cumulative):')
+    for cumulative, name in slowest_imports():
+        print(f'  {cumulative / 1000:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
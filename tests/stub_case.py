@@ -0,0 +1,70 @@
+import io
+import tempfile
+import unittest
+import contextlib
+
+from pathlib import Path
+
+import settings
+import ffmpeg_runner
+import stream_helpers
+from stub_backend import StubBackend
+
+
+fixture_dir = Path(__file__).resolve().parent / 'fixtures'
+
+
+class StubCase(unittest.TestCase):
+    """Base class for tests running stages, wrappers and
+    batches against stub_backend, with every cache in a
+    temporary directory.
+
+    media is a stereo 1080p source, surround a 4K source
+    with 6 channel audio and subtitles, see fixtures.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp_dir.name)
+
+        self.orig_settings = {name: getattr(settings, name)
+                              for name in ('probe_cache_file', 'passlog_cache_dir',
+                                           'artifact_cache_dir', 'journal_dir')}
+        settings.probe_cache_file = self.tmp_path / 'cache' / 'probe.sqlite'
+        settings.passlog_cache_dir = self.tmp_path / 'cache' / 'passlog'
+        settings.artifact_cache_dir = self.tmp_path / 'cache' / 'artifacts'
+        settings.journal_dir = self.tmp_path / 'cache' / 'journal'
+        stream_helpers._probe_memo.clear()
+
+        self.backend = StubBackend.from_fixtures(fixture_dir)
+        ffmpeg_runner.backend = self.backend
+
+        self.media = self.tmp_path / 'Show.s01e01.mkv'
+        self.media.write_bytes(b'\0' * 16)
+        self.surround = self.tmp_path / 'surround.mkv'
+        self.surround.write_bytes(b'\0' * 16)
+        self.out_dir = self.tmp_path / 'out'
+        self.out_dir.mkdir()
+
+        # stages print every command and its output
+        self.stdout = contextlib.redirect_stdout(io.StringIO())
+        self.stderr = contextlib.redirect_stderr(io.StringIO())
+        self.stdout.__enter__()
+        self.stderr.__enter__()
+
+    def tearDown(self):
+        self.stderr.__exit__(None, None, None)
+        self.stdout.__exit__(None, None, None)
+
+        ffmpeg_runner.backend = None
+        for name, value in self.orig_settings.items():
+            setattr(settings, name, value)
+        stream_helpers._probe_memo.clear()
+        self.tmp_dir.cleanup()
+
+    def _wrap(self, wrapper_class, in_file, **kwargs):
+        return wrapper_class(in_file=in_file,
+                             out_file=self.out_dir / in_file.name,
+                             file_title='Title',
+                             file_summary='Summary',
+                             **kwargs)
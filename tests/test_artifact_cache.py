@@ -0,0 +1,67 @@
+import os
+import unittest
+import tempfile
+
+from pathlib import Path
+
+import settings
+import artifact_cache
+
+
+class TestArtifactCache(unittest.TestCase):
+    """Testing class for artifact_cache.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp_dir.name)
+        self.orig_cache_dir = settings.artifact_cache_dir
+        settings.artifact_cache_dir = self.tmp_path / 'artifacts'
+
+        self.surround = self.tmp_path / 'show.s01e01.audio.opus'
+        self.downmix = self.tmp_path / 'show.s01e01.norm.opus'
+        self.surround.write_bytes(b'surround')
+        self.downmix.write_bytes(b'downmix')
+
+    def tearDown(self):
+        settings.artifact_cache_dir = self.orig_cache_dir
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        outputs = [self.downmix, self.surround]
+        self.assertFalse(artifact_cache.restore('abc', outputs))
+
+        artifact_cache.store('abc', outputs, 'Opus: show.s01e01.mkv')
+        for out_file in outputs:
+            out_file.unlink()
+
+        self.assertTrue(artifact_cache.restore('abc', outputs))
+        self.assertEqual(self.downmix.read_bytes(), b'downmix')
+        self.assertEqual(self.surround.read_bytes(), b'surround')
+        self.assertFalse(artifact_cache.restore('abc', [self.downmix]))
+
+        entry, = artifact_cache.entries()
+        self.assertEqual(entry['description'], 'Opus: show.s01e01.mkv')
+
+    def test_hard_links(self):
+        artifact_cache.store('abc', [self.downmix])
+        stored = settings.artifact_cache_dir / 'abc' / '0.opus'
+        self.assertTrue(os.path.samefile(stored, self.downmix))
+
+        self.downmix.unlink()
+        self.assertTrue(artifact_cache.restore('abc', [self.downmix]))
+        self.assertTrue(os.path.samefile(stored, self.downmix))
+        self.assertEqual(self.downmix.read_bytes(), b'downmix')
+
+    def test_evict(self):
+        for num in range(3):
+            artifact_cache.store(f'{num}', [self.downmix])
+            manifest = settings.artifact_cache_dir / f'{num}' / 'manifest.json'
+            os.utime(manifest, (num + 1, num + 1))
+        total = sum(entry['size'] for entry in artifact_cache.entries())
+
+        self.assertEqual(artifact_cache.evict(max_bytes=total - 1), 1)
+        self.assertEqual([entry['key'] for entry in artifact_cache.entries()], ['1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
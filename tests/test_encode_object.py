@@ -0,0 +1,135 @@
+import threading
+import unittest
+
+import settings
+import wrapper
+import encode_object
+from tests.stub_case import StubCase
+
+
+class TestEncodeObject(StubCase):
+    """Testing class for encode_object.py"""
+
+    def test_segmented_wrapper(self):
+        segments = 4
+        tv_wrapper = self._wrap(wrapper.TVStereoWrapper, self.media, segments=segments)
+
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 1'), segments)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2'), segments)
+        self.assertEqual(self.backend.launches('ffmpeg', '-f concat'), 1)
+        self.assertEqual(self.backend.launches('ffprobe', 'packet=pts_time'), 1)
+        # every chunk, and the concatenation, is counted
+        self.assertEqual(self.backend.launches('ffprobe', '-count_packets'), segments + 1)
+        self.assertEqual(list(self.out_dir.iterdir()), [tv_wrapper.out_file])
+
+    def test_segmented_failure(self):
+        self.backend.fail = 'chunk002.webm'
+        cancel = threading.Event()
+        with self.assertRaises(encode_object.EncodeError) as raised:
+            encode_object.VP9Encode(in_file=self.media, out_file=self.out_dir / 'show',
+                                    segments=4, cancel=cancel)
+
+        # the failed chunk is reported, not the siblings it stopped
+        self.assertNotIsInstance(raised.exception, encode_object.EncodeCancelled)
+        self.assertIn('stub failure', str(raised.exception))
+        self.assertTrue(cancel.is_set())
+        self.assertEqual(self.backend.launches('ffmpeg', '-f concat'), 0)
+        # finished chunks and pass logs are removed too
+        self.assertEqual(list(self.out_dir.iterdir()), [])
+
+    def test_segmented_without_keyframes(self):
+        # only the first packet is flagged as a keyframe
+        self.backend.keyframe_interval = 10 ** 9
+        stage = encode_object.VP9Encode(in_file=self.media, out_file=self.out_dir / 'show',
+                                        segments=4, cpu_threads='8')
+
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 1'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2', '-threads 8'), 1)
+        self.assertEqual(list(self.out_dir.iterdir()), [stage.out_file])
+
+    def test_segmented_threads(self):
+        segments = 4
+        encode_object.VP9Encode(in_file=self.media, out_file=self.out_dir / 'show',
+                                segments=segments, cpu_threads='8')
+
+        # each chunk encodes with its share of the threads
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2', '-threads 2'), segments)
+
+    def test_fused_downmix_measurement(self):
+        stage = encode_object.NormalizeFirstPassEncode(in_file=self.surround,
+                                                       out_file=self.out_dir / 'surround')
+
+        # pan and loudnorm share one graph on the source, no PCM is written
+        self.assertEqual(self.backend.launches('ffmpeg'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', 'pan=stereo', 'loudnorm', '-f null'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', 'pcm_s16le'), 0)
+        self.assertEqual(stage.norm_i, '-27.61')
+        self.assertEqual(list(self.out_dir.iterdir()), [])
+
+        # a stereo source is measured without the downmix
+        encode_object.NormalizeFirstPassEncode(in_file=self.media, out_file=self.out_dir / 'show')
+        self.assertEqual(self.backend.launches('ffmpeg', 'pan=stereo'), 1)
+
+    def test_normalization_passes(self):
+        self.backend.output_lra = [19.5, 18.0, 9.0]
+        stage = encode_object.OpusNormalizedDownmixEncode(in_file=self.surround,
+                                                          out_file=self.out_dir / 'surround')
+        self.assertEqual(len(stage.norm_passes), 3)
+        self.assertEqual(self.backend.launches('ffmpeg', 'print_format=json'), 3)
+        self.assertEqual(self.backend.launches('ffmpeg', 'libopus'), 1)
+        self.assertEqual(' '.join(stage.encode_cmd).count('measured_I='), 3)
+        self.assertTrue(stage.out_file.exists())
+
+        # measurements are cached, keyed by the passes applied
+        encode_object.OpusNormalizedDownmixEncode(in_file=self.surround,
+                                                  out_file=self.out_dir / 'surround')
+        self.assertEqual(self.backend.launches('ffmpeg', 'print_format=json'), 3)
+
+    def test_normalization_pass_limit(self):
+        self.backend.output_lra = [25.0]
+        stage = encode_object.OpusNormalizedDownmixEncode(in_file=self.media,
+                                                          out_file=self.out_dir / 'show')
+        self.assertEqual(len(stage.norm_passes), settings.loudnorm_max_passes)
+        self.assertEqual(self.backend.launches('ffmpeg', 'print_format=json'),
+                         settings.loudnorm_max_passes)
+
+    def test_normalized_aac(self):
+        stage = encode_object.AACNormalizedDownmixEncode(in_file=self.surround,
+                                                         out_file=self.out_dir / 'surround')
+
+        # the normalized audio is encoded as it is filtered
+        encode_cmd = ' '.join(stage.encode_cmd)
+        self.assertIn('measured_I=', encode_cmd)
+        self.assertIn('aresample=48000', encode_cmd)
+        self.assertEqual(self.backend.launches('ffmpeg'), 2)
+        self.assertEqual(list(self.out_dir.iterdir()), [stage.out_file])
+
+    def test_single_demux_renditions(self):
+        stage = encode_object.SurroundOpusNormalizedDownmixEncode(in_file=self.surround,
+                                                                  out_file=self.out_dir / 'surround')
+
+        # both renditions are written by one run, from one demux
+        self.assertEqual(self.backend.launches('ffmpeg', 'libopus'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '[0:a:0]asplit=2'), 1)
+        self.assertEqual(sorted(self.out_dir.iterdir()),
+                         sorted([stage.out_file, stage.surround_file]))
+
+    def test_filter_once(self):
+        stage = encode_object.VP9Encode(in_file=self.surround, out_file=self.out_dir / 'surround',
+                                        crop=True, filter_once=True)
+
+        # the crop is rendered once, the passes read the render unfiltered
+        self.assertEqual(self.backend.launches('ffmpeg', 'crop=', 'ffv1'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass', 'crop='), 0)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 1', '.filtered.mkv'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2', '.filtered.mkv'), 1)
+        self.assertEqual(list(self.out_dir.iterdir()), [stage.out_file])
+
+    def test_filter_once_without_filters(self):
+        encode_object.VP9Encode(in_file=self.media, out_file=self.out_dir / 'show',
+                                filter_once=True)
+        self.assertEqual(self.backend.launches('ffmpeg', 'ffv1'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
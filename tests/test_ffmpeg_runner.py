@@ -0,0 +1,107 @@
+import re
+import sys
+import stat
+import time
+import tempfile
+import threading
+import subprocess
+import unittest
+
+from pathlib import Path
+
+import settings
+import ffmpeg_runner
+
+
+# stands in for ffmpeg: progress on stdout, log lines on stderr
+fake_ffmpeg = f"""#!{sys.executable}
+import re
+import sys
+import time
+
+args = sys.argv[1:]
+mode = args[-1]
+sys.stderr.write('\\n'.join(f'log line {{num}}' for num in range(100)) + '\\n')
+sys.stderr.write('"input_i" : "-23.50",\\n"output_lra" : "4.20"\\n')
+sys.stderr.write('x' * 200000 + '\\r' + 'crop=1920:800:0:140\\n')
+if '-progress' in args:
+    for frame in (24, 48):
+        sys.stdout.write(f'frame={{frame}}\\nfps=47.5\\nout_time_us={{frame * 41666}}\\n'
+                         f'speed=1.98x\\nprogress={{"end" if frame == 48 else "continue"}}\\n')
+        sys.stdout.flush()
+if mode == 'sleep':
+    time.sleep(30)
+sys.exit(3 if mode == 'fail' else 0)
+"""
+
+
+class TestFFmpegRunner(unittest.TestCase):
+    """Testing class for ffmpeg_runner.py"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.fake_bin = Path(self.temp_dir.name) / 'ffmpeg'
+        self.fake_bin.write_text(fake_ffmpeg)
+        self.fake_bin.chmod(self.fake_bin.stat().st_mode | stat.S_IXUSR)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_progress_and_capture(self):
+        reports = []
+        capture = re.compile('"input_i" : "(?P<input_i>.+?)"'
+                            '|"output_lra" : "(?P<output_lra>.+?)"'
+                            '|crop=(?P<crop>[0-9:]+)')
+        run_result = ffmpeg_runner.run([self.fake_bin, 'ok'], progress=True, capture=capture,
+                                       echo=False, on_progress=reports.append).check()
+
+        self.assertEqual(run_result.cmd[1:4], ffmpeg_runner.progress_flags)
+        self.assertEqual([report.frame for report in reports], [24, 48])
+        self.assertTrue(run_result.progress.done)
+        self.assertAlmostEqual(run_result.progress.speed, 1.98)
+        self.assertAlmostEqual(run_result.progress.out_time, 48 * 0.041666)
+        self.assertEqual(run_result.captured, {'input_i': '-23.50', 'output_lra': '4.20',
+                                               'crop': '1920:800:0:140'})
+
+    def test_bounded_stderr(self):
+        run_result = ffmpeg_runner.run([self.fake_bin, 'ok'], echo=False)
+
+        self.assertEqual(len(run_result.stderr_tail), settings.runner_tail_lines)
+        self.assertEqual(run_result.stderr_tail[-1], 'crop=1920:800:0:140')
+        self.assertTrue(all(len(line) <= ffmpeg_runner._max_line
+                            for line in run_result.stderr_tail))
+
+    def test_stdout(self):
+        run_result = ffmpeg_runner.run([sys.executable, '-c', 'print("{}")'], stdout=True)
+        self.assertEqual(run_result.stdout, '{}\n')
+
+    def test_failure(self):
+        run_result = ffmpeg_runner.run([self.fake_bin, 'fail'], echo=False)
+
+        self.assertEqual(run_result.returncode, 3)
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_result.check()
+
+    def test_timeout(self):
+        start = time.monotonic()
+        run_result = ffmpeg_runner.run([self.fake_bin, 'sleep'], echo=False, timeout=0.5)
+
+        self.assertTrue(run_result.timed_out)
+        self.assertLess(time.monotonic() - start, 10)
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_result.check()
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        threading.Timer(0.5, cancel.set).start()
+        run_result = ffmpeg_runner.run([self.fake_bin, 'sleep'], echo=False, cancel=cancel)
+
+        self.assertTrue(run_result.cancelled)
+        self.assertNotEqual(run_result.returncode, 0)
+        with self.assertRaises(ffmpeg_runner.RunCancelled):
+            run_result.check()
+
+    def test_run_all(self):
+        run_results = ffmpeg_runner.run_all([[self.fake_bin, 'ok'], [self.fake_bin, 'fail']],
+                                            echo=False)
+        self.assertEqual([run_result.returncode for run_result in run_results], [0, 3])
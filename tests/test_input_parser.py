@@ -84,3 +84,13 @@ class TestInputParser(unittest.TestCase):
 
             test_resp = input_parser.is_movie(Path(test_title))
             self.assertEqual(test_resp, test_aswr)
+
+    def test_normalize_title(self):
+        self.assertEqual(input_parser.normalize_title('The_Show '), 'the show')
+        self.assertEqual(input_parser.normalize_title('the  show'), 'the show')
+        self.assertEqual(input_parser.normalize_title('The-Show'), 'the show')
+
+    def test_parse_name(self):
+        self.assertEqual(input_parser.parse_name('The.Show.S1E3.mkv'), ('The', '01', '03'))
+        self.assertEqual(input_parser.parse_name('Film (1999).mkv'), ('Film ', '', ''))
+        self.assertEqual(input_parser.parse_name('noext'), ('noext', '', ''))
@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+
+from pathlib import Path
+
+import journal
+
+
+class TestJournal(unittest.TestCase):
+    """Testing class for journal.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp_dir.name)
+        self.journal_file = self.tmp_path / 'batch.jsonl'
+
+        self.out_file = self.tmp_path / 'show.s01e01.audio.opus'
+        self.out_file.write_bytes(b'opus' * 16)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self):
+        key = journal.stage_key('OpusEncode', (1, 2, 3, 4), ['-c:a', 'libopus'])
+        batch_journal = journal.Journal(self.journal_file)
+        self.assertFalse(batch_journal.is_done(key))
+
+        batch_journal.record(key, [self.out_file])
+        self.assertTrue(journal.Journal(self.journal_file).is_done(key))
+
+    def test_truncated_line(self):
+        key = journal.stage_key('OpusEncode')
+        journal.Journal(self.journal_file).record(key, [self.out_file])
+        with open(self.journal_file, 'a') as journal_file:
+            journal_file.write('{"stage": "abc", "outp')
+
+        self.assertTrue(journal.Journal(self.journal_file).is_done(key))
+
+    def test_changed_output(self):
+        key = journal.stage_key('OpusEncode')
+        batch_journal = journal.Journal(self.journal_file)
+        batch_journal.record(key, [self.out_file])
+
+        self.out_file.write_bytes(b'opus' * 8)
+        self.assertFalse(batch_journal.is_done(key))
+
+        self.out_file.unlink()
+        self.assertFalse(batch_journal.is_done(key))
+
+    def test_checksum_tail(self):
+        size = 3 * 1024 * 1024
+        self.out_file.write_bytes(b'\0' * size)
+        before = journal.checksum(self.out_file)
+
+        with open(self.out_file, 'r+b') as out_file:
+            out_file.seek(size - 1)
+            out_file.write(b'\1')
+        self.assertNotEqual(journal.checksum(self.out_file), before)
+
+    def test_output_path(self):
+        out_file = self.tmp_path / 'show.s01e01.mkv'
+        self.assertEqual(journal.output_path(out_file),
+                         journal.output_path(self.tmp_path / '.' / 'show.s01e01.mkv'))
+        self.assertNotEqual(journal.output_path(out_file),
+                            journal.output_path(self.tmp_path / 'show.s01e02.mkv'))
+
+    def test_remove(self):
+        batch_journal = journal.Journal(self.journal_file)
+        batch_journal.record(journal.stage_key('OpusEncode'), [self.out_file])
+        batch_journal.remove()
+
+        self.assertFalse(self.journal_file.exists())
+        self.assertEqual(journal.Journal(self.journal_file).entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import tempfile
+import unittest
+
+from pathlib import Path
+
+import library_scan
+
+
+library = ['The Show/Season 1/The Show.s01e02.mkv',
+           'The Show/Season 1/The Show.s01e01.mkv',
+           'The Show/Season 1/The Show.s01e01.webm',
+           'the_show.S2E1.mp4',
+           'Movies/Film (1999).mkv',
+           'Movies/Film (1999).chromecast.mp4',
+           'Movies/Film (1999).srt',
+           'Movies/.Film (1999).part.mkv',
+           '.hidden/Other.s01e01.mkv']
+
+
+class TestLibraryScan(unittest.TestCase):
+    """Testing class for library_scan.py"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        for name in library:
+            (self.root / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.root / name).write_bytes(b'x' * len(name))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_scan(self):
+        entries = library_scan.scan(self.root)
+
+        self.assertEqual([entry.file.relative_to(self.root).as_posix() for entry in entries],
+                         ['Movies/Film (1999).mkv',
+                          'The Show/Season 1/The Show.s01e01.mkv',
+                          'The Show/Season 1/The Show.s01e02.mkv',
+                          'the_show.S2E1.mp4'])
+        self.assertTrue(entries[0].is_movie)
+        self.assertEqual((entries[3].season, entries[3].episode), ('02', '01'))
+        self.assertEqual(entries[1].size, len(library[1]))
+
+    def test_index(self):
+        library_index = library_scan.index(library_scan.scan(self.root))
+
+        self.assertEqual(library_index['files'], 4)
+        self.assertEqual([movie['title'] for movie in library_index['movies']], ['Film '])
+        self.assertEqual(sorted(library_index['shows']['the show']), ['01', '02'])
+        self.assertEqual(len(library_index['shows']['the show']['01']), 2)
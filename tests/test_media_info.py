@@ -0,0 +1,49 @@
+import unittest
+
+from pathlib import Path
+
+from media_info import MediaInfo
+
+
+probe = {'streams': [{'index': 0, 'codec_type': 'video', 'codec_name': 'hevc',
+                      'width': 3840, 'height': 2160, 'color_space': 'bt2020nc',
+                      'avg_frame_rate': '24000/1001'},
+                     {'index': 1, 'codec_type': 'audio', 'codec_name': 'truehd',
+                      'channels': 8, 'tags': {'language': 'eng'}},
+                     {'index': 2, 'codec_type': 'audio', 'codec_name': 'ac3',
+                      'channels': 2, 'avg_frame_rate': '0/0'},
+                     {'index': 3, 'codec_type': 'subtitle', 'codec_name': 'subrip',
+                      'tags': {'language': 'eng'}}],
+         'format': {'format_name': 'matroska,webm', 'duration': '5400.250000',
+                    'start_time': '1.400000',
+                    'bit_rate': '48000000'}}
+
+
+class TestMediaInfo(unittest.TestCase):
+    """Testing class for media_info.py"""
+
+    def setUp(self):
+        self.info = MediaInfo.from_ffprobe(Path('movie.mkv'), probe)
+
+    def test_format(self):
+        self.assertEqual(self.info.format_name, 'matroska,webm')
+        self.assertEqual(self.info.duration, 5400.25)
+        self.assertEqual(self.info.start_time, 1.4)
+        self.assertEqual(self.info.bit_rate, 48000000)
+
+    def test_relative_ids(self):
+        self.assertEqual(self.info.video('0').height, 2160)
+        self.assertEqual(self.info.video('0').color_space, 'bt2020nc')
+        self.assertEqual(self.info.audio('0').channels, 8)
+        self.assertEqual(self.info.audio('0').language, 'eng')
+        self.assertEqual(self.info.audio('1').index, 2)
+        self.assertEqual(self.info.audio('1').language, '')
+        self.assertEqual(self.info.subtitle('0').codec_name, 'subrip')
+
+    def test_frame_rate(self):
+        self.assertAlmostEqual(self.info.video('0').frame_rate, 23.976, places=3)
+        self.assertEqual(self.info.audio('1').frame_rate, 0.0)
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.info.duration = 0.0
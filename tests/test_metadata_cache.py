@@ -0,0 +1,91 @@
+import time
+import unittest
+import tempfile
+import threading
+
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import settings
+import metadata_cache
+
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the metadata APIs, counting requests."""
+    hits = 0
+
+    def do_GET(self):
+        StubHandler.hits += 1
+        body = f'{{"path": "{self.path}"}}'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(requests_cache is None, 'requests-cache not installed')
+class TestMetadataCache(unittest.TestCase):
+    """Testing class for metadata_cache.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.orig_cache_file = settings.metadata_cache_file
+        self.orig_expire_after = settings.metadata_cache_expire_after
+        settings.metadata_cache_file = Path(self.tmp_dir.name) / 'metadata.sqlite'
+
+        StubHandler.hits = 0
+        self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        metadata_cache.session().close()
+        metadata_cache._session = None
+        metadata_cache.offline = False
+        settings.metadata_cache_file = self.orig_cache_file
+        settings.metadata_cache_expire_after = self.orig_expire_after
+        self.tmp_dir.cleanup()
+
+    def _reopen(self, offline=False):
+        metadata_cache.session().close()
+        metadata_cache._session = None
+        metadata_cache.offline = offline
+
+    def test_repeat_request_cached(self):
+        for _ in range(3):
+            response = metadata_cache.session().get(f'{self.url}/search/series?name=show')
+            self.assertEqual(response.json()['path'], '/search/series?name=show')
+        self.assertEqual(StubHandler.hits, 1)
+
+        self._reopen()
+        metadata_cache.session().get(f'{self.url}/search/series?name=show')
+        self.assertEqual(StubHandler.hits, 1)
+
+    def test_offline_serves_stale(self):
+        settings.metadata_cache_expire_after = 1
+        metadata_cache.session().get(f'{self.url}/series/1')
+        time.sleep(1.1)
+
+        self._reopen(offline=True)
+        response = metadata_cache.session().get(f'{self.url}/series/1')
+        self.assertEqual(response.json()['path'], '/series/1')
+        self.assertEqual(StubHandler.hits, 1)
+
+        with self.assertRaises(Exception):
+            metadata_cache.session().get(f'{self.url}/series/2')
+        self.assertEqual(StubHandler.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
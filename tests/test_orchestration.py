@@ -0,0 +1,147 @@
+import os
+import subprocess
+
+import planner
+import settings
+import artifact_cache
+import wrapper
+import encode_object
+import input_parser
+import stream_helpers
+from journal import Journal
+from tests.stub_case import StubCase
+
+
+class TestOrchestration(StubCase):
+    """Process launches of whole stages, wrappers and
+    batches, run against stub_backend."""
+
+    def test_probe_once(self):
+        self.assertEqual(stream_helpers.get_height(self.media, '0'), 1080)
+        self.assertEqual(stream_helpers.get_audio_ch(self.media, '0'), '2')
+        self.assertEqual(stream_helpers.get_audio_lang(self.media, '0'), 'eng')
+        self.assertEqual(self.backend.launches('ffprobe'), 1)
+
+        # a new process reads the persistent cache
+        stream_helpers._probe_memo.clear()
+        self.assertEqual(stream_helpers.get_sub_stream(self.surround), '2')
+        stream_helpers.probe(self.media)
+        self.assertEqual(self.backend.launches('ffprobe'), 2)
+
+    def test_passlog_reuse_across_jobs(self):
+        # tile columns follow the thread share, which varies with --jobs
+        for cpu_threads in ('16', '2'):
+            encode_object.VP9Encode(in_file=self.media, out_file=self.out_dir / 'show',
+                                    cpu_threads=cpu_threads)
+
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 1'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2'), 2)
+
+    def test_failure_keeps_journaled_stages(self):
+        batch_journal = Journal(self.tmp_path / 'batch.jsonl')
+        default_probe = self.backend.default_probe
+        self.backend.default_probe = None
+        sub_file = self.tmp_path / 'broken.srt'
+        sub_file.touch()
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._wrap(wrapper.TVStereoSubtitleWrapper, self.surround,
+                       sub_file=sub_file, journal=batch_journal)
+        self.assertEqual(sorted(out_file.name for out_file in self.out_dir.iterdir()),
+                         ['surround.audio.opus', 'surround.vp9.webm'])
+
+        # the next run encodes only the failed stage, and muxes
+        self.backend.default_probe = default_probe
+        launches = self.backend.launches('ffmpeg')
+        tv_wrapper = self._wrap(wrapper.TVStereoSubtitleWrapper, self.surround,
+                                sub_file=sub_file, journal=batch_journal)
+        self.assertEqual(self.backend.launches('ffmpeg') - launches, 2)
+        self.assertEqual(list(self.out_dir.iterdir()), [tv_wrapper.out_file])
+
+    def test_scratch_dir(self):
+        scratch_dir = self.tmp_path / 'scratch'
+        other_dir = self.tmp_path / 'other'
+        other_dir.mkdir()
+
+        # outputs of the same name get their own intermediates
+        stage_dirs = set()
+        for out_dir in (self.out_dir, other_dir):
+            tv_wrapper = wrapper.TVStereoWrapper(in_file=self.media,
+                                                 out_file=out_dir / self.media.name,
+                                                 file_title='Title',
+                                                 file_summary='Summary',
+                                                 scratch_dir=scratch_dir)
+            self.assertEqual(tv_wrapper.stage_file.parent.parent, scratch_dir)
+            self.assertTrue(tv_wrapper.out_file.exists())
+            stage_dirs.add(tv_wrapper.stage_file.parent)
+
+        self.assertEqual(len(stage_dirs), 2)
+        # emptied and removed once muxed
+        self.assertEqual(list(scratch_dir.iterdir()), [])
+
+    def test_artifact_key(self):
+        artifact_cache.enabled = True
+        self.addCleanup(setattr, artifact_cache, 'enabled', False)
+        sub_file = self.tmp_path / 'Show.s01e01.srt'
+        sub_file.write_text('1\n00:00:01,000 --> 00:00:02,000\nOne\n')
+
+        def encode(cpu_threads):
+            encode_object.VP9Encode(in_file=self.media, out_file=self.out_dir / 'show',
+                                    burn_subs=True, sub_file=sub_file,
+                                    cpu_threads=cpu_threads)
+
+        # the thread share, and tile columns, vary with --jobs
+        encode('16')
+        encode('2')
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2'), 1)
+
+        # an edited subtitle file is burned in again
+        sub_file.write_text('1\n00:00:01,000 --> 00:00:02,000\nOne, edited\n')
+        encode('16')
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2'), 2)
+
+    def test_artifact_links(self):
+        artifact_cache.enabled = True
+        self.addCleanup(setattr, artifact_cache, 'enabled', False)
+
+        def encode():
+            return encode_object.OpusEncode(in_file=self.media, out_file=self.out_dir / 'show')
+
+        stage = encode()
+        stored, = settings.artifact_cache_dir.glob('*/0.opus')
+        self.assertTrue(os.path.samefile(stored, stage.out_file))
+
+        # encoding again replaces the linked output, not the entry
+        artifact_cache.enabled = False
+        self.backend.output_bytes = 2048
+        encode()
+        self.assertEqual(stored.stat().st_size, 1024)
+        self.assertEqual(stage.out_file.stat().st_size, 2048)
+
+    def test_plan_batch(self):
+        shows = 20
+        episodes = 50
+        in_files = []
+        for show in range(shows):
+            for episode in range(1, episodes + 1):
+                in_file = self.tmp_path / f'Show {show:02d}.s01e{episode:02d}.mkv'
+                in_file.touch()
+                in_files.append(in_file)
+
+        plans = []
+        for in_file in in_files:
+            plan = planner.FilePlan(file=in_file,
+                                    media_info=stream_helpers.probe(in_file),
+                                    title=input_parser.get_title(in_file),
+                                    is_movie=input_parser.is_movie(in_file),
+                                    season=input_parser.get_season(in_file),
+                                    episode=input_parser.get_episode(in_file))
+            plans.append(plan)
+
+        self.assertEqual(len(planner.group_plans(plans)), shows)
+        self.assertEqual(self.backend.launches('ffprobe'), len(in_files))
+
+        # planning again reads every probe from the cache
+        stream_helpers._probe_memo.clear()
+        for in_file in in_files:
+            stream_helpers.probe(in_file)
+        self.assertEqual(self.backend.launches(), len(in_files))
@@ -0,0 +1,64 @@
+import os
+import unittest
+import tempfile
+
+from pathlib import Path
+
+import settings
+import passlog_cache
+
+
+class TestPasslogCache(unittest.TestCase):
+    """Testing class for passlog_cache.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp_dir.name)
+        self.orig_cache_dir = settings.passlog_cache_dir
+        settings.passlog_cache_dir = self.tmp_path / 'passlog'
+
+        self.media = self.tmp_path / 'show.s01e01.mkv'
+        self.media.write_bytes(b'\0' * 16)
+        self.log_file = self.tmp_path / 'show.s01e01-0.log'
+
+    def tearDown(self):
+        settings.passlog_cache_dir = self.orig_cache_dir
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        cache_key = passlog_cache.key(self.media, ['0', None, ['-vf', 'crop=1920:800:0:140']])
+        self.assertFalse(passlog_cache.get(cache_key, self.log_file))
+
+        self.log_file.write_bytes(b'stats')
+        passlog_cache.put(cache_key, self.log_file)
+        self.log_file.unlink()
+
+        self.assertTrue(passlog_cache.get(cache_key, self.log_file))
+        self.assertEqual(self.log_file.read_bytes(), b'stats')
+
+    def test_key(self):
+        parts = ['0', None, ['-vf', 'crop=1920:800:0:140']]
+        self.assertEqual(passlog_cache.key(self.media, parts),
+                         passlog_cache.key(self.media, list(parts)))
+        self.assertNotEqual(passlog_cache.key(self.media, parts),
+                            passlog_cache.key(self.media, ['0', None, ['-vf', 'crop=1920:1040:0:20']]))
+
+        cache_key = passlog_cache.key(self.media, parts)
+        stat = os.stat(self.media)
+        os.utime(self.media, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertNotEqual(passlog_cache.key(self.media, parts), cache_key)
+
+    def test_evict(self):
+        self.log_file.write_bytes(b'\0' * 100)
+        for num in range(3):
+            passlog_cache.put(f'{num}', self.log_file)
+            cached = settings.passlog_cache_dir / f'{num}.log'
+            os.utime(cached, (num, num))
+
+        self.assertEqual(passlog_cache.evict(max_bytes=250), 1)
+        self.assertFalse((settings.passlog_cache_dir / '0.log').exists())
+        self.assertTrue((settings.passlog_cache_dir / '2.log').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
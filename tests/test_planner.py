@@ -0,0 +1,102 @@
+import sys
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+import planner
+
+
+movies = [{'id': 1, 'title': 'Alien Nation', 'release_date': '1988-10-07'},
+          {'id': 2, 'title': 'Alien', 'release_date': '1979-05-25'}]
+
+
+class TestPlanner(unittest.TestCase):
+    """Testing class for planner.py"""
+
+    def test_rank(self):
+        ranked = planner.rank('alien', movies)
+        self.assertEqual([movie['id'] for movie in ranked], [2, 1])
+        self.assertEqual(planner.rank('aliens', movies), movies)
+
+    def test_review_non_interactive(self):
+        ambiguous = {(True, 'alien'): planner.rank('alien', movies),
+                     (False, 'missing show'): []}
+        with mock.patch('builtins.input') as user_input:
+            chosen = planner.review(ambiguous, interactive=False)
+
+        user_input.assert_not_called()
+        self.assertEqual(chosen, {(True, 'alien'): movies[1]})
+
+    def test_review_retitle(self):
+        ambiguous = {(True, 'alein'): []}
+        searched = []
+
+        def search(query):
+            searched.append(query)
+            return [movies[1]]
+
+        with mock.patch('builtins.input', return_value='Alien'):
+            chosen = planner.review(ambiguous, search=search)
+
+        self.assertEqual(searched, [(True, 'Alien')])
+        self.assertEqual(chosen, {(True, 'alein'): movies[1]})
+
+    def test_review_invalid_choice(self):
+        ambiguous = {(True, 'alien'): movies}
+        with mock.patch('builtins.input', side_effect=['x', '2', '-1', '1']) as user_input:
+            chosen = planner.review(ambiguous)
+
+        self.assertEqual(user_input.call_count, 4)
+        self.assertEqual(chosen, {(True, 'alien'): movies[1]})
+
+    def test_group_plans(self):
+        files = ['Show A.s01e01.mkv', 'Show B.s02e01.mkv', 'show_a.s01e02.mkv',
+                 'Show B.s02e02.mkv', 'Show A.s02e01.mkv']
+        plans = [planner.FilePlan(file=Path(file), media_info=None,
+                                  title=file.partition('.')[0], is_movie=False,
+                                  season=file[-9:-7], episode=file[-6:-4])
+                 for file in files]
+        groups = planner.group_plans(plans)
+
+        self.assertEqual(list(groups), [(False, 'show a', '01'),
+                                        (False, 'show b', '02'),
+                                        (False, 'show a', '02')])
+        self.assertEqual(groups[(False, 'show a', '01')], [plans[0], plans[2]])
+
+    def test_resolve_imports_only_needed_lookups(self):
+        self.assertEqual(planner.resolve([]), [])
+
+        tmdb_lookup = mock.Mock()
+        tmdb_lookup.search_movies.return_value = [movies[1]]
+        tmdb_lookup.movie_metadata.return_value = ('Alien (1979)', 'Summary')
+        plan = planner.FilePlan(file=Path('Alien.mkv'), media_info=None,
+                                title='Alien', is_movie=True)
+
+        # a movie-only batch never loads the TheTVDB client
+        with mock.patch.dict(sys.modules, {'tmdb_lookup': tmdb_lookup}):
+            sys.modules.pop('thetvdb_lookup', None)
+            planner.resolve([plan], interactive=False)
+            self.assertNotIn('thetvdb_lookup', sys.modules)
+
+        self.assertEqual((plan.file_title, plan.error), ('Alien (1979)', ''))
+
+        thetvdb_lookup = mock.Mock()
+        thetvdb_lookup.search_show.return_value = [{'id': 7, 'seriesName': 'Show'}]
+        thetvdb_lookup.load_show.return_value = {'seriesName': 'Show'}
+        thetvdb_lookup.get_file_metadata.return_value = ('Show - S01E02 - Two', 'Summary')
+        plan = planner.FilePlan(file=Path('Show.s01e02.mkv'), media_info=None,
+                                title='Show', is_movie=False, season='01', episode='02')
+
+        # and a tv-only batch never loads the TMDb client
+        with mock.patch.dict(sys.modules, {'thetvdb_lookup': thetvdb_lookup}):
+            sys.modules.pop('tmdb_lookup', None)
+            planner.resolve([plan], interactive=False)
+            self.assertNotIn('tmdb_lookup', sys.modules)
+
+        thetvdb_lookup.load_show.assert_called_once_with(7)
+        self.assertEqual((plan.file_title, plan.error), ('Show - S01E02 - Two', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
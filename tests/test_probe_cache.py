@@ -0,0 +1,53 @@
+import os
+import unittest
+import tempfile
+
+from pathlib import Path
+
+import settings
+import probe_cache
+
+
+class TestProbeCache(unittest.TestCase):
+    """Testing class for probe_cache.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp_dir.name)
+        self.orig_cache_file = settings.probe_cache_file
+        settings.probe_cache_file = self.tmp_path / 'probe.sqlite'
+
+        self.media = self.tmp_path / 'show.s01e01.mkv'
+        self.media.write_bytes(b'\0' * 16)
+
+    def tearDown(self):
+        settings.probe_cache_file = self.orig_cache_file
+        probe_cache.refresh = False
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(probe_cache.get(self.media, 'ffprobe'))
+        probe_cache.put(self.media, 'ffprobe', '{}')
+        self.assertEqual(probe_cache.get(self.media, 'ffprobe'), '{}')
+        self.assertIsNone(probe_cache.get(self.media, 'cropdetect'))
+
+    def test_modified_file_misses(self):
+        probe_cache.put(self.media, 'ffprobe', '{}')
+        stat = os.stat(self.media)
+        os.utime(self.media, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIsNone(probe_cache.get(self.media, 'ffprobe'))
+
+    def test_refresh(self):
+        probe_cache.put(self.media, 'ffprobe', 'old')
+        probe_cache._refreshed.clear()
+        probe_cache.refresh = True
+        self.assertIsNone(probe_cache.get(self.media, 'ffprobe'))
+        probe_cache.put(self.media, 'ffprobe', 'new')
+        self.assertEqual(probe_cache.get(self.media, 'ffprobe'), 'new')
+
+    def test_evict(self):
+        probe_cache.put(self.media, 'ffprobe', 'x' * 100)
+        probe_cache.put(self.media, 'cropdetect', 'y' * 100)
+        self.assertEqual(probe_cache.evict(max_age_days=1, max_bytes=150), 1)
+        self.assertEqual(probe_cache.evict(max_age_days=-1), 1)
+        self.assertIsNone(probe_cache.get(self.media, 'cropdetect'))
@@ -0,0 +1,77 @@
+import sys
+import json
+import tempfile
+import unittest
+import contextvars
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import profiler
+import ffmpeg_runner
+
+
+busy_cmd = [sys.executable, '-c',
+            'import time\nend = time.time() + 0.6\nwhile time.time() < end: pass']
+
+
+class TestProfiler(unittest.TestCase):
+    """Testing class for profiler.py"""
+
+    def setUp(self):
+        profiler.enabled = True
+
+    def tearDown(self):
+        profiler.enabled = False
+
+    def test_disabled(self):
+        profiler.enabled = False
+        with profiler.title('movie.mp4') as title_profile:
+            self.assertIsNone(title_profile)
+        with profiler.stage('Opus Encode') as stage_profile:
+            self.assertIsNone(stage_profile)
+
+    def test_stages(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            out_file = Path(temp_dir) / 'out.opus'
+
+            with profiler.title('show.s01e01.webm') as title_profile:
+                with profiler.stage('Opus Encode', lambda: [out_file]):
+                    ffmpeg_runner.run(busy_cmd, title='Opus Pass', echo=False)
+                    out_file.write_bytes(b'x' * 100)
+
+                # threads started from a copied context share the title
+                with ThreadPoolExecutor() as executor:
+                    executor.submit(contextvars.copy_context().run,
+                                    self.run_stage, 'VP9 Encode').result()
+
+            # runs outside any stage are not recorded
+            ffmpeg_runner.run(busy_cmd, echo=False)
+
+            opus, vp9 = title_profile.stages
+            self.assertEqual(opus.name, 'Opus Encode')
+            self.assertEqual([run.title for run in opus.runs], ['Opus Pass'])
+            self.assertEqual(opus.output_bytes, 100)
+            self.assertGreater(opus.wall, 0.5)
+            self.assertEqual(len(vp9.runs), 1)
+            self.assertGreater(opus.user, 0.3)
+            self.assertGreater(opus.peak_rss, 0)
+
+            report_file = profiler.write_report(title_profile, temp_dir)
+            report = json.loads(report_file.read_text())
+            self.assertEqual([stage['name'] for stage in report['stages']],
+                             ['Opus Encode', 'VP9 Encode'])
+
+    def test_short_run_usage(self):
+        # exits well within one /proc sampling interval
+        short_cmd = [sys.executable, '-c',
+                     'import time\nend = time.process_time() + 0.1\n'
+                     'while time.process_time() < end: pass']
+        run_result = ffmpeg_runner.run(short_cmd, echo=False)
+
+        self.assertGreaterEqual(run_result.usage.user + run_result.usage.sys, 0.1)
+        self.assertGreater(run_result.usage.peak_rss, 0)
+
+    def run_stage(self, name):
+        with profiler.stage(name):
+            ffmpeg_runner.run(busy_cmd, echo=False)
@@ -0,0 +1,126 @@
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+import settings
+import wrapper
+import scheduler
+from tests.stub_case import StubCase
+
+
+class RecordingWrapper:
+    """Stand-in wrapper recording its thread share and
+    the peak number of concurrent encodes."""
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    threads = []
+
+    def __init__(self, in_file, cpu_threads, fail=False):
+        with RecordingWrapper.lock:
+            RecordingWrapper.active += 1
+            RecordingWrapper.peak = max(RecordingWrapper.peak, RecordingWrapper.active)
+            RecordingWrapper.threads.append(cpu_threads)
+        time.sleep(0.05)
+        with RecordingWrapper.lock:
+            RecordingWrapper.active -= 1
+        if fail:
+            raise RuntimeError('encode failed')
+
+
+class TestScheduler(unittest.TestCase):
+    """Testing class for scheduler.py"""
+
+    def setUp(self):
+        RecordingWrapper.active = 0
+        RecordingWrapper.peak = 0
+        RecordingWrapper.threads = []
+
+    def test_split_threads(self):
+        self.assertEqual(scheduler.split_threads('16', 1), '16')
+        self.assertEqual(scheduler.split_threads('16', 3), '5')
+        self.assertEqual(scheduler.split_threads('2', 4), '1')
+
+    def test_run_jobs(self):
+        jobs = [scheduler.Job(Path(f'show.s01e0{num}.mkv'), RecordingWrapper)
+                for num in range(5)]
+        failed = scheduler.run_jobs(jobs, max_jobs=2, cpu_threads='16')
+
+        self.assertEqual(failed, [])
+        self.assertEqual(RecordingWrapper.peak, 2)
+        self.assertEqual(RecordingWrapper.threads[:2], ['8', '8'])
+
+    def test_fewer_jobs_than_slots(self):
+        jobs = [scheduler.Job(Path(f'movie{num}.mkv'), RecordingWrapper)
+                for num in range(2)]
+        scheduler.run_jobs(jobs, max_jobs=4, cpu_threads='16')
+
+        self.assertEqual(RecordingWrapper.threads, ['8', '8'])
+
+    def test_failed_job_continues_batch(self):
+        jobs = [scheduler.Job(Path('a.mkv'), RecordingWrapper, dict(fail=True)),
+                scheduler.Job(Path('b.mkv'), RecordingWrapper)]
+        failed = scheduler.run_jobs(jobs, max_jobs=1, cpu_threads='4')
+
+        self.assertEqual(failed, [jobs[0]])
+        self.assertEqual(len(RecordingWrapper.threads), 2)
+
+    def test_scratch_preflight(self):
+        orig_wait = settings.scratch_wait
+        settings.scratch_wait = 0
+        self.addCleanup(setattr, settings, 'scratch_wait', orig_wait)
+
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            free = shutil.disk_usage(scratch_dir).free
+            jobs = [scheduler.Job(Path('a.mkv'), RecordingWrapper,
+                                  scratch_dir=Path(scratch_dir), scratch_bytes=free * 2),
+                    scheduler.Job(Path('b.mkv'), RecordingWrapper,
+                                  scratch_dir=Path(scratch_dir), scratch_bytes=1)]
+            self.assertFalse(scheduler.scratch_fits(jobs[0], []))
+            self.assertTrue(scheduler.scratch_fits(jobs[1], []))
+            self.assertFalse(scheduler.scratch_fits(jobs[1], [jobs[0]]))
+
+            failed = scheduler.run_jobs(jobs, max_jobs=2, cpu_threads='4')
+
+        self.assertEqual(failed, [jobs[0]])
+        self.assertEqual(RecordingWrapper.threads, ['4'])
+
+    def test_scratch_wait(self):
+        orig = settings.scratch_wait, settings.scratch_poll_interval
+        settings.scratch_wait, settings.scratch_poll_interval = 60, 0
+        self.addCleanup(setattr, settings, 'scratch_wait', orig[0])
+        self.addCleanup(setattr, settings, 'scratch_poll_interval', orig[1])
+
+        # space is freed by another program while the job waits
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            jobs = [scheduler.Job(Path('a.mkv'), RecordingWrapper,
+                                  scratch_dir=Path(scratch_dir), scratch_bytes=1)]
+            with mock.patch('scheduler.scratch_fits', side_effect=[False, False, True]):
+                failed = scheduler.run_jobs(jobs, max_jobs=1, cpu_threads='4')
+
+        self.assertEqual(failed, [])
+        self.assertEqual(RecordingWrapper.threads, ['4'])
+
+
+class TestSchedulerEncodes(StubCase):
+    """Jobs of real wrappers, run against stub_backend."""
+
+    def test_thread_share(self):
+        episode = self.tmp_path / 'Show.s01e02.mkv'
+        episode.write_bytes(b'\0' * 16)
+        jobs = [scheduler.Job(in_file, wrapper.TVStereoWrapper,
+                              dict(out_file=self.out_dir / in_file.name,
+                                   file_title='Title',
+                                   file_summary='Summary'))
+                for in_file in (self.media, episode)]
+        failed = scheduler.run_jobs(jobs, max_jobs=2, cpu_threads='16')
+
+        # each concurrent job encodes with its half of the budget
+        self.assertEqual(failed, [])
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2', '-threads 8'), 2)
+        self.assertEqual(self.backend.launches('ffmpeg', '-threads 16'), 0)
@@ -0,0 +1,42 @@
+import sys
+import unittest
+import subprocess
+
+from pathlib import Path
+
+
+webmify_dir = Path(__file__).resolve().parent.parent / 'webmify'
+
+# only needed once metadata is looked up
+heavy_modules = ['api_keys', 'requests', 'requests_cache',
+                 'thetvdb_lookup', 'tmdb_lookup', 'tmdbsimple', 'tvdb_api']
+
+check_script = f"""
+import sys
+import runpy
+
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path('webmify.py', run_name='__main__')
+except SystemExit:
+    pass
+print(' '.join(name for name in {heavy_modules!r} if name in sys.modules), file=sys.stderr)
+"""
+
+
+class TestStartup(unittest.TestCase):
+    """Testing that CLI startup avoids the metadata stack"""
+
+    def loaded_modules(self, *args):
+        comp_proc = subprocess.run([sys.executable, '-c', check_script, 'webmify.py', *args],
+                                   cwd=webmify_dir,
+                                   stdin=subprocess.DEVNULL,
+                                   capture_output=True,
+                                   text=True)
+        return comp_proc.stderr.strip().splitlines()[-1:]
+
+    def test_help(self):
+        self.assertEqual(self.loaded_modules('--help'), [])
+
+    def test_cache_list(self):
+        self.assertEqual(self.loaded_modules('cache', 'list'), [])
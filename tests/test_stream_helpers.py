@@ -0,0 +1,62 @@
+import unittest
+import subprocess
+
+from pathlib import Path
+from unittest import mock
+
+import stream_helpers
+from media_info import MediaInfo, StreamInfo
+
+
+class TestStreamHelpers(unittest.TestCase):
+    """Testing class for stream_helpers.py"""
+
+    def test_merge_crops(self):
+        # letterboxed 2.39:1 with a full height 1.78:1 sequence
+        crops = ['1920:800:0:140', '1920:1080:0:0', '1920:800:0:140']
+        self.assertEqual(stream_helpers.merge_crops(crops), '1920:1080:0:0')
+
+        crops = ['1920:800:0:140', '1904:816:8:132', '']
+        self.assertEqual(stream_helpers.merge_crops(crops), '1920:816:0:132')
+
+    def test_merge_crops_ignores_black_samples(self):
+        crops = ['1440:1072:240:4', '0:0:960:540']
+        self.assertEqual(stream_helpers.merge_crops(crops), '1440:1072:240:4')
+
+    def test_merge_crops_without_crops(self):
+        self.assertEqual(stream_helpers.merge_crops([]), '')
+        self.assertEqual(stream_helpers.merge_crops(['', '0:0:960:540']), '')
+
+    def test_estimate_scratch_bytes(self):
+        # a two hour, 40 GB UHD remux
+        remux = MediaInfo(file=Path('remux.mkv'), duration=7200.0, bit_rate=45_000_000,
+                          streams=(StreamInfo(0, 'video', width=3840, height=2160, frame_rate=24.0),
+                                   StreamInfo(1, 'audio', channels=6)))
+        estimate = stream_helpers.estimate_scratch_bytes(remux)
+        self.assertLess(estimate, 32 * 2**30)
+        self.assertLess(estimate, remux.bit_rate * remux.duration / 8)
+
+        # without the video intermediate only the audio is held
+        direct = stream_helpers.estimate_scratch_bytes(remux, direct_mux=True)
+        self.assertLess(direct, 2**30)
+
+        self.assertGreater(stream_helpers.estimate_scratch_bytes(remux, segments=4), estimate)
+        self.assertGreater(stream_helpers.estimate_scratch_bytes(remux, filter_once=True), estimate)
+
+        # scratch on the output's device also holds the muxed file
+        with_output = stream_helpers.estimate_scratch_bytes(remux, with_output=True)
+        self.assertGreater(with_output, estimate)
+        self.assertGreater(stream_helpers.estimate_scratch_bytes(remux, direct_mux=True,
+                                                                 with_output=True), direct)
+
+    def test_get_sub_type_probe_timeout(self):
+        timeout = subprocess.TimeoutExpired(['ffprobe'], 30)
+        with mock.patch('stream_helpers.probe', side_effect=timeout):
+            self.assertEqual(stream_helpers.get_sub_type(Path('show.srt'), '0'), 'subrip')
+
+    def test_get_vp9_tile_columns(self):
+        heights = [240, 480, 720, 1080, 1440, 2160]
+        answrs = ['0', '1', '2', '2', '3', '4']
+
+        for height, answr in zip(heights, answrs):
+            self.assertEqual(stream_helpers.get_vp9_tile_columns(height), answr)
@@ -0,0 +1,45 @@
+import unittest
+
+import settings
+import stream_object
+import stream_helpers
+from tests.stub_case import StubCase
+
+
+class TestStreamObject(StubCase):
+    """Testing class for stream_object.py"""
+
+    def test_stream_commands(self):
+        stream = stream_object.VP9Stream(self.surround, '0', crop=True, cpu_threads='8')
+        self.assertEqual(stream.filter_flags, ['-vf', 'crop=1920:800:0:140'])
+        self.assertEqual(stream.stream_maps, ['-map', '0:v:0'])
+        self.assertIn('-threads', stream.encoder_flags)
+        self.assertEqual(self.backend.launches('ffmpeg', 'cropdetect'), settings.crop_samples)
+
+        # crops are cached with the probe
+        stream_object.VP9Stream(self.surround, '0', crop=True)
+        self.assertEqual(self.backend.launches('ffmpeg'), settings.crop_samples)
+        self.assertEqual(self.backend.launches('ffprobe'), 1)
+
+    def test_stream_without_crop(self):
+        # ex. a black source, cropdetect reports nothing
+        self.backend.crop = ''
+        stream = stream_object.VP9Stream(self.surround, '0', crop=True)
+        self.assertIsNone(stream.filter_flags)
+        self.assertEqual(self.backend.launches('ffmpeg', 'cropdetect'), settings.crop_samples + 1)
+
+    def test_crop_samples(self):
+        stream_helpers.get_crop_dimns(self.surround)
+        duration = stream_helpers.probe(self.surround).duration
+
+        # keyframes only, at points spread across the whole source
+        crop_cmds = [cmd for cmd in self.backend.commands if 'cropdetect' in ' '.join(cmd)]
+        seeks = sorted(float(cmd[cmd.index('-ss') + 1]) for cmd in crop_cmds)
+        self.assertEqual(len(set(seeks)), settings.crop_samples)
+        self.assertTrue(all('nokey' in cmd for cmd in crop_cmds))
+        self.assertLess(seeks[0], duration * 0.1)
+        self.assertGreater(seeks[-1], duration * 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import sys
+import json
+import tempfile
+import unittest
+import contextvars
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import timeline
+import ffmpeg_runner
+
+
+class TestTimeline(unittest.TestCase):
+    """Testing class for timeline.py"""
+
+    def tearDown(self):
+        timeline.enabled = False
+
+    def test_disabled(self):
+        with timeline.span('Probe'):
+            pass
+        self.assertEqual(timeline.begin_run('Probe', ['ffprobe']), 0)
+
+    def test_trace(self):
+        timeline.start()
+        with timeline.span('Metadata Lookup', category='metadata'):
+            pass
+
+        with timeline.job('show.s01e01.mkv') as pid:
+            with ThreadPoolExecutor() as executor:
+                for name in ('VP9 Encode', 'Opus Encode'):
+                    executor.submit(contextvars.copy_context().run,
+                                    self.run_stage, name).result()
+            timeline.counter('VP9 Second Pass fps', 42.0)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_file = Path(temp_dir) / 'trace.json'
+            timeline.write(trace_file)
+            events = json.loads(trace_file.read_text())['traceEvents']
+
+        names = {(event['ph'], event['name']): event for event in events
+                 if event['ph'] != 'M'}
+        self.assertEqual(names[('X', 'Metadata Lookup')]['pid'], 0)
+        self.assertEqual(names[('X', 'VP9 Encode')]['pid'], pid)
+        self.assertEqual(names[('b', 'Stage Run')]['pid'], pid)
+        self.assertEqual(names[('C', 'VP9 Second Pass fps')]['args'], {'value': 42.0})
+
+        begins = [event for event in events if event['ph'] == 'b']
+        ends = [event for event in events if event['ph'] == 'e']
+        self.assertEqual(sorted(event['id'] for event in begins),
+                         sorted(event['id'] for event in ends))
+
+        process_names = [event['args']['name'] for event in events
+                         if event['ph'] == 'M' and event['name'] == 'process_name']
+        self.assertEqual(process_names, ['webmify batch', 'show.s01e01.mkv'])
+
+    def test_failed_launch(self):
+        timeline.start()
+        with self.assertRaises(OSError):
+            ffmpeg_runner.run(['/nonexistent/ffmpeg'], title='Missing Binary', echo=False)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_file = Path(temp_dir) / 'trace.json'
+            timeline.write(trace_file)
+            events = json.loads(trace_file.read_text())['traceEvents']
+
+        # the run span is closed, with the error
+        ends = [event for event in events if event['ph'] == 'e']
+        self.assertEqual([event['name'] for event in ends], ['Missing Binary'])
+        self.assertIn('error', ends[0]['args'])
+
+    def run_stage(self, name):
+        with timeline.span(name):
+            ffmpeg_runner.run([sys.executable, '-c', 'pass'], title='Stage Run', echo=False)
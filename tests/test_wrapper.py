@@ -0,0 +1,93 @@
+import threading
+import subprocess
+import unittest
+
+import wrapper
+from tests.stub_case import StubCase
+
+
+class TestWrapper(StubCase):
+    """Testing class for wrapper.py"""
+
+    def test_tv_stereo_wrapper(self):
+        tv_wrapper = self._wrap(wrapper.TVStereoWrapper, self.media)
+
+        self.assertEqual(self.backend.launches('ffprobe'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 1'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', 'libopus'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-c:v copy'), 1)
+        self.assertEqual(self.backend.launches(), 5)
+
+        # intermediates are removed once muxed
+        self.assertEqual(list(self.out_dir.iterdir()), [tv_wrapper.out_file])
+
+        # first pass statistics are reused
+        tv_wrapper.out_file.unlink()
+        self._wrap(wrapper.TVStereoWrapper, self.media)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 1'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2'), 2)
+
+    def test_failure_cleanup(self):
+        # the subtitle stage fails to probe its source
+        self.backend.default_probe = None
+        sub_file = self.tmp_path / 'broken.srt'
+        sub_file.touch()
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._wrap(wrapper.TVMultiChannelSubtitleWrapper, self.surround,
+                       sub_file=sub_file)
+
+        # the finished stages' outputs are removed
+        self.assertEqual(list(self.out_dir.iterdir()), [])
+
+    def test_concurrent_stages(self):
+        audio_started = threading.Event()
+        run = self.backend.run
+
+        def overlapping_run(cmd):
+            # the video first pass only finishes once the audio
+            # stage has started, as it cannot when run in turn
+            command_line = ' '.join(cmd)
+            if 'libopus' in command_line:
+                audio_started.set()
+            elif '-pass 1' in command_line and not audio_started.wait(5):
+                return 1, '', ['audio stage did not start']
+            return run(cmd)
+
+        self.backend.run = overlapping_run
+        tv_wrapper = self._wrap(wrapper.TVStereoWrapper, self.media)
+
+        self.assertTrue(tv_wrapper.out_file.exists())
+        self.assertFalse(tv_wrapper.cancel.is_set())
+
+    def test_surround_subtitle_wrapper(self):
+        tv_wrapper = self._wrap(wrapper.TVMultiChannelSubtitleWrapper, self.surround,
+                                sub_file=self.surround)
+
+        self.assertEqual(self.backend.launches('ffprobe'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', 'print_format=json'), 1)
+        # surround and downmix share one demux
+        self.assertEqual(self.backend.launches('ffmpeg', 'asplit=2'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg', 'webvtt'), 1)
+        self.assertEqual(self.backend.launches('ffmpeg'), 6)
+        self.assertEqual(list(self.out_dir.iterdir()), [tv_wrapper.out_file])
+
+    def test_direct_mux(self):
+        tv_wrapper = self._wrap(wrapper.TVStereoWrapper, self.media, direct_mux=True)
+
+        self.assertEqual(self.backend.launches('ffmpeg', '-c:v copy'), 0)
+        self.assertEqual(self.backend.launches('ffmpeg'), 3)
+        # the second pass muxes the audio into the output itself
+        self.assertEqual(self.backend.launches('ffmpeg', '-pass 2', '.audio.opus', '.part.webm'), 1)
+        self.assertEqual(list(self.out_dir.iterdir()), [tv_wrapper.out_file])
+
+    def test_chromecast_ignores_direct_mux(self):
+        cast_wrapper = self._wrap(wrapper.ChromecastWrapper, self.media, direct_mux=True)
+
+        self.assertIsNone(cast_wrapper.video_stream.mux)
+        self.assertEqual(self.backend.launches('ffmpeg', '-c:v copy'), 1)
+        self.assertEqual(list(self.out_dir.iterdir()), [cast_wrapper.out_file])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import settings
+
+import os
+import json
+import time
+import shutil
+import threading
+from pathlib import Path, PurePath
+from typing import Dict, List
+
+
+enabled = False
+"""When True, encode stages store their outputs and reuse
+them when the same stage is run again. Set by --cache."""
+
+_manifest = 'manifest.json'
+# held while entries are moved into place or evicted
+_lock = threading.Lock()
+
+
+def _entry(cache_key: str) -> Path:
+    return settings.artifact_cache_dir / cache_key
+
+
+def _size(entry: Path) -> int:
+    return sum(item.stat().st_size for item in entry.iterdir())
+
+
+def _link_or_copy(src: PurePath, dst: PurePath) -> None:
+    """Hard link dst to src, or copy it where they are on
+    different devices or links are unsupported.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def restore(cache_key: str, out_files: List[PurePath]) -> bool:
+    """Hard link, or copy, the stored outputs of a stage
+    to out_files. Returns False on a miss.
+
+    Parameters:
+    cache_key - from EncodeObject._artifact_key()
+    out_files - every file the stage writes, in order
+    """
+    entry = _entry(cache_key)
+    try:
+        with open(entry / _manifest) as manifest:
+            outputs = json.load(manifest)['outputs']
+    except (OSError, ValueError, KeyError):
+        return False
+
+    if len(outputs) != len(out_files):
+        return False
+
+    try:
+        for name, out_file in zip(outputs, out_files):
+            partial = Path(f'{out_file}.part')
+            partial.unlink(missing_ok=True)
+            _link_or_copy(entry / name, partial)
+            os.replace(partial, out_file)
+        os.utime(entry / _manifest)
+    except OSError as err:
+        print(f'Artifact cache not used: {err}')
+        return False
+
+    return True
+
+
+def store(cache_key: str, out_files: List[PurePath], description: str = '') -> None:
+    """Store the outputs of a finished stage, hard linked
+    where the cache is on their device, then trim the cache
+    to settings.artifact_cache_max_bytes. Failures to write
+    the cache are not fatal to an encode.
+
+    Parameters:
+    cache_key - from EncodeObject._artifact_key()
+    out_files - every file the stage wrote, in order
+    description - shown by 'webmify cache list'
+    """
+    entry = _entry(cache_key)
+    partial = entry.with_suffix('.part')
+    try:
+        shutil.rmtree(partial, ignore_errors=True)
+        partial.mkdir(parents=True)
+
+        outputs = []
+        for num, out_file in enumerate(out_files):
+            name = f'{num}{PurePath(out_file).suffix}'
+            _link_or_copy(out_file, partial / name)
+            outputs.append(name)
+
+        with open(partial / _manifest, 'w') as manifest:
+            json.dump({'outputs': outputs,
+                       'description': description,
+                       'created': time.time()}, manifest)
+
+        with _lock:
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(partial, entry)
+    except OSError as err:
+        shutil.rmtree(partial, ignore_errors=True)
+        print(f'Artifact cache not updated: {err}')
+        return
+
+    evict()
+
+
+def entries() -> List[Dict]:
+    """Every stored stage, least recently used first, as
+    dicts of key, description, size and last use time.
+    """
+    found = []
+    try:
+        for entry in settings.artifact_cache_dir.iterdir():
+            manifest_file = entry / _manifest
+            if entry.suffix == '.part' or not manifest_file.exists():
+                continue
+            with open(manifest_file) as manifest:
+                description = json.load(manifest).get('description', '')
+            found.append({'key': entry.name,
+                          'description': description,
+                          'size': _size(entry),
+                          'accessed': manifest_file.stat().st_mtime})
+    except (OSError, ValueError):
+        pass
+
+    return sorted(found, key=lambda found_entry: found_entry['accessed'])
+
+
+def evict(max_bytes: int = None) -> int:
+    """Remove the least recently used stages until the
+    cache fits in max_bytes. Returns the number removed.
+    Concurrent jobs evict one at a time.
+
+    Parameters:
+    max_bytes - defaults to settings.artifact_cache_max_bytes
+    """
+    if max_bytes is None:
+        max_bytes = settings.artifact_cache_max_bytes
+
+    with _lock:
+        stored = entries()
+        total = sum(entry['size'] for entry in stored)
+        removed = 0
+        for entry in stored:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(_entry(entry['key']), ignore_errors=True)
+            total -= entry['size']
+            removed += 1
+
+    return removed
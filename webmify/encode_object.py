@@ -1,21 +1,81 @@
 import settings
+import profiler
+import timeline
+import probe_cache
+import artifact_cache
+import passlog_cache
 import stream_object
+import ffmpeg_runner
 import stream_helpers
+from journal import Journal, stage_key
+from media_info import MediaInfo
 
 import re
-import subprocess
+import json
+import math
+import threading
+import contextvars
 from pathlib import Path, PurePath
-from typing import List, Tuple
+from typing import Callable, Dict, List, Pattern, Tuple
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 
-ffmpeg_bin = settings.ffmpeg_bin
+# the loudnorm json, one value per stderr line
+_loudnorm_re = re.compile('"(?:input_i" : "(?P<input_i>.+?)'
+                          '|input_tp" : "(?P<input_tp>.+?)'
+                          '|input_lra" : "(?P<input_lra>.+?)'
+                          '|input_thresh" : "(?P<input_thresh>.+?)'
+                          '|target_offset" : "(?P<target_offset>.+?)'
+                          '|output_lra" : "(?P<output_lra>.+?))"')
+
+
+# flags following the per-job thread share, see _stream_flags
+_thread_flags = {'-threads', '-tile-columns'}
+
+
+class EncodeError(RuntimeError):
+    """Raised when an ffmpeg stage exits unsuccessfully."""
+
+
+class EncodeCancelled(EncodeError):
+    """Raised when an ffmpeg stage is stopped by its cancel
+    event, ex. because a sibling stage failed."""
 
 
 @dataclass
 class EncodeObject(ABC):
     """Abstract Class for accumulating and
     constructing encoding parameters.
+
+    media_info is the probe result for in_file. When
+    supplied it is handed to the stream so the source
+    is not probed again.
+
+    extra_outputs are further (audio stream, filename)
+    renditions of in_file written by the same ffmpeg
+    invocation. The source is demuxed once and asplit
+    between every output reading the same stream.
+
+    mux, when set, is called just before the stage's final
+    write and returns (input flags, output flags) adding
+    further files to it, so that write produces the muxed
+    mux_file directly. Only the video stages honor it.
+
+    With a journal, a stage whose outputs were recorded by
+    an earlier, interrupted run is skipped, and each stage
+    is recorded once its outputs are complete.
+
+    With artifact_cache enabled, a stage that was run before
+    on the same source with the same flags hard links, or
+    copies, its stored outputs instead of encoding. Earlier
+    outputs are unlinked before encoding, as ffmpeg would
+    otherwise truncate a linked cache entry in place.
+
+    Every ffmpeg run goes through ffmpeg_runner. Its result
+    is kept as run_result; encode_capture, when set, is
+    searched on every stderr line, which is then not echoed.
+    Setting cancel stops the running ffmpeg.
     """
 
     in_file: PurePath
@@ -24,7 +84,13 @@ class EncodeObject(ABC):
     stream_id: str = '0'
     work_title: str = ''
     encode_cmd: List[str] = field(default_factory=list)
-    encode_capture: bool = False
+    encode_capture: Pattern = None
+    media_info: MediaInfo = None
+    extra_outputs: List[Tuple[stream_object.AudioStream, PurePath]] = field(default_factory=list)
+    mux: Callable[[], Tuple[List[str], List[str]]] = None
+    mux_file: PurePath = ''
+    journal: Journal = None
+    cancel: threading.Event = None
 
     def __post_init__(self):
         if not isinstance(self.in_file, PurePath):
@@ -37,15 +103,128 @@ class EncodeObject(ABC):
             self.out_file = Path(self.out_file)
 
         self._set_stream()
-        self._do_encode()
-        self._clean_up()
+        if self.journal is not None:
+            self.stage_key = self._stage_key()
+            if self.journal.is_done(self.stage_key):
+                print(f'\n\nSkipping: {self.work_title} Encode, finished by an earlier run')
+                return
+
+        artifact_key = None
+        if artifact_cache.enabled and self._cacheable():
+            artifact_key = self._artifact_key()
+
+        if artifact_key and artifact_cache.restore(artifact_key, self.outputs()):
+            print(f'\n\nReusing: {self.work_title} Encode, from the artifact cache')
+        else:
+            for out_file in self.outputs():
+                Path(out_file).unlink(missing_ok=True)
+
+            stage_name = f'{self.work_title} Encode'
+            with profiler.stage(stage_name, self.outputs), timeline.span(stage_name):
+                try:
+                    self._do_encode()
+                except BaseException:
+                    self._remove_outputs()
+                    raise
+                with timeline.span(f'{self.work_title} Clean-up'):
+                    self._clean_up()
+            if artifact_key:
+                artifact_cache.store(artifact_key, self.outputs(),
+                                     f'{self.work_title}: {self.in_file.name}')
+
+        if self.journal is not None:
+            self.journal.record(self.stage_key, self.outputs())
 
     @abstractmethod
     def _set_stream(self):
         pass
 
+    def _stream_flags(self) -> List[List[str]]:
+        """Flags of every stream written. Thread counts, and
+        the VP9 tile columns derived from them, are left out,
+        as they vary with the number of running jobs.
+        """
+        streams = [self.stream] + [stream for stream, _ in self.extra_outputs]
+        stream_flags = []
+        for stream in streams:
+            for flags in (stream.filter_flags, stream.stream_maps,
+                          stream.encoder_flags, stream.metadata):
+                flags = list(flags or [])
+                stream_flags.append([flag for num, flag in enumerate(flags)
+                                     if not _thread_flags.intersection(flags[max(0, num - 1):num + 1])])
+        return stream_flags
+
+    def _stage_key(self) -> str:
+        """Journal key covering the source, outputs and flags."""
+        return stage_key(type(self).__name__,
+                         probe_cache.file_key(self.in_file),
+                         [str(out_file) for out_file in self.outputs()],
+                         self._stream_flags())
+
+    def _artifact_key(self) -> str:
+        """Artifact cache key covering the source, any burned
+        subtitle file and flags, but not where the outputs are
+        written.
+        """
+        parts = [type(self).__name__, probe_cache.file_key(self.in_file), self._stream_flags()]
+        if getattr(self, 'burn_subs', False):
+            parts.append(probe_cache.file_key(self.sub_file))
+
+        return stage_key(*parts)
+
+    def _cacheable(self) -> bool:
+        # a stage muxing other files writes nothing reusable alone
+        return self.mux is None
+
+    def _graph_cmd(self) -> List[str]:
+        """Build one command writing the stream and every extra
+        output from a shared filter graph.
+        """
+        outputs = [(self.stream, self.out_file)] + self.extra_outputs
+
+        input_labels = {}
+        for stream_id in dict.fromkeys(stream.stream_id for stream, _ in outputs):
+            output_nums = [num for num, (stream, _) in enumerate(outputs)
+                           if stream.stream_id == stream_id]
+            input_labels[stream_id] = [f'[in{num}]' for num in output_nums]
+
+        graph = [f"[0:a:{stream_id}]asplit={len(labels)}{''.join(labels)}"
+                 for stream_id, labels in input_labels.items()]
+        for num, (stream, _) in enumerate(outputs):
+            graph.append(f'[in{num}]{stream.filter_chain}[out{num}]')
+
+        encode_cmd = [settings.ffmpeg_bin, '-y', '-i', f'{self.in_file}',
+                      '-filter_complex', ';'.join(graph)]
+        for num, (stream, out_file) in enumerate(outputs):
+            encode_cmd += ['-map', f'[out{num}]']
+            if stream.encoder_flags:
+                encode_cmd += stream.encoder_flags
+            if stream.metadata:
+                encode_cmd += stream.metadata
+            encode_cmd += [f'{out_file}']
+
+        return encode_cmd
+
+    def outputs(self) -> List[PurePath]:
+        """Every file written by this stage."""
+        return [self.out_file] + [out_file for _, out_file in self.extra_outputs]
+
+    def _remove_outputs(self) -> None:
+        """Delete what a failed or cancelled encode wrote."""
+        for out_file in self.outputs():
+            if Path(out_file).exists():
+                print(f'Deleting partial output: {out_file}')
+                Path(out_file).unlink()
+
     def _do_encode(self) -> None:
-        self.encode_cmd = [f'{ffmpeg_bin}', '-i', f'{self.in_file}']
+        if self.extra_outputs:
+            self.encode_cmd = self._graph_cmd()
+            self._run_encode()
+            return
+
+        mux_inputs, mux_outputs = self.mux() if self.mux else ([], [])
+
+        self.encode_cmd = [settings.ffmpeg_bin, '-y', '-i', f'{self.in_file}'] + mux_inputs
         if self.stream.filter_flags:
             self.encode_cmd += self.stream.filter_flags
         if self.stream.stream_maps:
@@ -54,117 +233,144 @@ class EncodeObject(ABC):
             self.encode_cmd += self.stream.encoder_flags
         if self.stream.metadata:
             self.encode_cmd += self.stream.metadata
-        self.encode_cmd += [f'{self.out_file}']
-
-        print(f'\n\nRunning: {self.work_title} Encode')
-        print(f"Command: {' '.join(str(element) for element in self.encode_cmd)}\n")
-        self.comp_proc = subprocess.run(self.encode_cmd,
-                                        capture_output=self.encode_capture,
-                                        text=True)
+        self.encode_cmd += mux_outputs + [f'{self.out_file}']
+        self._run_encode()
+
+    def _run_encode(self) -> None:
+        self.run_result = self._run_cmd(f'{self.work_title} Encode', self.encode_cmd,
+                                        capture=self.encode_capture)
+
+    def _run_cmd(self, title: str, encode_cmd: List[str],
+                 capture: Pattern = None) -> ffmpeg_runner.RunResult:
+        print(f'\n\nRunning: {title}')
+        print(f"Command: {' '.join(str(element) for element in encode_cmd)}\n")
+        run_result = ffmpeg_runner.run(encode_cmd,
+                                       title=title,
+                                       progress=True,
+                                       capture=capture,
+                                       echo=capture is None,
+                                       timeout=settings.encode_timeout,
+                                       cancel=self.cancel)
+        self._check_proc(run_result)
+        return run_result
+
+    def _check_proc(self, run_result: ffmpeg_runner.RunResult = None) -> None:
+        """Stages may run concurrently, so failures are raised
+        rather than exiting, letting the caller clean up.
+        """
+        if run_result is None:
+            run_result = self.run_result
+
+        if run_result.cancelled:
+            raise EncodeCancelled(f'{self.work_title} encode cancelled for {self.in_file}')
+
+        if run_result.returncode != 0:
+            reason = 'timed out' if run_result.timed_out else f'exit status {run_result.returncode}'
+            last_line = run_result.stderr_tail[-1] if run_result.stderr_tail else ''
+            raise EncodeError(f'{self.work_title} encode failed for {self.in_file} '
+                              f'(ffmpeg {reason}): {last_line}')
 
     def _clean_up(self) -> None:
         pass
 
 
 @dataclass
-class AACNormalizedDownmixEncode(EncodeObject):
+class NormalizedDownmixEncode(EncodeObject, ABC):
+    """Abstract Class for loudness normalized stereo encodes.
+
+    The source is measured with NormalizeFirstPassEncode. While
+    the predicted output LRA stays above 17, the normalized
+    signal is measured again, up to settings.loudnorm_max_passes.
+    The final encode applies every pass in one filter graph
+    feeding the encoder, so no PCM intermediate is written.
+    """
+    norm_passes: List[Dict[str, str]] = field(default_factory=list)
+
+    def _measure(self):
+        # measurements are kept in the probe cache, keyed by
+        # the passes already applied
+        self.norm_passes = []
+        while True:
+            kind = f'loudnorm:a:{self.stream_id}:{json.dumps(self.norm_passes)}'
+            cached = probe_cache.get(self.in_file, kind)
+            if cached is not None:
+                measured = json.loads(cached)
+            else:
+                measured = NormalizeFirstPassEncode(in_file=self.in_file,
+                                                    out_file=self.out_file,
+                                                    stream_id=self.stream_id,
+                                                    media_info=self.media_info,
+                                                    norm_passes=list(self.norm_passes),
+                                                    cancel=self.cancel).measured
+                probe_cache.put(self.in_file, kind, json.dumps(measured))
+            self.norm_passes.append(measured)
+
+            if (float(measured['output_lra']) <= 17.0 or
+                    len(self.norm_passes) >= settings.loudnorm_max_passes):
+                break
+
+
+@dataclass
+class AACNormalizedDownmixEncode(NormalizedDownmixEncode):
     def _set_stream(self):
-        self.norm_second_encode = NormalizeSecondPassEncode(in_file=self.in_file,
-                                                            out_file=self.out_file,
-                                                            stream_id=self.stream_id)
+        self._measure()
 
         self.work_title = 'AAC Normalized Downmix'
-        self.in_file = self.norm_second_encode.out_file
         self.out_file = self.out_file.with_suffix('.norm.aac.mkv')
         self.stream = stream_object.AACNormalizedDownmixStream(in_file=self.in_file,
-                                                               stream_id='0')
-
-    def _clean_up(self):
-        if self.norm_second_encode.out_file.exists():
-            self.norm_second_encode.out_file.unlink()
+                                                               stream_id=self.stream_id,
+                                                               norm_passes=self.norm_passes,
+                                                               media_info=self.media_info)
 
 
 @dataclass
 class NormalizeFirstPassEncode(EncodeObject):
+    """Loudness measurement. Results are available as
+    measured, the loudnorm json, and the norm_* attributes.
+    The json is picked out of stderr line by line, as
+    ffmpeg writes it.
+
+    norm_passes are earlier measurements applied before
+    this one is taken.
+    """
+    norm_passes: List[Dict[str, str]] = field(default_factory=list)
+
     def _set_stream(self):
-        self.stream_channels = stream_helpers.get_audio_ch(self.in_file, self.stream_id)
-        if int(self.stream_channels) > 2:
-            self.downmix_encode = StereoDownmixEncode(in_file=self.in_file,
-                                                      out_file=self.out_file,
-                                                      stream_id=self.stream_id)
-            self.in_file = self.downmix_encode.out_file
-
-        self.encode_capture = True
+        self.encode_capture = _loudnorm_re
         self.work_title = 'Normalization First Pass'
         self.stream = stream_object.NormalizedFirstPassStream(self.in_file,
-                                                              self.stream_id)
-
-    def _get_norm_i(self):
-        norm_i_re = re.compile('\"input_i\" : \"(.+?)\"')
-        self.norm_i = norm_i_re.search(self.comp_proc.stderr).groups()[0]
-
-    def _get_norm_tp(self):
-        norm_tp_re = re.compile('\"input_tp\" : \"(.+?)\"')
-        self.norm_tp = norm_tp_re.search(self.comp_proc.stderr).groups()[0]
+                                                              self.stream_id,
+                                                              norm_passes=self.norm_passes,
+                                                              media_info=self.media_info)
 
-    def _get_norm_lra(self):
-        norm_lra_re = re.compile('\"input_lra\" : \"(.+?)\"')
-        self.norm_lra = norm_lra_re.search(self.comp_proc.stderr).groups()[0]
+    def _cacheable(self):
+        # the result is the measurement, not an output file
+        return False
 
-        out_lra_re = re.compile('\"output_lra\" : \"(.+?)\"')
-        self.out_lra = out_lra_re.search(self.comp_proc.stderr).groups()[0]
-
-    def _get_norm_thresh(self):
-        norm_thresh_re = re.compile('\"input_thresh\" : \"(.+?)\"')
-        self.norm_thresh = norm_thresh_re.search(self.comp_proc.stderr).groups()[0]
-
-    def _get_norm_offset(self):
-        norm_offset_re = re.compile('\"target_offset\" : \"(.+?)\"')
-        self.norm_offset = norm_offset_re.search(self.comp_proc.stderr).groups()[0]
+    def outputs(self):
+        # -f null, nothing is written
+        return []
 
     def _clean_up(self):
-        self._get_norm_i()
-        self._get_norm_tp()
-        self._get_norm_lra()
-        self._get_norm_thresh()
-        self._get_norm_offset()
-
-
-@dataclass
-class NormalizeSecondPassEncode(EncodeObject):
-    def _set_stream(self):
-        self.norm_first_encode = NormalizeFirstPassEncode(in_file=self.in_file,
-                                                          out_file=self.out_file,
-                                                          stream_id=self.stream_id)
-
-        self.work_title = 'Normalization Second Pass'
-        self.in_file = self.norm_first_encode.in_file
-        self.out_file = self.out_file.with_suffix('.norm.mkv')
-        self.stream = stream_object.NormalizedSecondPassStream(self.norm_first_encode.in_file,
-                                                               self.stream_id,
-                                                               norm_i=self.norm_first_encode.norm_i,
-                                                               norm_tp=self.norm_first_encode.norm_tp,
-                                                               norm_lra=self.norm_first_encode.norm_lra,
-                                                               norm_thresh=self.norm_first_encode.norm_thresh,
-                                                               norm_tar_off=self.norm_first_encode.norm_offset)
-
-    def _clean_up(self):
-        try:
-            self.norm_first_encode.downmix_encode.out_file.unlink()
-        except:
-            pass
-
-        self.cur_lra = self.norm_first_encode.out_lra
-        if float(self.cur_lra) > 17.0:
-            self.old_name = self.out_file.with_suffix('.old.mkv')
-            self.out_file.rename(self.old_name)
-
-            NormalizeSecondPassEncode(in_file=self.old_name,
-                                      out_file=self.out_file.parent / self.out_file.stem,
-                                      stream_id=self.stream_id)
-
-            if self.old_name.exists():
-                self.old_name.unlink()
+        captured = self.run_result.captured
+        missing = [name for name in _loudnorm_re.groupindex if name not in captured]
+        if missing:
+            raise EncodeError(f'{self.work_title} found no {", ".join(missing)} '
+                              f'for {self.in_file}')
+
+        self.norm_i = captured['input_i']
+        self.norm_tp = captured['input_tp']
+        self.norm_lra = captured['input_lra']
+        self.norm_thresh = captured['input_thresh']
+        self.norm_offset = captured['target_offset']
+        self.out_lra = captured['output_lra']
+
+        self.measured = {'input_i': self.norm_i,
+                         'input_tp': self.norm_tp,
+                         'input_lra': self.norm_lra,
+                         'input_thresh': self.norm_thresh,
+                         'target_offset': self.norm_offset,
+                         'output_lra': self.out_lra}
 
 
 @dataclass
@@ -173,34 +379,39 @@ class OpusEncode(EncodeObject):
         self.work_title = 'Opus'
         self.out_file = self.out_file.with_suffix('.audio.opus')
         self.stream = stream_object.OpusStream(in_file=self.in_file,
-                                               stream_id=self.stream_id)
+                                               stream_id=self.stream_id,
+                                               media_info=self.media_info)
 
 
 @dataclass
-class OpusNormalizedDownmixEncode(EncodeObject):
+class OpusNormalizedDownmixEncode(NormalizedDownmixEncode):
     def _set_stream(self):
-        self.norm_second_encode = NormalizeSecondPassEncode(in_file=self.in_file,
-                                                            out_file=self.out_file,
-                                                            stream_id=self.stream_id)
+        self._measure()
 
         self.work_title = 'Opus Normalized Downmix'
-        self.in_file = self.norm_second_encode.out_file
         self.out_file = self.out_file.with_suffix('.norm.opus')
-        self.stream = stream_object.OpusNormalizedDownmixStream(in_file=self.norm_second_encode.out_file,
-                                                                stream_id='0')
-
-    def _clean_up(self):
-        if self.norm_second_encode.out_file.exists():
-            self.norm_second_encode.out_file.unlink()
+        self.stream = stream_object.OpusNormalizedDownmixStream(in_file=self.in_file,
+                                                                stream_id=self.stream_id,
+                                                                norm_passes=self.norm_passes,
+                                                                media_info=self.media_info)
 
 
 @dataclass
-class StereoDownmixEncode(EncodeObject):
+class SurroundOpusNormalizedDownmixEncode(OpusNormalizedDownmixEncode):
+    """Opus of the source stream as-is, and the normalized
+    Opus downmix, written by one ffmpeg invocation.
+
+    The surround rendition is available as surround_file.
+    """
     def _set_stream(self):
-        self.work_title = 'Stereo Downmix'
-        self.out_file = self.out_file.with_suffix('.downmix.mkv')
-        self.stream = stream_object.StereoDownmixStream(self.in_file,
-                                                        self.stream_id)
+        self.surround_file = self.out_file.with_suffix('.audio.opus')
+        surround_stream = stream_object.OpusStream(in_file=self.in_file,
+                                                   stream_id=self.stream_id,
+                                                   media_info=self.media_info)
+        self.extra_outputs = [(surround_stream, self.surround_file)]
+
+        super()._set_stream()
+        self.work_title = 'Opus Surround and Normalized Downmix'
 
 
 ###################################
@@ -229,6 +440,7 @@ class WebVTTEncode(EncodeObject):
 @dataclass
 class ChromecastEncode(EncodeObject):
     burn_subs: bool = False
+    cpu_threads: str = settings.cpu_threads
     crf: str = '19'
     crop: bool = True
     denoise: bool = False
@@ -236,64 +448,317 @@ class ChromecastEncode(EncodeObject):
 
     def _set_stream(self):
         self.work_title = 'Chromecast Video'
-        self.out_file = self.out_file.with_suffix('.x264.mkv')
+        if self.mux is None:
+            self.out_file = self.out_file.with_suffix('.x264.mkv')
+        else:
+            self.out_file = Path(self.mux_file)
         self.stream = stream_object.ChromecastStream(self.in_file,
                                                      self.stream_id,
                                                      burn_subs=self.burn_subs,
+                                                     cpu_threads=self.cpu_threads,
                                                      crf=self.crf,
                                                      crop=self.crop,
                                                      denoise=self.denoise,
-                                                     sub_file=self.sub_file)
+                                                     sub_file=self.sub_file,
+                                                     media_info=self.media_info)
 
 
 @dataclass
 class VP9Encode(EncodeObject):
+    """Two-pass VP9 encode.
+
+    With segments > 1 the source is split at keyframes
+    into that many chunks, each chunk is two-pass encoded
+    concurrently with an even share of cpu_threads, and
+    the chunks are losslessly concatenated. The first chunk
+    to fail sets cancel, stopping the others. A source with
+    fewer keyframes than segments is encoded whole.
+
+    With mux set, the second pass (or the concatenation)
+    writes mux_file, muxed with the mux inputs. Pass logs,
+    chunks and other intermediates stay beside out_file.
+
+    With filter_once, the video filter chain is rendered a
+    single time to a lossless FFV1 intermediate, which every
+    pass (and chunk) then reads unfiltered.
+
+    First pass statistics are kept in passlog_cache and
+    reused when the source, stream, seek, filters and
+    encoder flags other than crf and the thread flags all
+    match.
+    """
     burn_subs: bool = False
+    cpu_threads: str = settings.cpu_threads
     crf: str = '19'
     crop: bool = False
     denoise: bool = False
+    filter_once: bool = False
+    segments: int = 0
     sub_file: PurePath = ''
 
     def _set_stream(self):
+        self.work_title = 'VP9'
         self.out_file = self.out_file.with_suffix('.vp9.webm')
         self.logfile = self.out_file.parent / self.out_file.stem
+        if self.mux is not None:
+            self.out_file = Path(self.mux_file)
+
+        # Subtitles are timed against the whole source, so
+        # they cannot be burned into seeked chunks.
+        if self.segments > 1 and self.burn_subs:
+            print('\nSegmented encoding disabled: burned subtitles need a single encode.')
+            self.segments = 0
+
+        stream_threads = self.cpu_threads
+        if self.segments > 1:
+            stream_threads = str(max(1, int(self.cpu_threads) // self.segments))
+        self._set_vp9_stream(stream_threads)
+
+        self.chunks = []
+        self.filtered_file = None
+        if self.filter_once and not self.stream.filter_flags:
+            self.filter_once = False
+
+    def _set_vp9_stream(self, cpu_threads: str) -> None:
         self.stream = stream_object.VP9Stream(self.in_file,
                                               self.stream_id,
                                               burn_subs=self.burn_subs,
+                                              cpu_threads=cpu_threads,
                                               crf=self.crf,
                                               crop=self.crop,
                                               denoise=self.denoise,
-                                              sub_file=self.sub_file)
+                                              sub_file=self.sub_file,
+                                              media_info=self.media_info)
+
+    def _scratch_file(self, suffix: str) -> PurePath:
+        # intermediates are named after the pass log, which
+        # stays beside out_file even when muxing elsewhere
+        return self.logfile.parent / (self.logfile.name + suffix)
+
+    def _render_filtered(self) -> None:
+        """Write the filtered video losslessly to filtered_file,
+        for the passes to read in place of in_file.
+        """
+        self.filtered_file = self._scratch_file('.filtered.mkv')
+        if self.journal is not None:
+            render_key = stage_key(self.stage_key, 'filtered')
+            if self.journal.is_done(render_key):
+                print('\n\nSkipping: VP9 Filter Render, finished by an earlier run')
+                return
+
+        encode_cmd = [settings.ffmpeg_bin, '-y', '-i', f'{self.in_file}']
+        encode_cmd += self.stream.filter_flags
+        encode_cmd += self.stream.stream_maps
+        encode_cmd += ['-c:v', 'ffv1', '-level', '3', '-g', '1',
+                       '-threads', self.cpu_threads, f'{self.filtered_file}']
+        self._run_cmd('VP9 Filter Render', encode_cmd)
+
+        if self.journal is not None:
+            self.journal.record(render_key, [self.filtered_file])
+
+    def _pass_cmd(self, pass_num: str, logfile: PurePath, out_file: PurePath,
+                  seek: List[str] = None,
+                  mux_args: Tuple[List[str], List[str]] = ([], [])) -> List[str]:
+        mux_inputs, mux_outputs = mux_args
+
+        encode_cmd = [settings.ffmpeg_bin, '-y']
+        if seek:
+            encode_cmd += seek
+        if self.filtered_file:
+            encode_cmd += ['-i', f'{self.filtered_file}'] + mux_inputs
+            encode_cmd += ['-map', '0:v:0']
+        else:
+            encode_cmd += ['-i', f'{self.in_file}'] + mux_inputs
+            if self.stream.filter_flags:
+                encode_cmd += self.stream.filter_flags
+            encode_cmd += self.stream.stream_maps
+        encode_cmd += self.stream.encoder_flags
+        encode_cmd += self.stream.metadata
+        encode_cmd += mux_outputs
+        encode_cmd += ['-pass', pass_num, '-f', 'webm', '-passlogfile',
+                       logfile, '-strict', 'experimental', f'{out_file}']
+        return encode_cmd
+
+    def _first_pass(self, title: str, logfile: PurePath, seek: List[str] = None) -> None:
+        """Run the first pass, or restore its statistics
+        from the cache.
+        """
+        flags = self.stream.encoder_flags
+        parts = [self.stream_id, seek, self.stream.filter_flags]
+        parts += [f'{option} {value}' for option, value in zip(flags[::2], flags[1::2])
+                  if option != '-crf' and option not in _thread_flags]
+        if self.burn_subs:
+            parts.append(probe_cache.file_key(self.sub_file))
+
+        cache_key = passlog_cache.key(self.in_file, parts)
+        log_file = logfile.parent / (logfile.name + '-0.log')
+        if passlog_cache.get(cache_key, log_file):
+            print(f'\n\n{title}: reusing cached statistics')
+            return
+
+        self.encode_cmd = self._pass_cmd('1', logfile, '/dev/null', seek)
+        self._run_cmd(title, self.encode_cmd)
+        passlog_cache.put(cache_key, log_file)
 
     def _do_encode(self):
-        self.encode_cmd = [f'{ffmpeg_bin}', '-y', '-i', f'{self.in_file}']
-        if self.stream.filter_flags:
-            self.encode_cmd += self.stream.filter_flags
-        self.encode_cmd += self.stream.stream_maps
-        self.encode_cmd += self.stream.encoder_flags
-        self.encode_cmd += self.stream.metadata
-        self.encode_cmd += ['-pass', '1', '-f', 'webm', '-passlogfile',
-                            self.logfile, '-strict',
-                            'experimental', '/dev/null']
-
-        print('\n\nRunning: VP9 First Pass')
-        print(f"Command: {' '.join(str(element) for element in self.encode_cmd)}\n")
-        self.comp_proc = subprocess.run(self.encode_cmd)
-
-        self.encode_cmd = [f'{ffmpeg_bin}', '-i', f'{self.in_file}']
-        if self.stream.filter_flags:
-            self.encode_cmd += self.stream.filter_flags
-        self.encode_cmd += self.stream.stream_maps
-        self.encode_cmd += self.stream.encoder_flags
-        self.encode_cmd += self.stream.metadata
-        self.encode_cmd += ['-pass', '2', '-f', 'webm', '-passlogfile',
-                            self.logfile, '-strict',
-                            'experimental', f'{self.out_file}']
-
-        print('\n\nRunning: VP9 Second Pass')
-        print(f"Command: {' '.join(str(element) for element in self.encode_cmd)}\n")
-        self.comp_proc = subprocess.run(self.encode_cmd)
+        if self.filter_once:
+            self._render_filtered()
+
+        if self.segments > 1:
+            self.chunks = self._get_chunks()
+            if self.chunks:
+                self._do_segmented_encode()
+                return
+
+            # ex. a stream with no keyframe flags, encoded whole
+            # with the threads the chunks would have shared
+            print('\nSegmented encoding disabled: too few keyframes to split at.')
+            self.segments = 0
+            self._set_vp9_stream(self.cpu_threads)
+
+        self._first_pass('VP9 First Pass', self.logfile)
+
+        self.encode_cmd = self._pass_cmd('2', self.logfile, self.out_file,
+                                         mux_args=self.mux() if self.mux else ([], []))
+        self.run_result = self._run_cmd('VP9 Second Pass', self.encode_cmd)
+
+    def _get_chunks(self) -> List[Tuple[float, float, int]]:
+        """Split the source at the keyframes closest to evenly
+        spaced points. Returns (start, end, frame count) per
+        chunk, with times relative to the container start, or
+        [] if there are fewer keyframes than segments.
+        """
+        media_info = self.stream.media_info
+        packets = [(pts - media_info.start_time, is_key) for pts, is_key in
+                   stream_helpers.get_video_packets(self.in_file, self.stream_id)]
+        keyframes = [pts for pts, is_key in packets if is_key]
+        if len(keyframes) < self.segments:
+            return []
+
+        starts = [0.0]
+        for num in range(1, self.segments):
+            target = media_info.duration * num / self.segments
+            keyframe = min(keyframes, key=lambda pts: abs(pts - target))
+            if keyframe > starts[-1]:
+                starts.append(keyframe)
+
+        ends = starts[1:] + [math.inf]
+        return [(start, end, sum(1 for pts, _ in packets if start <= pts < end))
+                for start, end in zip(starts, ends)]
+
+    def _encode_chunk(self, chunk_num: int, start: float, end: float) -> PurePath:
+        # Seek just before the chunk's keyframe and stop just
+        # before the next one, so each frame lands in one chunk.
+        epsilon = 0.001
+        seek = ['-ss', f'{max(0.0, start - epsilon):.6f}']
+        if end != math.inf:
+            seek += ['-t', f'{end - max(0.0, start - epsilon) - epsilon:.6f}']
+
+        chunk_file = self._scratch_file(f'.chunk{chunk_num:03d}.webm')
+        logfile = self._scratch_file(f'.chunk{chunk_num:03d}')
+
+        if self.journal is not None:
+            chunk_key = stage_key(self.stage_key, chunk_num, start, end)
+            if self.journal.is_done(chunk_key):
+                print(f'\n\nSkipping: VP9 Chunk {chunk_num}, finished by an earlier run')
+                return chunk_file
+
+        self._first_pass(f'VP9 First Pass - Chunk {chunk_num}', logfile, seek)
+        self._run_cmd(f'VP9 Second Pass - Chunk {chunk_num}',
+                      self._pass_cmd('2', logfile, chunk_file, seek))
+
+        if self.journal is not None:
+            self.journal.record(chunk_key, [chunk_file])
+
+        return chunk_file
+
+    def _do_segmented_encode(self):
+        self.concat_list = self._scratch_file('.chunks.txt')
+
+        # a failed chunk stops its siblings, as a failed stage does
+        if self.cancel is None:
+            self.cancel = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=len(self.chunks)) as executor:
+            # each chunk keeps the stage's context, for the profiler
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       self._encode_chunk, chunk_num, start, end)
+                       for chunk_num, (start, end, _) in enumerate(self.chunks)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            if any(future.exception() is not None for future in done):
+                self.cancel.set()
+                for future in futures:
+                    future.cancel()
+
+        # chunks stopped by cancel are reported after the cause
+        failures = sorted((future.exception() for future in futures
+                           if not future.cancelled() and future.exception() is not None),
+                          key=lambda error: isinstance(error, EncodeCancelled))
+        if failures:
+            raise failures[0]
+        self.chunk_files = [future.result() for future in futures]
+
+        with open(self.concat_list, 'w') as concat_list:
+            for chunk_file in self.chunk_files:
+                concat_list.write(f"file '{Path(chunk_file).resolve()}'\n")
+
+        mux_inputs, mux_outputs = self.mux() if self.mux else ([], [])
+        if self.mux:
+            mux_outputs = ['-map', '0:0'] + mux_outputs
+
+        self.encode_cmd = [settings.ffmpeg_bin, '-y', '-f', 'concat', '-safe', '0',
+                           '-i', f'{self.concat_list}'] + mux_inputs
+        self.encode_cmd += ['-c', 'copy'] + mux_outputs + [f'{self.out_file}']
+        self.run_result = self._run_cmd('VP9 Chunk Concatenation', self.encode_cmd)
+
+        expected_frames = sum(frames for _, _, frames in self.chunks)
+        chunk_frames = sum(stream_helpers.count_packets(chunk_file, '0')
+                           for chunk_file in self.chunk_files)
+        out_frames = stream_helpers.count_packets(self.out_file, '0')
+
+        if not expected_frames == chunk_frames == out_frames:
+            raise EncodeError(f'VP9 chunk frame count mismatch for {self.in_file}: '
+                              f'source {expected_frames}, chunks {chunk_frames}, '
+                              f'concatenated {out_frames}')
+
+    def _journaled(self, *parts) -> bool:
+        # parts of a key derived from stage_key, set with a journal
+        return self.journal is not None and self.journal.is_done(stage_key(self.stage_key, *parts))
+
+    def _remove_outputs(self) -> None:
+        """Also delete the pass logs, chunks and filtered
+        render of a failed encode, except the chunks and render
+        recorded in the journal, which the next run resumes
+        from.
+        """
+        super()._remove_outputs()
+
+        intermediates = [self._scratch_file('-0.log'), self._scratch_file('.chunks.txt')]
+        if self.filtered_file and not self._journaled('filtered'):
+            intermediates.append(self.filtered_file)
+        for chunk_num, (start, end, _) in enumerate(self.chunks):
+            intermediates.append(self._scratch_file(f'.chunk{chunk_num:03d}-0.log'))
+            if not self._journaled(chunk_num, start, end):
+                intermediates.append(self._scratch_file(f'.chunk{chunk_num:03d}.webm'))
+
+        for intermediate in intermediates:
+            if intermediate.exists():
+                print(f'Deleting intermediate file: {intermediate}')
+                intermediate.unlink()
 
     def _clean_up(self):
-        self.logfile = self.logfile.parent / (self.logfile.name + f'-{self.stream_id}.log')
+        if self.filtered_file:
+            self.filtered_file.unlink()
+
+        if self.segments > 1:
+            self.concat_list.unlink()
+            for chunk_num, chunk_file in enumerate(self.chunk_files):
+                chunk_file.unlink()
+                # chunks resumed from the journal have no log
+                logfile = self._scratch_file(f'.chunk{chunk_num:03d}-0.log')
+                logfile.unlink(missing_ok=True)
+            return
+
+        # named by output stream index, the video is always output 0
+        self.logfile = self._scratch_file('-0.log')
         self.logfile.unlink()
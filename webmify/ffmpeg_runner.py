@@ -0,0 +1,392 @@
+import settings
+import profiler
+import timeline
+
+import os
+import re
+import sys
+import time
+import signal
+import asyncio
+import resource
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Pattern
+
+
+progress_flags = ['-progress', 'pipe:1', '-nostats']
+
+_line_re = re.compile(rb'[\r\n]+')
+_max_line = 64 * 1024
+_poll_interval = 0.2
+_stop_grace = 5
+
+backend = None
+"""When set, commands are handed to backend.run(cmd), which
+returns (returncode, stdout, stderr lines), instead of
+launching a process, ex. stub_backend.StubBackend."""
+
+
+class RunCancelled(RuntimeError):
+    """Raised by RunResult.check for a run stopped by its
+    cancel event."""
+
+
+@dataclass
+class Progress:
+    """One ffmpeg -progress report.
+
+    Attributes:
+        frame: frames written so far
+        fps: encoding frames per second
+        speed: encoding speed relative to playback
+        out_time: seconds of output written
+        total_size: bytes of output written
+        done: this is the final report
+    """
+    frame: int = 0
+    fps: float = 0.0
+    speed: float = 0.0
+    out_time: float = 0.0
+    total_size: int = 0
+    done: bool = False
+
+
+@dataclass
+class ProcessUsage:
+    """Resources used by one process. CPU time is the
+    rusage wait4 reports once it exits, so short runs are
+    counted in full. Peak RSS and storage I/O are sampled
+    from /proc while it runs, and topped up from the same
+    rusage.
+
+    Attributes:
+        user: user cpu seconds
+        sys: system cpu seconds
+        peak_rss: peak resident set size, bytes
+        read_bytes: bytes read from storage, not the page cache
+        write_bytes: bytes written to storage
+    """
+    user: float = 0.0
+    sys: float = 0.0
+    peak_rss: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+
+@dataclass
+class RunResult:
+    """Outcome of one ffmpeg or ffprobe run.
+
+    Attributes:
+        cmd: command run, including progress flags
+        returncode: exit status, negative if killed by a signal
+        elapsed: wall time, in seconds
+        stdout: the whole of stdout, when captured
+        stderr_tail: the last settings.runner_tail_lines stderr lines
+        captured: named groups of the capture pattern, last match wins
+        progress: the last progress report, None without progress
+        usage: resources used by the process
+        timed_out: killed after the timeout
+        cancelled: killed by the cancel event
+    """
+    cmd: List[str]
+    returncode: int = None
+    elapsed: float = 0.0
+    stdout: str = ''
+    stderr_tail: List[str] = field(default_factory=list)
+    captured: Dict[str, str] = field(default_factory=dict)
+    progress: Progress = None
+    usage: ProcessUsage = field(default_factory=ProcessUsage)
+    timed_out: bool = False
+    cancelled: bool = False
+
+    def check(self) -> 'RunResult':
+        """Return self if the run succeeded. Otherwise raise
+        RunCancelled, or TimeoutExpired or CalledProcessError
+        as subprocess.check_output would.
+        """
+        if self.cancelled:
+            raise RunCancelled(f'Cancelled: {" ".join(self.cmd)}')
+
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.cmd, self.elapsed,
+                                            output=self.stdout,
+                                            stderr='\n'.join(self.stderr_tail))
+
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.cmd,
+                                                output=self.stdout,
+                                                stderr='\n'.join(self.stderr_tail))
+        return self
+
+
+def _float(value: str) -> float:
+    try:
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+async def _lines(stream: asyncio.StreamReader) -> AsyncIterator[str]:
+    """Yield lines as they are written, split on newlines
+    and carriage returns. Lines longer than _max_line are
+    truncated, so memory stays bounded however much the
+    process writes.
+    """
+    pending = b''
+    while True:
+        chunk = await stream.read(_max_line)
+        if not chunk:
+            break
+        lines = _line_re.split(pending + chunk)
+        pending = lines.pop()[:_max_line]
+        for line in lines:
+            yield line[:_max_line].decode(errors='replace')
+
+    if pending:
+        yield pending.decode(errors='replace')
+
+
+def _stderr_line(line: str, result: RunResult, tail: deque,
+                 capture: Pattern, echo: bool) -> None:
+    tail.append(line)
+    if capture is not None:
+        found = capture.search(line)
+        if found:
+            result.captured.update({name: value for name, value in found.groupdict().items()
+                                    if value is not None})
+    if echo:
+        print(line, file=sys.stderr)
+
+
+async def _read_stderr(stream: asyncio.StreamReader, result: RunResult, tail: deque,
+                       capture: Pattern, echo: bool) -> None:
+    async for line in _lines(stream):
+        _stderr_line(line, result, tail, capture, echo)
+
+
+async def _read_progress(stream: asyncio.StreamReader, result: RunResult, title: str,
+                         echo: bool, on_progress: Callable[[Progress], None]) -> None:
+    # each report is a block of key=value lines ending with progress=
+    report = {}
+    last_print = time.monotonic()
+    async for line in _lines(stream):
+        key, _, value = line.partition('=')
+        report[key.strip()] = value.strip()
+        if key != 'progress':
+            continue
+
+        progress = Progress(frame=int(_float(report.get('frame'))),
+                            fps=_float(report.get('fps')),
+                            speed=_float(report.get('speed')),
+                            out_time=_float(report.get('out_time_us')) / 1e6,
+                            total_size=int(_float(report.get('total_size'))),
+                            done=value.strip() == 'end')
+        report = {}
+        result.progress = progress
+        timeline.counter(f'{title} fps', progress.fps)
+        if on_progress is not None:
+            on_progress(progress)
+
+        if echo and (progress.done or
+                     time.monotonic() - last_print >= settings.runner_progress_interval):
+            last_print = time.monotonic()
+            print(f'{title}: {time.strftime("%H:%M:%S", time.gmtime(progress.out_time))} '
+                  f'frame={progress.frame} fps={progress.fps:.1f} speed={progress.speed:.2f}x')
+
+
+def _sample(pid: int, usage: ProcessUsage) -> None:
+    """Update peak RSS and I/O from /proc/<pid>. Counters
+    only grow, so the latest readable sample is kept.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    usage.peak_rss = int(line.split()[1]) * 1024
+
+        with open(f'/proc/{pid}/io') as io_file:
+            counters = dict(line.split(': ') for line in io_file.read().splitlines())
+        usage.read_bytes = int(counters['read_bytes'])
+        usage.write_bytes = int(counters['write_bytes'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+
+def _add_rusage(rusage: 'resource.struct_rusage', usage: ProcessUsage) -> None:
+    """Take CPU time from the rusage of the exited process,
+    and the final peak RSS and I/O where no sample saw them.
+    """
+    usage.user = rusage.ru_utime
+    usage.sys = rusage.ru_stime
+    # kilobytes, and 512 byte blocks, on Linux
+    usage.peak_rss = max(usage.peak_rss, rusage.ru_maxrss * 1024)
+    usage.read_bytes = max(usage.read_bytes, rusage.ru_inblock * 512)
+    usage.write_bytes = max(usage.write_bytes, rusage.ru_oublock * 512)
+
+
+async def _pipe_reader(pipe) -> asyncio.StreamReader:
+    """Wrap a pipe of the process in a StreamReader."""
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+async def _read_stdout(stream: asyncio.StreamReader, result: RunResult) -> None:
+    result.stdout = (await stream.read()).decode(errors='replace')
+
+
+async def _stop(pid: int, waiter: asyncio.Future) -> None:
+    """Terminate pid, killing it if it outlives _stop_grace."""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        await asyncio.wait_for(asyncio.shield(waiter), _stop_grace)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        os.kill(pid, signal.SIGKILL)
+    await waiter
+
+
+async def _run_process(cmd: List[str], result: RunResult, tail: deque, title: str,
+                       progress: bool, stdout: bool, capture: Pattern, echo: bool,
+                       timeout: float, cancel: threading.Event,
+                       on_progress: Callable[[Progress], None]) -> None:
+    """Launch cmd and read its output until it exits, or is
+    stopped by timeout or cancel. See run_async.
+
+    The process is reaped with wait4 on a worker thread,
+    rather than by asyncio, to get its own rusage. It is
+    signalled by pid and never polled through proc, which
+    would reap it first.
+    """
+    result_start = time.monotonic()
+    proc = subprocess.Popen(cmd,
+                            stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE if progress or stdout else None,
+                            stderr=subprocess.PIPE)
+    waiter = asyncio.get_running_loop().run_in_executor(None, os.wait4, proc.pid, 0)
+
+    readers = [asyncio.ensure_future(_read_stderr(await _pipe_reader(proc.stderr),
+                                                  result, tail, capture, echo))]
+    if progress:
+        readers.append(asyncio.ensure_future(_read_progress(await _pipe_reader(proc.stdout),
+                                                            result, title, echo, on_progress)))
+    elif stdout:
+        readers.append(asyncio.ensure_future(_read_stdout(await _pipe_reader(proc.stdout),
+                                                          result)))
+
+    try:
+        while not waiter.done():
+            _sample(proc.pid, result.usage)
+            await asyncio.wait({waiter}, timeout=_poll_interval)
+            if waiter.done():
+                break
+            if timeout is not None and time.monotonic() - result_start > timeout:
+                result.timed_out = True
+            elif cancel is not None and cancel.is_set():
+                result.cancelled = True
+            else:
+                continue
+            await _stop(proc.pid, waiter)
+
+        await asyncio.gather(*readers)
+    except asyncio.CancelledError:
+        result.cancelled = True
+        for reader in readers:
+            reader.cancel()
+        await _stop(proc.pid, waiter)
+        raise
+    finally:
+        if waiter.done():
+            # Popen must not wait for the reaped pid itself
+            _, status, rusage = waiter.result()
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            _add_rusage(rusage, result.usage)
+
+    result.returncode = proc.returncode
+
+
+async def run_async(cmd: List[str], title: str = '', progress: bool = False,
+                    stdout: bool = False, capture: Pattern = None, echo: bool = True,
+                    timeout: float = None, cancel: threading.Event = None,
+                    on_progress: Callable[[Progress], None] = None) -> RunResult:
+    """Run cmd and return its RunResult. stderr, and the
+    progress reports, are parsed line by line as they are
+    written; only a short tail of stderr is kept.
+
+    If the awaiting task is cancelled, the process is
+    stopped before CancelledError propagates.
+
+    Parameters:
+    cmd - command, elements are converted to str
+    title - name used in progress lines, profiles and traces
+    progress - add progress_flags, ffmpeg only, and parse the reports
+    stdout - capture the whole of stdout, not with progress
+    capture - regex searched on every stderr line, see RunResult.captured
+    echo - print stderr lines and, every settings.runner_progress_interval, progress
+    timeout - seconds before the process is killed, None for no limit
+    cancel - event which, once set, stops the process
+    on_progress - called with every Progress report
+    """
+    if progress and stdout:
+        raise ValueError('progress reports are written to stdout')
+
+    cmd = [str(element) for element in cmd]
+    if progress:
+        cmd = cmd[:1] + progress_flags + cmd[1:]
+
+    result = RunResult(cmd=cmd)
+    title = title or os.path.basename(cmd[0])
+    tail = deque(maxlen=settings.runner_tail_lines)
+    start = time.monotonic()
+
+    run_id = timeline.begin_run(title, cmd)
+    run_args = {}
+    try:
+        if backend is not None:
+            result.returncode, backend_stdout, stderr_lines = backend.run(cmd)
+            for line in stderr_lines:
+                _stderr_line(line, result, tail, capture, echo)
+            if stdout:
+                result.stdout = backend_stdout
+        else:
+            await _run_process(cmd, result, tail, title, progress, stdout, capture, echo,
+                               timeout, cancel, on_progress)
+        run_args['returncode'] = result.returncode
+    except asyncio.CancelledError:
+        run_args['cancelled'] = True
+        raise
+    except Exception as error:
+        # ex. OSError launching a missing binary
+        run_args['error'] = str(error)
+        raise
+    finally:
+        timeline.end_run(title, run_id, **run_args)
+
+    result.elapsed = time.monotonic() - start
+    result.stderr_tail = list(tail)
+    profiler.record(title, result)
+    return result
+
+
+def run(cmd: List[str], **kwargs) -> RunResult:
+    """Run cmd to completion on an event loop of the calling
+    thread, see run_async. Safe to call from worker threads.
+    """
+    return asyncio.run(run_async(cmd, **kwargs))
+
+
+def run_all(cmds: List[List[str]], **kwargs) -> List[RunResult]:
+    """Run every command concurrently on one event loop,
+    without a thread per process, and return their
+    results in order. See run_async.
+    """
+    async def gather():
+        return await asyncio.gather(*[run_async(cmd, **kwargs) for cmd in cmds])
+
+    return asyncio.run(gather())
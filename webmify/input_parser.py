@@ -1,9 +1,20 @@
 import re
 
 from typing import Tuple
+from functools import lru_cache
 from pathlib import Path, PurePath
 
 
+# title, season and episode in one pass; each part is
+# an optional lookahead from the start, so every part
+# is matched anywhere in the name, as with re.search
+_name_re = re.compile(r'^(?:(?=(?P<title>.+?)[(.]))?'
+                      r'(?:(?=.*?\W[s,S](?P<season>[0-9]+)))?'
+                      r'(?:(?=.*?\d[e,E](?P<episode>[0-9]+)))?',
+                      re.DOTALL)
+_separator_re = re.compile(r'[\s._-]+')
+
+
 def check_strip_path(file: str) -> str:
     """Format input to string.
     Input may be Path() or str. Return only
@@ -15,6 +26,29 @@ def check_strip_path(file: str) -> str:
         return Path(file).name
 
 
+def _pad(number: str) -> str:
+    if number and int(number) < 10 and number[0] != '0':
+        return '0' + number
+
+    return number
+
+
+@lru_cache(maxsize=4096)
+def parse_name(name: str) -> Tuple[str, str, str]:
+    """Return (title, season, episode) parsed from a base
+    filename with a single regex match. Season and episode
+    are zero padded, '' if none found.
+
+    Parameters:
+    name -- base filename, without directories
+    """
+    found = _name_re.match(name)
+
+    return (found['title'] or name,
+            _pad(found['season'] or ''),
+            _pad(found['episode'] or ''))
+
+
 def get_title(file: str) -> str:
     """Return the base filename, assumed
     to be the media title.
@@ -22,12 +56,17 @@ def get_title(file: str) -> str:
     Parameters:
     file -- Either string or Path() filename
     """
-    file = check_strip_path(file)
+    return parse_name(check_strip_path(file))[0]
 
-    title_re = re.compile(r'^(.+?)[(.]')
-    title_found = title_re.search(file).groups()[0]
 
-    return title_found
+def normalize_title(title: str) -> str:
+    """Return title in a form equal for every spelling
+    of the same series, ex. 'The_Show ' and 'the show'.
+
+    Parameters:
+    title -- title as parsed by get_title
+    """
+    return ' '.join(_separator_re.split(title.casefold())).strip()
 
 
 def get_season(file: str) -> str:
@@ -37,20 +76,7 @@ def get_season(file: str) -> str:
     Parameters:
     file -- Either string or Path() filename
     """
-    file = check_strip_path(file)
-
-    season_re = re.compile(r'\W[s,S]([0-9]+)')
-    season_groups = season_re.search(file)
-
-    if season_groups is None:
-        season_found = ''
-    else:
-        season_found = season_groups.groups()[0]
-
-        if int(season_found) < 10 and season_found[0] != '0':
-            season_found = '0' + season_found
-
-    return season_found
+    return parse_name(check_strip_path(file))[1]
 
 
 def get_episode(file: str) -> str:
@@ -60,20 +86,7 @@ def get_episode(file: str) -> str:
     Parameters:
     file -- Either string or Path() filename
     """
-    file = check_strip_path(file)
-
-    episode_re = re.compile('\d[e,E]([0-9]+)')
-    episode_groups = episode_re.search(file)
-
-    if episode_groups is None:
-        episode_found = ''
-    else:
-        episode_found = episode_groups.groups()[0]
-
-        if int(episode_found) < 10 and episode_found[0] != '0':
-            episode_found = '0' + episode_found
-
-    return episode_found
+    return parse_name(check_strip_path(file))[2]
 
 
 def get_out_file(file: str, suffix: str) -> str:
@@ -102,16 +115,3 @@ def is_movie(file: str) -> bool:
     else:
         return False
 
-
-def is_batch_repeat(file1: str, file2: str) -> bool:
-    """Given two inputs, file1 and file2, return
-    true if the parsed titles are equivalent.
-    """
-    
-    if not file1 or not file2:
-        return False
-
-    title1 = get_title(file1)
-    title2 = get_title(file2)
-
-    return title1 == title2
@@ -0,0 +1,122 @@
+import settings
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path, PurePath
+from typing import Dict, List
+from dataclasses import dataclass, field
+
+_checksum_bytes = 1024 * 1024
+
+
+def checksum(out_file: PurePath) -> str:
+    """Quick checksum of a finished output: its size and a
+    blake2b of the first and last MiB. Enough to tell a
+    complete file from a truncated or replaced one without
+    reading multi-GB video.
+
+    Parameters:
+    out_file - filename
+    """
+    size = os.path.getsize(out_file)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(out_file, 'rb') as data:
+        digest.update(data.read(_checksum_bytes))
+        if size > _checksum_bytes:
+            data.seek(max(_checksum_bytes, size - _checksum_bytes))
+            digest.update(data.read())
+
+    return f'{size}:{digest.hexdigest()}'
+
+
+def stage_key(*parts) -> str:
+    """Hash of everything that determines a stage's output,
+    ex. stage name, source identity and ffmpeg flags.
+    """
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def output_path(out_file: PurePath) -> Path:
+    """Journal location for one output, independent of the
+    rest of the batch, so a rerun with a different work
+    list still resumes it.
+
+    Parameters:
+    out_file - output the wrapper writes, or its input if unset
+    """
+    digest = hashlib.sha256(str(Path(out_file).resolve()).encode()).hexdigest()
+    return settings.journal_dir / f'{digest[:32]}.jsonl'
+
+
+@dataclass
+class Journal:
+    """Append-only JSONL record of finished stages.
+
+    Each line holds a stage key and the checksum of every
+    file the stage wrote. Lines are flushed and fsynced as
+    they are written, and a line cut short by a crash is
+    ignored when the journal is read back.
+
+    Attributes:
+        path: journal file
+        entries: stage key: {output path: checksum}
+    """
+    path: Path
+    entries: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry['stage']] = entry['outputs']
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, key: str) -> bool:
+        """True if the stage was recorded and every output
+        it wrote is still present and unchanged.
+
+        Parameters:
+        key - from stage_key()
+        """
+        outputs = self.entries.get(key)
+        if outputs is None:
+            return False
+
+        try:
+            return all(checksum(out_file) == out_sum
+                       for out_file, out_sum in outputs.items())
+        except OSError:
+            return False
+
+    def record(self, key: str, out_files: List[PurePath]) -> None:
+        """Record a finished stage.
+
+        Parameters:
+        key - from stage_key()
+        out_files - every file the stage wrote
+        """
+        outputs = {str(out_file): checksum(out_file) for out_file in out_files}
+        line = json.dumps({'stage': key, 'outputs': outputs}) + '\n'
+
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(line)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            self.entries[key] = outputs
+
+    def remove(self) -> None:
+        """Discard the journal, once its output has finished."""
+        with self._lock:
+            if self.path.exists():
+                self.path.unlink()
+            self.entries.clear()
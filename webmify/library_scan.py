@@ -0,0 +1,112 @@
+import settings
+import input_parser
+
+import os
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List
+
+
+@dataclass(frozen=True)
+class ScanEntry:
+    """One source file found by a library scan.
+
+    Attributes:
+        path: path to the source, as found by os.scandir
+        title: title parsed from the filename
+        season: tv season number, '' for movies
+        episode: tv episode number, '' for movies
+        size: bytes
+        mtime: modification time, seconds since the epoch
+    """
+    path: str
+    title: str
+    season: str
+    episode: str
+    size: int
+    mtime: float
+
+    @property
+    def file(self) -> Path:
+        return Path(self.path)
+
+    @property
+    def is_movie(self) -> bool:
+        return not self.season and not self.episode
+
+
+def _walk(root: str) -> Iterator[os.DirEntry]:
+    """Yield every regular file below root, skipping hidden
+    files and directories, such as partial outputs.
+    Symlinked directories are not followed.
+    """
+    pending = [root]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as dir_entries:
+                for dir_entry in dir_entries:
+                    if dir_entry.name.startswith('.'):
+                        continue
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        pending.append(dir_entry.path)
+                    elif dir_entry.is_file():
+                        yield dir_entry
+        except (PermissionError, FileNotFoundError) as err:
+            print(f'Skipping unreadable directory: {err.filename}')
+
+
+def scan(root: str) -> List[ScanEntry]:
+    """Return every encodable source below root, ordered
+    by title, season and episode, so each series is queued
+    together.
+
+    Parameters:
+    root - library directory, string or Path()
+    """
+    # Path() construction dominates large scans, so plain
+    # paths are kept until an entry is used
+    entries = []
+    for dir_entry in _walk(os.fspath(root)):
+        name = dir_entry.name
+        if name.lower().endswith(settings.scan_skip_suffixes):
+            continue
+        if os.path.splitext(name)[1].lower() not in settings.scan_suffixes:
+            continue
+
+        title, season, episode = input_parser.parse_name(name)
+        stat = dir_entry.stat()
+        entries.append(ScanEntry(path=dir_entry.path,
+                                 title=title,
+                                 season=season,
+                                 episode=episode,
+                                 size=stat.st_size,
+                                 mtime=stat.st_mtime))
+
+    normalized = {entry.title: input_parser.normalize_title(entry.title)
+                  for entry in entries}
+    entries.sort(key=lambda entry: (normalized[entry.title],
+                                    entry.season, entry.episode, entry.path))
+    return entries
+
+
+def index(entries: List[ScanEntry]) -> Dict:
+    """Return the scan as a JSON ready index of movies, and
+    of shows by season, with file counts and total size.
+
+    Parameters:
+    entries - as returned by scan
+    """
+    movies = []
+    shows = {}
+    for entry in entries:
+        record = asdict(entry)
+        if entry.is_movie:
+            movies.append(record)
+        else:
+            show = shows.setdefault(input_parser.normalize_title(entry.title), {})
+            show.setdefault(entry.season, []).append(record)
+
+    return {'files': len(entries),
+            'bytes': sum(entry.size for entry in entries),
+            'movies': movies,
+            'shows': shows}
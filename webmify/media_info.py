@@ -0,0 +1,123 @@
+from pathlib import PurePath
+from typing import Tuple
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class StreamInfo:
+    """Immutable description of a single stream,
+    as reported by ffprobe.
+
+    Attributes:
+        index: absolute stream index within the container
+        codec_type: 'audio', 'video', 'subtitle', ...
+        codec_name: ex. 'h264', 'dts', 'subrip'
+        channels: audio channel count, 0 otherwise
+        language: 3 letter language code, '' if untagged
+        width: video width, 0 otherwise
+        height: video height, 0 otherwise
+        color_space: video color space, ex. 'bt2020nc'
+        frame_rate: average video frame rate, 0 otherwise
+    """
+    index: int
+    codec_type: str
+    codec_name: str = ''
+    channels: int = 0
+    language: str = ''
+    width: int = 0
+    height: int = 0
+    color_space: str = ''
+    frame_rate: float = 0.0
+
+    @classmethod
+    def from_ffprobe(cls, stream: dict) -> 'StreamInfo':
+        """Build from one entry of ffprobe's 'streams' list."""
+        return cls(index=int(stream.get('index', 0)),
+                   codec_type=stream.get('codec_type', ''),
+                   codec_name=stream.get('codec_name', ''),
+                   channels=int(stream.get('channels', 0)),
+                   language=stream.get('tags', {}).get('language', ''),
+                   width=int(stream.get('width', 0)),
+                   height=int(stream.get('height', 0)),
+                   color_space=stream.get('color_space', ''),
+                   frame_rate=_rate(stream.get('avg_frame_rate', '0/0')))
+
+
+def _rate(rate: str) -> float:
+    """Convert an ffprobe rational, ex. '24000/1001'."""
+    num, _, den = rate.partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """Immutable result of a single ffprobe call.
+
+    Streams are grouped by type so the relative stream
+    ids used throughout webmify (ex. 'a:1') index
+    directly into the matching tuple.
+
+    Attributes:
+        file: probed filename
+        format_name: container format, ex. 'matroska,webm'
+        duration: container duration in seconds
+        start_time: container start time in seconds
+        bit_rate: container bit rate in bits/s, 0 if unknown
+        streams: every stream, in container order
+    """
+    file: PurePath
+    format_name: str = ''
+    duration: float = 0.0
+    start_time: float = 0.0
+    bit_rate: int = 0
+    streams: Tuple[StreamInfo, ...] = ()
+
+    @classmethod
+    def from_ffprobe(cls, file: PurePath, probe: dict) -> 'MediaInfo':
+        """Build from ffprobe's -show_streams -show_format json.
+
+        Parameters:
+        file - filename that was probed
+        probe - decoded json output of ffprobe
+        """
+        fmt = probe.get('format', {})
+        streams = tuple(StreamInfo.from_ffprobe(stream)
+                        for stream in probe.get('streams', []))
+
+        return cls(file=file,
+                   format_name=fmt.get('format_name', ''),
+                   duration=float(fmt.get('duration', 0.0)),
+                   start_time=float(fmt.get('start_time', 0.0)),
+                   bit_rate=int(fmt.get('bit_rate', 0)),
+                   streams=streams)
+
+    def _of_type(self, codec_type: str) -> Tuple[StreamInfo, ...]:
+        return tuple(stream for stream in self.streams
+                     if stream.codec_type == codec_type)
+
+    @property
+    def audio_streams(self) -> Tuple[StreamInfo, ...]:
+        return self._of_type('audio')
+
+    @property
+    def subtitle_streams(self) -> Tuple[StreamInfo, ...]:
+        return self._of_type('subtitle')
+
+    @property
+    def video_streams(self) -> Tuple[StreamInfo, ...]:
+        return self._of_type('video')
+
+    def audio(self, stream_id: str) -> StreamInfo:
+        """Return audio stream by relative id [0...]"""
+        return self.audio_streams[int(stream_id)]
+
+    def subtitle(self, stream_id: str) -> StreamInfo:
+        """Return subtitle stream by relative id [0...]"""
+        return self.subtitle_streams[int(stream_id)]
+
+    def video(self, stream_id: str) -> StreamInfo:
+        """Return video stream by relative id [0...]"""
+        return self.video_streams[int(stream_id)]
@@ -0,0 +1,56 @@
+import settings
+
+import threading
+
+
+offline = False
+"""When True, no request reaches the network: cached
+responses are served however old, anything else fails.
+Set by --offline."""
+
+_session = None
+_lock = threading.Lock()
+
+
+def _offline_adapter():
+    """Return a transport that refuses every request, so
+    the cached session falls back to stale entries.
+    """
+    import requests
+    from requests.adapters import BaseAdapter
+
+    class OfflineAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            raise requests.ConnectionError(f'Offline, not cached: {request.url}')
+
+        def close(self):
+            pass
+
+    return OfflineAdapter()
+
+
+def session() -> 'requests_cache.CachedSession':
+    """Return the cached session shared by the metadata
+    lookups, created on first use. requests_cache is only
+    imported here, keeping it out of CLI startup.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            import requests_cache
+
+            settings.metadata_cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # POST is cached for TheTVDB's login token
+            _session = requests_cache.CachedSession(
+                str(settings.metadata_cache_file),
+                backend='sqlite',
+                expire_after=settings.metadata_cache_expire_after,
+                urls_expire_after=settings.metadata_cache_urls_expire_after,
+                allowable_methods=('GET', 'HEAD', 'POST'),
+                stale_if_error=True)
+
+            if offline:
+                _session.mount('http://', _offline_adapter())
+                _session.mount('https://', _offline_adapter())
+
+        return _session
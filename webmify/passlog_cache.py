@@ -0,0 +1,89 @@
+import settings
+import probe_cache
+
+import os
+import shutil
+import hashlib
+from pathlib import Path, PurePath
+from typing import List
+
+
+def key(in_file: PurePath, parts: List[str]) -> str:
+    """Return the cache key for a first pass of in_file,
+    as it currently exists, made with the given settings.
+
+    Parameters:
+    in_file - source filename
+    parts - stream id, seek, filter and encoder flags
+    """
+    digest = hashlib.sha256(repr(probe_cache.file_key(in_file)).encode())
+    for part in parts:
+        digest.update(b'\0' + str(part).encode())
+    return digest.hexdigest()
+
+
+def _path(cache_key: str) -> Path:
+    return settings.passlog_cache_dir / f'{cache_key}.log'
+
+
+def get(cache_key: str, log_file: PurePath) -> bool:
+    """Copy the cached statistics to log_file.
+    Returns False on a miss.
+
+    Parameters:
+    cache_key - from key()
+    log_file - passlogfile ffmpeg would read
+    """
+    cached = _path(cache_key)
+    try:
+        shutil.copyfile(cached, log_file)
+        os.utime(cached)
+    except OSError:
+        return False
+    return True
+
+
+def put(cache_key: str, log_file: PurePath) -> None:
+    """Store the statistics in log_file. Failures to write
+    the cache are not fatal to an encode.
+
+    Parameters:
+    cache_key - from key()
+    log_file - passlogfile written by the first pass
+    """
+    cached = _path(cache_key)
+    partial = cached.with_suffix('.part')
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(log_file, partial)
+        os.replace(partial, cached)
+    except OSError as err:
+        print(f'First pass cache not updated: {err}')
+
+
+def evict(max_bytes: int = None) -> int:
+    """Remove the least recently used statistics until the
+    cache fits in max_bytes. Returns the number removed.
+
+    Parameters:
+    max_bytes - defaults to settings.passlog_cache_max_bytes
+    """
+    if max_bytes is None:
+        max_bytes = settings.passlog_cache_max_bytes
+
+    try:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry)
+                   for entry in settings.passlog_cache_dir.glob('*.log')]
+    except OSError:
+        return 0
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        entry.unlink()
+        total -= size
+        removed += 1
+
+    return removed
@@ -0,0 +1,211 @@
+import timeline
+import input_parser
+from media_info import MediaInfo
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+@dataclass
+class FilePlan:
+    """Metadata for one input file, resolved before any
+    encode starts.
+
+    Attributes:
+        file: input file
+        media_info: probe result for file
+        title: title searched for, ex. parsed from file
+        is_movie: search TMDb rather than TheTVDB
+        season: tv season number, '' for movies
+        episode: tv episode number, '' for movies
+        file_title: resolved title written to the output
+        file_summary: resolved summary written to the output
+        error: why resolution failed, '' on success
+    """
+    file: Path
+    media_info: MediaInfo
+    title: str
+    is_movie: bool
+    season: str = ''
+    episode: str = ''
+    file_title: str = ''
+    file_summary: str = ''
+    error: str = ''
+
+
+def _name(result: dict) -> str:
+    return result.get('title') or result.get('seriesName') or result.get('name', '')
+
+
+def _year(result: dict) -> str:
+    return (result.get('release_date') or result.get('firstAired') or '')[:4]
+
+
+def rank(title: str, results: List[dict]) -> List[dict]:
+    """Order search results best match first: exact title
+    matches, then the remote API's own relevance order.
+
+    Parameters:
+    title - title searched for
+    results - search results, TMDb movies or TheTVDB series
+    """
+    return sorted(results, key=lambda result: _name(result).casefold() != title.casefold())
+
+
+def group_plans(plans: List[FilePlan]) -> Dict[Tuple[bool, str, str], List[FilePlan]]:
+    """Group plans by (is movie, normalized title, season),
+    in order of first appearance, however the inputs are
+    interleaved. Each group shares one search.
+
+    Parameters:
+    plans - one per input file
+    """
+    groups = {}
+    for plan in plans:
+        key = (plan.is_movie, input_parser.normalize_title(plan.title), plan.season)
+        groups.setdefault(key, []).append(plan)
+
+    return groups
+
+
+def _search(query: Tuple[bool, str]) -> List[dict]:
+    # the lookup modules pull in their api clients and
+    # keys, so they are only imported once needed
+    is_movie, title = query
+    with timeline.span(f'Search: {title}', category='metadata'):
+        if is_movie:
+            import tmdb_lookup
+            return rank(title, tmdb_lookup.search_movies(title))
+
+        import thetvdb_lookup
+        return rank(title, thetvdb_lookup.search_show(title))
+
+
+def review(ambiguous: Dict[Tuple[bool, str], List[dict]],
+           interactive: bool = True,
+           search: Callable = _search) -> Dict[Tuple[bool, str], dict]:
+    """Choose a result for every ambiguous or unmatched
+    search in one pass, once all searches have finished.
+    Without interactive, the top ranked result is taken
+    and searches without results stay unresolved.
+
+    Parameters:
+    ambiguous - (is movie, title): ranked results, 0 or > 1
+    interactive - prompt for choices
+    search - (is movie, title) -> ranked results, for retitling
+    """
+    chosen = {}
+    if not ambiguous:
+        return chosen
+
+    print(f'\n\nMetadata review: {len(ambiguous)} searches need a choice')
+    for query, results in ambiguous.items():
+        is_movie, title = query
+        kind = 'Movie' if is_movie else 'Series'
+
+        while not results:
+            print(f"\n{kind} '{title}' not found.")
+            if not interactive:
+                break
+            new_title = input('Enter a title to search, blank to skip: ').strip()
+            if not new_title:
+                break
+            results = search((is_movie, new_title))
+            title = new_title
+
+        if not results:
+            continue
+
+        if len(results) == 1:
+            chosen[query] = results[0]
+            continue
+
+        print(f"\n{kind} '{title}' matches:")
+        for index, result in enumerate(results):
+            print(f'[{index}]: {_name(result)}, {_year(result)} (id {result["id"]})')
+
+        if not interactive:
+            print(f'Auto-selected [0]: {_name(results[0])}')
+            chosen[query] = results[0]
+            continue
+
+        while True:
+            user_choice = input('Result number [0]: ').strip() or '0'
+            if user_choice.isdigit() and int(user_choice) < len(results):
+                break
+            print(f'Enter a number from 0 to {len(results) - 1}.')
+        chosen[query] = results[int(user_choice)]
+
+    return chosen
+
+
+def resolve(plans: List[FilePlan], interactive: bool = True,
+            max_workers: int = 8) -> List[FilePlan]:
+    """Resolve metadata for every plan. Plans are grouped
+    so each title is searched, and each series loaded with
+    all its episodes, only once. Searches and series loads
+    run concurrently, ambiguous matches are reviewed
+    together, and episodes are then resolved from memory.
+    Plans that could not be resolved carry an error.
+    Returns plans. Each lookup module is imported only
+    when plans of its kind are present.
+
+    Parameters:
+    plans - one per input file
+    interactive - prompt for ambiguous matches
+    max_workers - concurrent metadata requests
+    """
+    if not plans:
+        return plans
+
+    groups = group_plans(plans)
+
+    # one search per normalized title, using its first spelling
+    queries = {}
+    for (is_movie, normalized, _), group in groups.items():
+        queries.setdefault((is_movie, normalized), (is_movie, group[0].title))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        found = dict(zip(queries, executor.map(_search, queries.values())))
+
+        chosen = {query: results[0] for query, results in found.items()
+                  if len(results) == 1}
+        chosen.update(review({query: results for query, results in found.items()
+                              if len(results) != 1},
+                             interactive=interactive))
+
+        series_ids = list(dict.fromkeys(result['id'] for (is_movie, _), result in chosen.items()
+                                        if not is_movie))
+        shows = {}
+        if series_ids:
+            import thetvdb_lookup
+            shows = dict(zip(series_ids, executor.map(thetvdb_lookup.load_show, series_ids)))
+
+    for (is_movie, normalized, season), group in groups.items():
+        result = chosen.get((is_movie, normalized))
+        if result is None:
+            for plan in group:
+                plan.error = f"No match for '{plan.title}'"
+            continue
+
+        if is_movie:
+            import tmdb_lookup
+            tmdb_lookup.display_movie(result)
+            for plan in group:
+                plan.file_title, plan.file_summary = tmdb_lookup.movie_metadata(result)
+            continue
+
+        # thetvdb_lookup was imported to load the show
+        show = shows[result['id']]
+        print(f"\n\n{show['seriesName']}, season {season}: {len(group)} files")
+        for plan in group:
+            try:
+                plan.file_title, plan.file_summary = thetvdb_lookup.get_file_metadata(show,
+                                                                                      plan.season,
+                                                                                      plan.episode)
+            except LookupError as err:
+                plan.error = str(err)
+
+    return plans
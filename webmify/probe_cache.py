@@ -0,0 +1,132 @@
+import settings
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import PurePath
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+
+refresh = False
+"""When True, entries stored before this run are ignored
+and every result is re-stored. Set by --refresh-probe."""
+
+_lock = threading.Lock()
+_refreshed = set()
+
+_schema = ('CREATE TABLE IF NOT EXISTS probe ('
+           'dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, '
+           'kind TEXT, value TEXT, accessed REAL, '
+           'PRIMARY KEY (dev, ino, size, mtime_ns, kind))')
+
+
+def file_key(in_file: PurePath) -> Tuple[int, int, int, int]:
+    """Return (device, inode, size, mtime_ns) identifying
+    the current contents of a file.
+
+    Parameters:
+    in_file - filename
+    """
+    stat = os.stat(in_file)
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """Serialized connection to the cache database,
+    committed and closed on exit.
+    """
+    with _lock:
+        settings.probe_cache_file.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(settings.probe_cache_file, timeout=30)
+        try:
+            conn.execute(_schema)
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def get(in_file: PurePath, kind: str) -> Optional[str]:
+    """Return the cached value stored for in_file,
+    or None on a miss.
+
+    Parameters:
+    in_file - filename
+    kind - type of result, ex. 'ffprobe', 'cropdetect'
+    """
+    key = file_key(in_file)
+    if refresh and (key, kind) not in _refreshed:
+        return None
+
+    try:
+        with _connect() as conn:
+            row = conn.execute('SELECT value FROM probe WHERE dev=? AND ino=? '
+                               'AND size=? AND mtime_ns=? AND kind=?',
+                               (*key, kind)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE probe SET accessed=? WHERE dev=? AND ino=? '
+                             'AND size=? AND mtime_ns=? AND kind=?',
+                             (time.time(), *key, kind))
+    except (sqlite3.Error, OSError):
+        return None
+
+    return row[0] if row else None
+
+
+def put(in_file: PurePath, kind: str, value: str) -> None:
+    """Store value for in_file. Failures to write
+    the cache are not fatal to an encode.
+
+    Parameters:
+    in_file - filename
+    kind - type of result, ex. 'ffprobe', 'cropdetect'
+    value - result to store
+    """
+    key = file_key(in_file)
+    try:
+        with _connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (*key, kind, value, time.time()))
+        _refreshed.add((key, kind))
+    except (sqlite3.Error, OSError) as err:
+        print(f'Probe cache not updated: {err}')
+
+
+def evict(max_age_days: float = None, max_bytes: int = None) -> int:
+    """Drop entries unused for max_age_days, then the least
+    recently used entries until the stored values fit in
+    max_bytes. Returns the number of entries removed.
+
+    Parameters:
+    max_age_days - defaults to settings.probe_cache_max_age_days
+    max_bytes - defaults to settings.probe_cache_max_bytes
+    """
+    if max_age_days is None:
+        max_age_days = settings.probe_cache_max_age_days
+    if max_bytes is None:
+        max_bytes = settings.probe_cache_max_bytes
+
+    cutoff = time.time() - max_age_days * 86400
+    try:
+        with _connect() as conn:
+            removed = conn.execute('DELETE FROM probe WHERE accessed < ?',
+                                   (cutoff,)).rowcount
+
+            total = conn.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) '
+                                 'FROM probe').fetchone()[0]
+            if total > max_bytes:
+                rows = conn.execute('SELECT rowid, LENGTH(value) FROM probe '
+                                    'ORDER BY accessed').fetchall()
+                for rowid, length in rows:
+                    if total <= max_bytes:
+                        break
+                    conn.execute('DELETE FROM probe WHERE rowid=?', (rowid,))
+                    total -= length
+                    removed += 1
+    except (sqlite3.Error, OSError):
+        return 0
+
+    return removed
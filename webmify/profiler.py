@@ -0,0 +1,182 @@
+import settings
+
+import json
+import time
+import threading
+import contextvars
+from pathlib import Path, PurePath
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Iterator, List
+
+
+enabled = False
+"""When True, wrappers profile every stage and write a
+report per title to settings.profile_dir. Set by
+--profile."""
+
+_title = contextvars.ContextVar('profile_title', default=None)
+_stage = contextvars.ContextVar('profile_stage', default=None)
+_lock = threading.Lock()
+
+
+@dataclass
+class RunProfile:
+    """One process run within a stage, see
+    ffmpeg_runner.ProcessUsage.
+    """
+    title: str
+    wall: float
+    user: float
+    sys: float
+    peak_rss: int
+    read_bytes: int
+    write_bytes: int
+    returncode: int
+
+
+@dataclass
+class StageProfile:
+    """Totals for one encode stage, or mux. start is in
+    seconds after the title started, peak_rss is the
+    largest of any single run.
+    """
+    name: str
+    start: float = 0.0
+    wall: float = 0.0
+    user: float = 0.0
+    sys: float = 0.0
+    peak_rss: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    output_bytes: int = 0
+    runs: List[RunProfile] = field(default_factory=list)
+
+
+@dataclass
+class TitleProfile:
+    """Every stage run for one output file."""
+    title: str
+    start: float = field(default_factory=time.time)
+    wall: float = 0.0
+    stages: List[StageProfile] = field(default_factory=list)
+
+
+@contextmanager
+def title(name: str) -> Iterator[TitleProfile]:
+    """Profile the stages run within, including those run
+    by threads started from a copied context. Yields None
+    unless enabled.
+
+    Parameters:
+    name - title of the report, ex. the output filename
+    """
+    if not enabled:
+        yield None
+        return
+
+    title_profile = TitleProfile(name)
+    token = _title.set(title_profile)
+    start = time.monotonic()
+    try:
+        yield title_profile
+    finally:
+        title_profile.wall = time.monotonic() - start
+        _title.reset(token)
+
+
+@contextmanager
+def stage(name: str, outputs: Callable[[], List[PurePath]] = None) -> Iterator[StageProfile]:
+    """Attribute every process run within to a stage of the
+    current title. Yields None outside a profiled title.
+
+    Parameters:
+    name - stage name, ex. 'VP9 Encode'
+    outputs - returns the stage's outputs, sized on success
+    """
+    title_profile = _title.get()
+    if title_profile is None:
+        yield None
+        return
+
+    start = time.monotonic()
+    stage_profile = StageProfile(name, start=time.time() - title_profile.start)
+    with _lock:
+        title_profile.stages.append(stage_profile)
+
+    token = _stage.set(stage_profile)
+    try:
+        yield stage_profile
+        if outputs is not None:
+            stage_profile.output_bytes = sum(Path(out_file).stat().st_size
+                                             for out_file in outputs()
+                                             if Path(out_file).exists())
+    finally:
+        stage_profile.wall = time.monotonic() - start
+        _stage.reset(token)
+
+
+def record(run_title: str, run_result) -> None:
+    """Add a finished process to the current stage, if any.
+    Called by ffmpeg_runner for every run.
+
+    Parameters:
+    run_title - name of the run, ex. 'VP9 First Pass'
+    run_result - ffmpeg_runner.RunResult
+    """
+    stage_profile = _stage.get()
+    if stage_profile is None:
+        return
+
+    usage = run_result.usage
+    with _lock:
+        stage_profile.runs.append(RunProfile(title=run_title,
+                                             wall=run_result.elapsed,
+                                             user=usage.user,
+                                             sys=usage.sys,
+                                             peak_rss=usage.peak_rss,
+                                             read_bytes=usage.read_bytes,
+                                             write_bytes=usage.write_bytes,
+                                             returncode=run_result.returncode))
+        stage_profile.user += usage.user
+        stage_profile.sys += usage.sys
+        stage_profile.peak_rss = max(stage_profile.peak_rss, usage.peak_rss)
+        stage_profile.read_bytes += usage.read_bytes
+        stage_profile.write_bytes += usage.write_bytes
+
+
+def format_table(title_profile: TitleProfile) -> str:
+    """Return the profile as a table, one row per stage."""
+    rows = [f"{'Stage':<40} {'Wall s':>8} {'User s':>8} {'Sys s':>7} {'CPU':>5} "
+            f"{'RSS MiB':>8} {'Read MiB':>9} {'Write MiB':>10} {'Out MiB':>8}"]
+    for stage_profile in title_profile.stages:
+        cpu = (stage_profile.user + stage_profile.sys) / stage_profile.wall if stage_profile.wall else 0
+        rows.append(f'{stage_profile.name[:40]:<40} {stage_profile.wall:8.1f} '
+                    f'{stage_profile.user:8.1f} {stage_profile.sys:7.1f} {cpu:5.1f} '
+                    f'{stage_profile.peak_rss / 2**20:8.1f} {stage_profile.read_bytes / 2**20:9.1f} '
+                    f'{stage_profile.write_bytes / 2**20:10.1f} {stage_profile.output_bytes / 2**20:8.1f}')
+    rows.append(f"{'Total (wall)':<40} {title_profile.wall:8.1f}")
+
+    return '\n'.join(rows)
+
+
+def write_report(title_profile: TitleProfile, report_dir: PurePath = None) -> Path:
+    """Print the profile table and write the JSON report,
+    returning its path.
+
+    Parameters:
+    title_profile - as yielded by title
+    report_dir - default settings.profile_dir
+    """
+    report_dir = Path(report_dir or settings.profile_dir)
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(title_profile.start))
+    report_file = report_dir / f'{title_profile.title}.{stamp}.json'
+    with open(report_file, 'w') as report:
+        json.dump(asdict(title_profile), report, indent=2)
+
+    print(f'\n\nProfile: {title_profile.title}\n{format_table(title_profile)}')
+    print(f'Report: {report_file}')
+
+    return report_file
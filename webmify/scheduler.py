@@ -0,0 +1,137 @@
+import settings
+import timeline
+
+import time
+import shutil
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+@dataclass
+class Job:
+    """A single planned encode.
+
+    Attributes:
+        in_file: source file
+        wrapper_class: wrapper that encodes in_file,
+                       ex. wrapper.TVStereoWrapper
+        wrapper_args: keyword arguments for wrapper_class,
+                      other than in_file and cpu_threads
+        delete_files: files removed once the encode succeeds
+        scratch_dir: where the job writes its intermediates
+        scratch_bytes: estimated peak scratch use, 0 if unknown
+    """
+    in_file: Path
+    wrapper_class: Callable
+    wrapper_args: Dict = field(default_factory=dict)
+    delete_files: List[Path] = field(default_factory=list)
+    scratch_dir: Path = None
+    scratch_bytes: int = 0
+
+    def run(self, cpu_threads: str) -> None:
+        with timeline.job(self.in_file.name):
+            self.wrapper_class(in_file=self.in_file,
+                               cpu_threads=cpu_threads,
+                               **self.wrapper_args)
+
+            for file in self.delete_files:
+                print(f'Deleting input file: {file}')
+                file.unlink()
+
+
+def split_threads(cpu_threads: str, active_jobs: int) -> str:
+    """Share the global thread budget between the
+    active jobs, at least one thread each.
+
+    Parameters:
+    cpu_threads - total thread budget
+    active_jobs - number of jobs sharing it
+    """
+    return str(max(1, int(cpu_threads) // max(1, active_jobs)))
+
+
+def scratch_fits(job: Job, running: List[Job]) -> bool:
+    """True if the job's scratch estimate fits in the free
+    space of its scratch_dir, less the estimates of running
+    jobs sharing that device.
+
+    Parameters:
+    job - job about to start
+    running - jobs already running
+    """
+    if not job.scratch_bytes or job.scratch_dir is None:
+        return True
+
+    device = Path(job.scratch_dir).stat().st_dev
+    reserved = sum(other.scratch_bytes for other in running
+                   if other.scratch_dir is not None and
+                   Path(other.scratch_dir).stat().st_dev == device)
+
+    return shutil.disk_usage(job.scratch_dir).free - reserved >= job.scratch_bytes
+
+
+def run_jobs(jobs: List[Job], max_jobs: int = 1,
+             cpu_threads: str = settings.cpu_threads) -> List[Job]:
+    """Run up to max_jobs encodes at once. Each job is given
+    an even share of cpu_threads when it starts; once fewer
+    jobs remain than max_jobs, later jobs get larger shares.
+    A failed job is reported and the batch continues.
+
+    A job whose scratch estimate does not fit waits until
+    running jobs finish, then up to settings.scratch_wait
+    for space to be freed, and is refused, as failed, if it
+    still does not fit. A job larger than its scratch device
+    is refused at once.
+    Returns the jobs that failed.
+
+    Parameters:
+    jobs - planned encodes, started in order
+    max_jobs - number of concurrent encodes
+    cpu_threads - global thread budget
+    """
+    pending = list(jobs)
+    running = {}
+    failed = []
+    waiting_since = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_jobs)) as executor:
+        while pending or running:
+            while pending and len(running) < max_jobs:
+                if not scratch_fits(pending[0], list(running.values())):
+                    if running:
+                        break
+                    # space freed by other programs may still let it start
+                    could_fit = pending[0].scratch_bytes <= shutil.disk_usage(pending[0].scratch_dir).total
+                    if waiting_since is None and could_fit and settings.scratch_wait > 0:
+                        waiting_since = time.monotonic()
+                        print(f'\n\nWaiting for scratch space: {pending[0].in_file}')
+                    if waiting_since is not None and time.monotonic() - waiting_since < settings.scratch_wait:
+                        time.sleep(settings.scratch_poll_interval)
+                        continue
+                    waiting_since = None
+                    job = pending.pop(0)
+                    print(f'\n\nRefused: {job.in_file}: needs about '
+                          f'{job.scratch_bytes / 2**30:.1f} GiB free in {job.scratch_dir}')
+                    failed.append(job)
+                    continue
+
+                waiting_since = None
+                job = pending.pop(0)
+                active_jobs = min(max_jobs, len(pending) + len(running) + 1)
+                job_threads = split_threads(cpu_threads, active_jobs)
+
+                print(f'\n\nX        NEW ENCODE        X\n\n'
+                      f'{job.in_file} ({job_threads} threads)\n')
+                running[executor.submit(job.run, job_threads)] = job
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    print(f'\n\nFailed: {job.in_file}: {error}')
+                    failed.append(job)
+
+    return failed
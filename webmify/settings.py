@@ -1,7 +1,148 @@
+import os
+from pathlib import Path
+
 cpu_threads = '16'
-ffmpeg_bin = 'ffmpeg'
+ffmpeg_bin = os.environ.get('WEBMIFY_FFMPEG', 'ffmpeg')
+ffprobe_bin = os.environ.get('WEBMIFY_FFPROBE', 'ffprobe')
 mkvmerge_bin = 'mkvmerge'
 
+"""Process Settings
+
+ffmpeg and ffprobe are run by ffmpeg_runner, from
+ffmpeg_bin and ffprobe_bin: the WEBMIFY_FFMPEG and
+WEBMIFY_FFPROBE environment variables, or --ffmpeg and
+--ffprobe, select other builds. Only the
+last runner_tail_lines of stderr are kept, for error
+messages. Encode progress is printed every
+runner_progress_interval seconds. Probes taking longer
+than probe_timeout seconds are killed, encodes are
+limited by encode_timeout, None for no limit.
+"""
+runner_tail_lines = 20
+runner_progress_interval = 30
+probe_timeout = 600
+encode_timeout = None
+
+"""Cache Settings
+
+Persistent caches live under cache_dir. Probe
+results are keyed by file identity, so a file
+that is replaced or modified is re-probed.
+"""
+cache_dir = Path.home() / '.cache' / 'webmify'
+probe_cache_file = cache_dir / 'probe.sqlite'
+probe_cache_max_age_days = 90
+probe_cache_max_bytes = 64 * 1024 * 1024
+
+"""VP9 First Pass Cache
+
+First pass statistics are stored under passlog_cache_dir,
+named by a hash of the source identity, stream and every
+setting that shapes the first pass other than crf and
+threads. The least recently used are removed once the
+directory exceeds passlog_cache_max_bytes.
+"""
+passlog_cache_dir = cache_dir / 'passlog'
+passlog_cache_max_bytes = 2 * 1024 * 1024 * 1024
+
+"""Batch Journal
+
+Finished stages are recorded in journal_dir, one journal
+per output, so an interrupted batch resumes where it
+stopped even if it is rerun with a different work list.
+"""
+journal_dir = cache_dir / 'journal'
+
+"""Stage Artifact Cache
+
+With --cache, the outputs of each encode stage are kept
+in artifact_cache_dir, keyed by the source identity and
+the stage's ffmpeg flags, and reused by later runs. The
+least recently used are removed once the directory
+exceeds artifact_cache_max_bytes.
+"""
+artifact_cache_dir = cache_dir / 'artifacts'
+artifact_cache_max_bytes = 100 * 1024 * 1024 * 1024
+
+"""Scratch Settings
+
+Intermediate files are written to scratch_dir, ex. a
+tmpfs or local NVMe mount, or next to the output when it
+is None. The finished file is renamed into place.
+
+Before a job starts, its scratch use is estimated from
+the intermediates it writes: the encoded video at
+scratch_video_bits_per_pixel, a ceiling for the CRF
+encodes, the audio renditions at scratch_audio_bit_rate,
+and lossless filtered video at ffv1_bytes_per_pixel with
+--filter-once, plus the muxed output when scratch_dir is
+on the output's device, times scratch_headroom. The
+source is never copied to scratch. Jobs wait while that does not
+fit, up to scratch_wait seconds once nothing else runs,
+then are refused.
+"""
+scratch_dir = None
+scratch_headroom = 1.25
+scratch_video_bits_per_pixel = 0.1
+scratch_audio_bit_rate = 640_000
+ffv1_bytes_per_pixel = 0.75
+scratch_wait = 300
+scratch_poll_interval = 10
+
+"""Metadata Cache Settings
+
+TMDb and TheTVDB responses are stored in the sqlite
+metadata_cache_file. Entries expire after the time set
+for the first matching url pattern, in seconds, or
+metadata_cache_expire_after otherwise. Expired entries
+are still served when a request fails, and with
+--offline no request is sent at all.
+"""
+metadata_cache_file = cache_dir / 'metadata.sqlite'
+metadata_cache_expire_after = 7 * 86400
+metadata_cache_urls_expire_after = {
+    'api.themoviedb.org/3/search': 7 * 86400,
+    'api.themoviedb.org/3/movie': 30 * 86400,
+    'api.thetvdb.com/login': 20 * 3600,
+    'api.thetvdb.com/search': 7 * 86400,
+    'api.thetvdb.com/series/*/episodes': 86400,
+    'api.thetvdb.com/series': 7 * 86400,
+}
+
+"""Profile Settings
+
+With --profile, a JSON report of the time, cpu, memory
+and I/O of every stage is written per title to
+profile_dir.
+"""
+profile_dir = cache_dir / 'profiles'
+
+"""Library Scan Settings
+
+webmify scan indexes files with a scan_suffixes suffix,
+skipping names ending in a scan_skip_suffixes entry,
+the outputs of earlier encodes.
+"""
+scan_suffixes = ('.avi', '.m2ts', '.m4v', '.mkv', '.mov', '.mp4', '.mpg', '.ts')
+scan_skip_suffixes = ('.webm', '.chromecast.mp4')
+
+"""Loudness Normalization Settings
+
+Normalization is repeated while the predicted
+output loudness range stays above 17 LU, at most
+loudnorm_max_passes times.
+"""
+loudnorm_max_passes = 3
+
+"""Crop Detection Settings
+
+Crop is detected from crop_sample_frames keyframes
+at each of crop_samples points spread across the
+source.
+"""
+crop_samples = 12
+crop_sample_frames = 4
+
 """Subtitle Settings
 
 Used for burning subtitles given an
@@ -1,41 +1,137 @@
+import settings
+import profiler
+import timeline
+import probe_cache
+import ffmpeg_runner
+from media_info import MediaInfo
+
 import re
+import json
+import threading
 import subprocess
 from pathlib import Path, PurePath
-from collections import Counter
+from typing import Dict, List, Tuple
+
+
+_probe_memo: Dict[Tuple, MediaInfo] = {}
+_probe_lock = threading.Lock()
+
+_crop_re = re.compile('crop=(?P<crop>[0-9]+:[0-9]+:[0-9]+:[0-9]+)')
+
+
+def probe(in_file: PurePath) -> MediaInfo:
+    """Run a single ffprobe over the whole container and
+    return its MediaInfo. Results are memoized in-process
+    and stored in the persistent probe cache, both keyed
+    by file identity, so repeated calls are free.
+
+    Parameters:
+    in_file - filename, string or Path()
+    """
+    key = probe_cache.file_key(in_file)
+    with _probe_lock:
+        if key in _probe_memo:
+            return _probe_memo[key]
+
+    probe_out = probe_cache.get(in_file, 'ffprobe')
+    if probe_out is None:
+        probe_cmd = [settings.ffprobe_bin, f'{in_file}', '-loglevel', 'error',
+                     '-show_streams', '-show_format', '-of', 'json']
+
+        with timeline.span('Probe', in_file=str(in_file)):
+            probe_out = ffmpeg_runner.run(probe_cmd, title='Probe', stdout=True,
+                                          timeout=settings.probe_timeout).check().stdout
+        probe_cache.put(in_file, 'ffprobe', probe_out)
+
+    media_info = MediaInfo.from_ffprobe(Path(in_file), json.loads(probe_out))
+
+    with _probe_lock:
+        _probe_memo[key] = media_info
+
+    return media_info
 
 
 def get_audio_ch(in_file: PurePath, audio_id: str) -> str:
-    """Use ffprobe to query the number of
-    audio channels in the specified stream.
+    """Return the number of audio channels
+    in the specified stream.
 
     Parameters:
     in_file - filename, string or Path()
     audio_id - relative audio stream id [0...]
     """
-    probe_cmd = ['ffprobe', f'{in_file}', '-loglevel', 'error',
-                 '-select_streams', f'a:{audio_id}', '-show_entries',
-                 'stream=channels', '-of', 'default=nw=1:nk=1']
-
-    return subprocess.check_output(probe_cmd, stdin=None, stderr=None,
-                                   shell=False, universal_newlines=True).strip()
+    return str(probe(in_file).audio(audio_id).channels)
 
 
 def get_audio_lang(in_file: PurePath, audio_id: str) -> str:
-    """Use ffprobe to query the language of
-    the specified audio stream.
+    """Return the language of the specified
+    audio stream.
 
     Parameters:
     in_file - filename
     audio_id - relative audio stream id [0...]
     """
-    audio_lang_probe_cmd = ['ffprobe', f'{in_file}', '-loglevel',
-                            'error', '-select_streams', f'a:{audio_id}',
-                            '-show_entries', 'stream_tags=language',
-                            '-of', 'default=nw=1:nk=1']
+    return probe(in_file).audio(audio_id).language
+
+
+def count_packets(in_file: PurePath, stream_id: str) -> int:
+    """Demux the file and return the number of packets,
+    i.e. frames, in the specified video stream.
+
+    Parameters:
+    in_file - filename
+    stream_id - relative video stream id [0...]
+    """
+    probe_cmd = [settings.ffprobe_bin, f'{in_file}', '-loglevel', 'error',
+                 '-select_streams', f'v:{stream_id}', '-count_packets',
+                 '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0']
+
+    return int(ffmpeg_runner.run(probe_cmd, stdout=True,
+                                 timeout=settings.probe_timeout).check().stdout.strip())
+
+
+def _crop_cmd(in_file: PurePath, seek: float) -> List[str]:
+    """Command running cropdetect over a few keyframes from seek."""
+    return [settings.ffmpeg_bin, '-skip_frame', 'nokey', '-ss', f'{seek:.3f}',
+            '-i', f'{in_file}', '-frames:v', f'{settings.crop_sample_frames}',
+            '-vf', 'cropdetect', '-an', '-sn', '-f', 'null', '/dev/null']
+
+
+def _detect_crops(in_file: PurePath, seeks: List[float]) -> List[str]:
+    """Run cropdetect at every seek concurrently and return
+    the accumulated crop of each, '' if none was found.
+    """
+    run_results = ffmpeg_runner.run_all([_crop_cmd(in_file, seek) for seek in seeks],
+                                        title='Crop Detect', capture=_crop_re, echo=False,
+                                        timeout=settings.probe_timeout)
+
+    # cropdetect accumulates over frames, the last line covers them all
+    return [run_result.captured.get('crop', '') for run_result in run_results]
+
+
+def merge_crops(crops: List[str]) -> str:
+    """Return the smallest crop containing every sampled
+    crop, so no sample loses picture. Black samples, which
+    detect as empty, are ignored. Returns '' when no sample
+    found a crop.
+
+    Parameters:
+    crops - crop strings, 'w:h:x:y'
+    """
+    boxes = [tuple(int(dimn) for dimn in crop.split(':'))
+             for crop in crops if crop]
+    boxes = [(w, h, x, y) for w, h, x, y in boxes if w > 0 and h > 0]
+    if not boxes:
+        return ''
+
+    left = min(x for w, h, x, y in boxes)
+    top = min(y for w, h, x, y in boxes)
+    right = max(x + w for w, h, x, y in boxes)
+    bottom = max(y + h for w, h, x, y in boxes)
+
+    width = (right - left) - (right - left) % 2
+    height = (bottom - top) - (bottom - top) % 2
 
-    return subprocess.check_output(audio_lang_probe_cmd, stdin=None,
-                                   stderr=None, shell=False,
-                                   universal_newlines=True).strip()
+    return f'{width}:{height}:{left}:{top}'
 
 
 def get_crop_dimns(in_file: PurePath) -> str:
@@ -43,100 +139,119 @@ def get_crop_dimns(in_file: PurePath) -> str:
     Returns string of crop dimensions to feed
     directly into ffmpeg crop filter
 
+    Keyframes are sampled at settings.crop_samples evenly
+    spaced points across the whole duration, concurrently,
+    and merged with merge_crops. Returns '' when no crop
+    was found, ex. for a black or very short source.
+
     Parameters:
     in_file - filename
     """
-    crop_cmd = ['ffmpeg', '-ss', '300', '-t', '600', '-i', f'{in_file}',
-                '-vf', 'cropdetect', '-an', '-f', 'null', '/dev/null']
+    crop_dimns = probe_cache.get(in_file, 'cropdetect:sampled')
+    if crop_dimns is not None:
+        return crop_dimns
 
-    comp_proc = subprocess.run(crop_cmd,
-                               capture_output=True,
-                               text=True)
+    duration = probe(in_file).duration
+    seeks = [duration * (num + 1) / (settings.crop_samples + 1)
+             for num in range(settings.crop_samples)]
 
-    crop_re = re.compile('crop=([0-9]+:[0-9]+:[0-9]+:[0-9]+)')
-    crops_found = crop_re.findall(comp_proc.stderr)
+    with profiler.stage('Crop Detect'), timeline.span('Crop Detect'):
+        crops_found = _detect_crops(in_file, seeks)
+        if not any(crops_found):
+            crops_found = _detect_crops(in_file, [0.0])
 
-    crop_counts = Counter(crops_found)
+    crop_dimns = merge_crops(crops_found)
+    probe_cache.put(in_file, 'cropdetect:sampled', crop_dimns)
 
-    return crop_counts.most_common(1)[0][0]
+    return crop_dimns
 
 
 def get_height(in_file: PurePath, stream_id: str) -> int:
-    """Use ffprobe to query the height of
-    the specified video stream. Returns int
-    of resolution height.
+    """Return int of the resolution height
+    of the specified video stream.
+
+    Parameters:
+    in_file - filename
+    stream_id - relative video stream id [0...]
+    """
+    return probe(in_file).video(stream_id).height
+
+
+def get_video_packets(in_file: PurePath, stream_id: str) -> List[Tuple[float, bool]]:
+    """Demux the specified video stream without decoding
+    and return (pts time, is keyframe) for every packet,
+    in presentation order.
 
     Parameters:
     in_file - filename
     stream_id - relative video stream id [0...]
     """
-    probe_cmd = ['ffprobe', f'{in_file}', '-loglevel',
-                            'error', '-select_streams', f'v:{stream_id}',
-                            '-show_entries', 'stream=height',
-                            '-of', 'default=nw=1:nk=1']
+    cache_kind = f'packets:v:{stream_id}'
+    packets_out = probe_cache.get(in_file, cache_kind)
+    if packets_out is None:
+        probe_cmd = [settings.ffprobe_bin, f'{in_file}', '-loglevel', 'error',
+                     '-select_streams', f'v:{stream_id}',
+                     '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0']
+
+        packets_out = ffmpeg_runner.run(probe_cmd, stdout=True,
+                                        timeout=settings.probe_timeout).check().stdout
+        probe_cache.put(in_file, cache_kind, packets_out)
 
-    height = subprocess.check_output(probe_cmd, stdin=None,
-                                     stderr=None, shell=False,
-                                     universal_newlines=True).strip()
+    packets = []
+    for line in packets_out.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if pts_time and pts_time != 'N/A':
+            packets.append((float(pts_time), 'K' in flags))
 
-    return int(height)
+    return sorted(packets)
 
 
 def get_sub_stream(in_file: PurePath) -> str:
-    """Use ffprobe to query for subtitle stream
-    ids.
+    """Return the absolute ids of English
+    subtitle streams, one per line.
 
     Parameters:
     in_file - filename
     """
-    probe_cmd = ['ffprobe', f'{in_file}', '-loglevel',
-                 'error', '-select_streams', 's:m:language=eng',
-                 '-show_entries', 'stream=index', '-of', 'csv=p=0']
-
-    return subprocess.check_output(probe_cmd, stdin=None, stderr=None,
-                                   shell=False, universal_newlines=True).strip()
+    return '\n'.join(str(stream.index)
+                     for stream in probe(in_file).subtitle_streams
+                     if stream.language == 'eng')
 
 
 def get_sub_type(in_file: PurePath, stream_id: str) -> str:
-    """Use ffprobe to query the subtitle stream
-    type.
+    """Return the subtitle stream type. A failed or timed
+    out probe falls back to the file extension. Probes take
+    no cancel event, so RunCancelled is never raised.
 
     Parameters:
     in_file - filename
     stream_id - relative stream id [0...]
     """
-    probe_cmd = ['ffprobe', f'{in_file}', '-loglevel',
-                 'error', '-select_streams', f's:{stream_id}',
-                 '-show_entries', 'stream=codec_name',
-                 '-of', 'default=nw=1:nk=1']
-
-    sub_type = subprocess.run(probe_cmd, capture_output=True,
-                              text=True).stdout.strip()
+    try:
+        sub_type = probe(in_file).subtitle(stream_id).codec_name
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, IndexError):
+        sub_type = ''
 
     if sub_type:
         return sub_type
-    elif Path(in_file).suffix == 'srt':
+    elif Path(in_file).suffix == '.srt':
         return 'subrip'
-    elif Path(in_file).suffix == 'ass':
+    elif Path(in_file).suffix == '.ass':
         return 'ass'
     else:
         return ''
 
 
-def get_vp9_tile_columns(in_file: PurePath, stream_id: str) -> str:
-    """Use ffprobe to query the resolution of
-    the specified video stream and return the
-    recommended number of tile columns.
+def get_vp9_tile_columns(height: int) -> str:
+    """Return the recommended number of tile
+    columns for the given resolution height.
 
     Recommendations from:
     https://developers.google.com/media/vp9/settings/vod/
 
     Parameters:
-    in_file - filename
-    stream_id - relative video stream id [0...]
+    height - video resolution height
     """
-    height = get_height(in_file, stream_id)
-
     if height <= 240:
         return '0'
     elif height <= 480:
@@ -150,21 +265,48 @@ def get_vp9_tile_columns(in_file: PurePath, stream_id: str) -> str:
 
 
 def is_hdr(in_file: PurePath, stream_id: str) -> bool:
-    """Use ffprobe to query the color space of
-    the specified video stream and return True
-    if bt2020nc.
+    """Return True if the color space of the
+    specified video stream is bt2020nc.
 
     Parameters:
     input_file - filename
     stream_id - relative video stream id [0...]
     """
-    probe_cmd = ['ffprobe', f'{in_file}', '-loglevel',
-                            'error', '-select_streams', f'v:{stream_id}',
-                            '-show_entries', 'stream=color_space',
-                            '-of', 'default=nw=1:nk=1']
+    return probe(in_file).video(stream_id).color_space == 'bt2020nc'
+
+
+def estimate_scratch_bytes(media_info: MediaInfo, filter_once: bool = False,
+                           direct_mux: bool = False, segments: int = 0,
+                           with_output: bool = False) -> int:
+    """Estimate the scratch space an encode of the source
+    needs at its peak, with settings.scratch_headroom. The
+    source is not counted, see Scratch Settings.
+
+    Parameters:
+    media_info - probe result for the source
+    filter_once - include the lossless filtered video
+    direct_mux - the video is written straight to the output
+    segments - VP9 chunks, held alongside their concatenation
+    with_output - include the muxed part_file, for scratch on the output's device
+    """
+    audio_bytes = settings.scratch_audio_bit_rate * media_info.duration / 8
+    video_bytes = 0
+    estimate = audio_bytes
+
+    if media_info.video_streams:
+        video_info = media_info.video('0')
+        pixels = video_info.width * video_info.height * video_info.frame_rate * media_info.duration
+
+        video_bytes = pixels * settings.scratch_video_bits_per_pixel / 8
+        if segments > 1:
+            estimate += video_bytes
+        if not direct_mux:
+            estimate += video_bytes
+
+        if filter_once:
+            estimate += pixels * settings.ffv1_bytes_per_pixel
 
-    color_space = subprocess.check_output(probe_cmd, stdin=None,
-                                          stderr=None, shell=False,
-                                          universal_newlines=True).strip()
+    if with_output:
+        estimate += video_bytes + audio_bytes
 
-    return color_space == 'bt2020nc'
+    return int(estimate * settings.scratch_headroom)
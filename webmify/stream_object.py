@@ -1,5 +1,6 @@
 import settings
 import stream_helpers
+from media_info import MediaInfo
 
 import sys
 from pathlib import Path, PurePath
@@ -18,6 +19,11 @@ lang_dict = {'chi': 'Chinese',
              '': 'English'}
 """Communal dict to translate language codes."""
 
+downmix_filter = ('pan=stereo'
+                  '|c0=.95*FL+1.0*FC+.4*BL+.4*SL'
+                  '|c1=.95*FR+1.0*FC+.4*BR+.4*SR')
+"""Dialogue weighted stereo downmix of surround sources."""
+
 
 @dataclass
 class StreamObject(ABC):
@@ -41,6 +47,8 @@ class StreamObject(ABC):
                        ex. ['-c:a:0', 'libopus', '-b:a:0', '128k']
         metadata: list of metadata flags to pass to ffmpeg
                   ex. ['-metadata', 'title="Stream Title"']
+        media_info: probe result for in_file, probed on
+                    demand if not supplied
     """
     in_file: PurePath
     stream_id: str
@@ -48,14 +56,20 @@ class StreamObject(ABC):
     filter_flags: List[str] = field(init=False)
     encoder_flags: List[str] = field(init=False)
     metadata: List[str] = field(init=False)
+    media_info: MediaInfo = None
 
     def __post_init__(self):
         """Call concrete methods to finalize attributes."""
+        self._set_media_info()
         self._set_stream_maps()
         self._set_filter()
         self._set_encoder()
         self._set_metadata()
 
+    def _set_media_info(self) -> None:
+        if self.media_info is None:
+            self.media_info = stream_helpers.probe(self.in_file)
+
     @abstractmethod
     def _set_stream_maps(self) -> None:
         pass
@@ -86,36 +100,93 @@ class AudioStream(StreamObject, ABC):
         """Audio streams must track the number of channels and their
         language before defining the rest of their attributes.
         """
-        self.channel_num = stream_helpers.get_audio_ch(self.in_file,
-                                                       self.stream_id)
+        self._set_media_info()
+        audio_info = self.media_info.audio(self.stream_id)
+
+        self._set_channel_num(audio_info.channels)
         if not self.stream_lang:
-            self.stream_lang = stream_helpers.get_audio_lang(self.in_file,
-                                                             self.stream_id)
+            self.stream_lang = audio_info.language
 
         super().__post_init__()
 
+    def _set_channel_num(self, channels: int):
+        self.channel_num = str(channels)
+
+    def _set_filter_chain(self, filter_chain: str):
+        """Audio filters are kept as a chain on the source stream
+        as well as flags, so encode_object can combine several
+        audio streams into one filter graph.
+        """
+        self.filter_chain = filter_chain
+        self.filter_flags = ['-filter_complex', f'[0:a:{self.stream_id}]'
+                                                f'{filter_chain}[aout]']
+
     def _set_stream_maps(self):
-        if int(self.channel_num) < 6:
-            self.stream_maps = ['-map', f'0:a:{self.stream_id}']
-        else:
-            self.stream_maps = ['-map', '[ss]']
+        self.stream_maps = ['-map', '[aout]']
+
+
+def loudnorm_filter(measured: Dict[str, str] = None) -> str:
+    """Return the loudnorm filter. Without a measurement it
+    analyses and prints json; with one it applies linear
+    normalization using the measured values.
+
+    Parameters:
+    measured - loudnorm json from a previous pass
+    """
+    if measured is None:
+        return 'loudnorm=I=-16:LRA=16:tp=-1.5:print_format=json'
+
+    return ('loudnorm=I=-16:LRA=16:tp=-1.5:'
+            f"measured_I={measured['input_i']}:"
+            f"measured_LRA={measured['input_lra']}:"
+            f"measured_tp={measured['input_tp']}:"
+            f"measured_thresh={measured['input_thresh']}:"
+            f"offset={measured['target_offset']}")
+
+
+@dataclass
+class NormalizedStream(AudioStream, ABC):
+    """Abstract base class for streams read through the
+    loudnorm chain, in a single filter graph on the source.
+
+    Sources with more than two channels are downmixed first.
+    Each measurement in norm_passes is then applied in turn,
+    so a re-normalization never touches disk.
+
+    Attributes:
+        norm_passes: loudnorm measurements of earlier passes
+        source_channel_num: channels in the source stream,
+                            channel_num is that of the output
+    """
+    norm_passes: List[Dict[str, str]] = field(default_factory=list)
+
+    def _set_channel_num(self, channels: int):
+        self.source_channel_num = str(channels)
+        self.channel_num = str(min(channels, 2))
+
+    def _set_normalized_filter(self, tail: str):
+        chain = [loudnorm_filter(measured) for measured in self.norm_passes]
+        if int(self.source_channel_num) > 2:
+            chain.insert(0, downmix_filter)
+
+        self._set_filter_chain(','.join(chain + [tail]))
+
+    def _set_filter(self):
+        # loudnorm upsamples to 192kHz internally
+        self._set_normalized_filter('aresample=48000')
 
 
 @dataclass
 class AACStream(AudioStream):
     # Bitrates from: https://trac.ffmpeg.org/wiki/Encode/AAC vbr esimations
     def _set_filter(self):
-        filter_dict = {'1': ['-af', 'channelmap=channel_layout=mono'],
-                       '2': ['-af', 'channelmap=channel_layout=stereo'],
-                       '4': ['-ac', '2'],
-                       '6': ['-filter_complex', f'[a:{self.stream_id}]'
-                                                'channelmap=channel_layout=5.1'
-                                                '[ss]'],
-                       '8': ['-filter_complex', f'[a:{self.stream_id}]'
-                                                'channelmap=channel_layout=7.1'
-                                                '[ss]']}
-
-        self.filter_flags = filter_dict[self.channel_num]
+        filter_dict = {'1': 'channelmap=channel_layout=mono',
+                       '2': 'channelmap=channel_layout=stereo',
+                       '4': 'aformat=channel_layouts=stereo',
+                       '6': 'channelmap=channel_layout=5.1',
+                       '8': 'channelmap=channel_layout=7.1'}
+
+        self._set_filter_chain(filter_dict[self.channel_num])
 
     def _set_encoder(self):
         encoder_dict = {'1': ['-c:a', 'libfdk_aac', '-b:a', '96k', '-cutoff', '18000'],
@@ -147,7 +218,7 @@ class AACStream(AudioStream):
 
 
 @dataclass
-class AACNormalizedDownmixStream(AACStream):
+class AACNormalizedDownmixStream(NormalizedStream, AACStream):
     def _set_metadata(self):
         self.metadata = ['-metadata:s:a', f'title={lang_dict[self.stream_lang]} '
                                           '- AAC Dialogue Enhanced Downmix - 2.0',
@@ -155,10 +226,12 @@ class AACNormalizedDownmixStream(AACStream):
 
 
 @dataclass
-class NormalizedFirstPassStream(AudioStream):
+class NormalizedFirstPassStream(NormalizedStream):
+    """Loudness measurement of the source after any earlier
+    passes are applied. Nothing is written.
+    """
     def _set_filter(self):
-        self.filter_flags = ['-af', 'loudnorm=I=-16:LRA=16:tp=-1.5:'
-                                    'print_format=json']
+        self._set_normalized_filter(loudnorm_filter())
 
     def _set_encoder(self):
         self.encoder_flags = None
@@ -167,46 +240,17 @@ class NormalizedFirstPassStream(AudioStream):
         self.metadata = ['-f', 'null']
 
 
-@dataclass
-class NormalizedSecondPassStream(AudioStream):
-    norm_i: str = ''
-    norm_tp: str = ''
-    norm_lra: str = ''
-    norm_thresh: str = ''
-    norm_tar_off: str = ''
-
-    def _set_filter(self):
-        self.filter_flags = ['-af', 'loudnorm=I=-16:LRA=16:tp=-1.5:'
-                                    f'measured_I={self.norm_i}:'
-                                    f'measured_LRA={self.norm_lra}:'
-                                    f'measured_tp={self.norm_tp}:'
-                                    f'measured_thresh={self.norm_thresh}:'
-                                    f'offset={self.norm_tar_off}:'
-                                    'print_format=json']
-
-    def _set_encoder(self):
-        self.encoder_flags = ['-c:a', 'pcm_s16le', '-ar', '48k']
-
-    def _set_metadata(self):
-        self.metadata = ['-metadata:s:a', f'title={lang_dict[self.stream_lang]} '
-                                          '- Normalized Stereo']
-
-
 @dataclass
 class OpusStream(AudioStream):
     # Bitrates from: https://wiki.xiph.org/index.php?title=Opus_Recommended_Settings
     def _set_filter(self):
-        filter_dict = {'1': ['-af', 'channelmap=channel_layout=mono'],
-                       '2': ['-af', 'channelmap=channel_layout=stereo'],
-                       '4': ['-ac', '2'],
-                       '6': ['-filter_complex', f'[a:{self.stream_id}]'
-                                                'channelmap=channel_layout=5.1'
-                                                '[ss]'],
-                       '8': ['-filter_complex', f'[a:{self.stream_id}]'
-                                                'channelmap=channel_layout=7.1'
-                                                '[ss]']}
-
-        self.filter_flags = filter_dict[self.channel_num]
+        filter_dict = {'1': 'channelmap=channel_layout=mono',
+                       '2': 'channelmap=channel_layout=stereo',
+                       '4': 'aformat=channel_layouts=stereo',
+                       '6': 'channelmap=channel_layout=5.1',
+                       '8': 'channelmap=channel_layout=7.1'}
+
+        self._set_filter_chain(filter_dict[self.channel_num])
 
     def _set_encoder(self):
         encoder_dict = {'1': ['-c:a', 'libopus', '-b:a', '96k'],
@@ -238,34 +282,13 @@ class OpusStream(AudioStream):
 
 
 @dataclass
-class OpusNormalizedDownmixStream(OpusStream):
+class OpusNormalizedDownmixStream(NormalizedStream, OpusStream):
     def _set_metadata(self):
         self.metadata = ['-metadata:s:a', f'title={lang_dict[self.stream_lang]} '
                                           '- Opus Dialogue Enhanced Downmix - 2.0',
                          '-metadata:s:a', f'language={self.stream_lang}']
 
 
-@dataclass
-class StereoDownmixStream(AudioStream):
-    def _set_filter(self):
-        self.filter_flags = ['-filter_complex', f'[a:{self.stream_id}]'
-                                                'pan=stereo'
-                                                '|c0=.95*FL+1.0*FC+.4*BL+.4*SL'
-                                                '|c1=.95*FR+1.0*FC+.4*BR+.4*SR'
-                                                '[dm]']
-
-    def _set_encoder(self):
-        self.encoder_flags = ['-c:a', 'pcm_s16le', '-ar', '48k']
-
-    def _set_metadata(self):
-        self.metadata = ['-metadata:s:a', f'title={lang_dict[self.stream_lang]} '
-                                          '- Stereo Downmix',
-                         '-metadata:s:a', f'language={self.stream_lang}']
-
-    def _set_stream_maps(self):
-        self.stream_maps = ['-map', '[dm]']
-
-
 ###################################
 #                                 #
 #        Subtitle Streams         #
@@ -320,6 +343,12 @@ class VideoStream(StreamObject, ABC):
             self.filter_flags[1] += ','
 
     def _set_filter(self):
+        if self.crop:
+            print('\nParsing crop dimensions: ', end='')
+            self.crop_dimns = stream_helpers.get_crop_dimns(self.in_file)
+            print(f'{self.crop_dimns or "none found, not cropping"}')
+            self.crop = bool(self.crop_dimns)
+
         self.any_filter = (self.crop or
                            self.burn_subs or
                            self.denoise or
@@ -337,9 +366,6 @@ class VideoStream(StreamObject, ABC):
             self.filter_flags = None
 
         if self.crop:
-            print('\nParsing crop dimensions: ', end='')
-            self.crop_dimns = stream_helpers.get_crop_dimns(self.in_file)
-            print(f'{self.crop_dimns}')
             self.tmp_filter = f'crop={self.crop_dimns}'
             self._filter_len_check()
             self._add_filter(self.tmp_filter)
@@ -390,17 +416,19 @@ class VideoStream(StreamObject, ABC):
 @dataclass
 class ChromecastStream(VideoStream):
     def __post_init__(self):
-        self.hdr_to_sdr = stream_helpers.is_hdr(in_file=self.in_file,
-                                                stream_id=self.stream_id)
-        self.scale_to_1080 = (1080 < stream_helpers.get_height(in_file=self.in_file,
-                                                               stream_id=self.stream_id))
+        self._set_media_info()
+        video_info = self.media_info.video(self.stream_id)
+
+        self.hdr_to_sdr = video_info.color_space == 'bt2020nc'
+        self.scale_to_1080 = 1080 < video_info.height
 
         super().__post_init__()
 
     def _set_encoder(self):
         self.encoder_flags = ['-c:v', 'libx264', '-preset', 'veryslow', '-tune',
                               'film', '-crf', self.crf, '-profile:v', 'high',
-                              '-level', '4.1', '-maxrate', '5M', '-bufsize', '2M']
+                              '-level', '4.1', '-maxrate', '5M', '-bufsize', '2M',
+                              '-threads', self.cpu_threads]
 
     def _set_metadata(self):
         self.metadata = ['-metadata:s:v', 'title=h264 (avc1) 4.1 High']
@@ -409,13 +437,17 @@ class ChromecastStream(VideoStream):
 @dataclass
 class VP9Stream(VideoStream):
     def _set_encoder(self):
-        self.tile_columns = stream_helpers.get_vp9_tile_columns(in_file=self.in_file,
-                                                                stream_id=self.stream_id)
+        # tile-columns is log2 of the column count, more
+        # columns than threads cannot be encoded in parallel
+        height = self.media_info.video(self.stream_id).height
+        max_columns = int(self.cpu_threads).bit_length() - 1
+        self.tile_columns = str(min(int(stream_helpers.get_vp9_tile_columns(height)),
+                                    max_columns))
 
         self.encoder_flags = ['-c:v', 'libvpx-vp9', '-crf', self.crf, '-b:v',
                               '0', '-g', '240', '-deadline', 'good',
                               '-cpu-used', '2', '-tile-columns', self.tile_columns,
-                              '-row-mt', '1', '-threads', settings.cpu_threads,
+                              '-row-mt', '1', '-threads', self.cpu_threads,
                               '-profile:v', '2', '-pix_fmt', 'yuv420p10le']
 
     def _set_metadata(self):
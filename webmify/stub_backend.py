@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+from pathlib import Path, PurePath
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+
+# ffmpeg options which take no value
+_no_value = {'-y', '-n', '-an', '-sn', '-vn', '-dn', '-nostats', '-shortest'}
+
+# outputs which are not files
+_no_file = ('/dev/null', 'pipe:', '-')
+
+_loudnorm_json = """[Parsed_loudnorm_0 @ 0x0]
+{{
+\t"input_i" : "-27.61",
+\t"input_tp" : "-4.47",
+\t"input_lra" : "18.06",
+\t"input_thresh" : "-39.20",
+\t"output_i" : "-16.58",
+\t"output_tp" : "-1.50",
+\t"output_lra" : "{output_lra:.2f}",
+\t"output_thresh" : "-27.71",
+\t"normalization_type" : "dynamic",
+\t"target_offset" : "0.58"
+}}"""
+
+
+@dataclass
+class StubBackend:
+    """Stands in for ffmpeg and ffprobe, see
+    ffmpeg_runner.backend. Nothing is decoded: probes are
+    answered from fixture json and encodes touch their
+    outputs, so a whole wrapper runs in milliseconds and
+    only the orchestration is measured. Every command is
+    logged to commands.
+
+    Probes are looked up by file name, falling back to
+    default_probe. Video outputs keep the frame count of
+    the part of the source they cover, so segmented
+    encodes pass their frame count checks. Loudness
+    measurements report output_lra[n] after n earlier
+    passes are applied, the last value repeating, to drive
+    the normalization passes.
+
+    Attributes:
+        probes: file name: ffprobe -show_streams -show_format json
+        default_probe: json for files not in probes, None to fail
+        output_lra: predicted output LRA per normalization pass
+        crop: reported by cropdetect, '' for no match
+        keyframe_interval: packets between keyframes
+        output_bytes: size of every file written
+        fail: commands containing this exit with status 1, '' for none
+        commands: every command run, in order
+    """
+    probes: Dict[str, dict] = field(default_factory=dict)
+    default_probe: dict = None
+    output_lra: List[float] = field(default_factory=lambda: [7.0])
+    crop: str = '1920:800:0:140'
+    keyframe_interval: int = 48
+    output_bytes: int = 1024
+    fail: str = ''
+    commands: List[List[str]] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._frames = {}
+
+    @classmethod
+    def from_fixtures(cls, fixture_dir: PurePath, **kwargs) -> 'StubBackend':
+        """Load every <file name>.json in fixture_dir as the
+        probe of that file, and default.json as default_probe.
+
+        Parameters:
+        fixture_dir - directory of ffprobe json
+        kwargs - further StubBackend attributes
+        """
+        probes = {fixture.stem: json.loads(fixture.read_text())
+                  for fixture in Path(fixture_dir).glob('*.json')}
+        return cls(probes=probes, default_probe=probes.pop('default', None), **kwargs)
+
+    def launches(self, program: str = '', *contains: str) -> int:
+        """Return the number of commands run, optionally only
+        of program and containing every string of contains.
+
+        Parameters:
+        program - ex. 'ffprobe', '' for any
+        contains - ex. '-pass 1', matched against the command line
+        """
+        with self._lock:
+            commands = list(self.commands)
+
+        return sum(1 for cmd in commands
+                   if (not program or os.path.basename(cmd[0]) == program)
+                   and all(text in ' '.join(cmd) for text in contains))
+
+    def run(self, cmd: List[str]) -> Tuple[int, str, List[str]]:
+        """Run cmd, returning (returncode, stdout, stderr lines)."""
+        with self._lock:
+            self.commands.append(list(cmd))
+
+        if self.fail and self.fail in ' '.join(cmd):
+            return 1, '', [f'stub failure: {self.fail}']
+
+        if 'ffprobe' in os.path.basename(cmd[0]):
+            return self._ffprobe(cmd)
+        return self._ffmpeg(cmd)
+
+    def _probe(self, in_file: str) -> dict:
+        return self.probes.get(PurePath(in_file).name, self.default_probe)
+
+    def _source_frames(self, in_file: str) -> Tuple[int, float]:
+        """Return (packets, frame rate) of the first video stream."""
+        probe = self._probe(in_file) or {}
+        videos = [stream for stream in probe.get('streams', [])
+                  if stream.get('codec_type') == 'video']
+        if not videos:
+            return 0, 0.0
+
+        num, _, den = videos[0].get('avg_frame_rate', '24/1').partition('/')
+        rate = float(num) / float(den or 1)
+        frames = int(float(probe.get('format', {}).get('duration', 0)) * rate)
+        with self._lock:
+            return self._frames.get(os.path.realpath(in_file), frames), rate
+
+    def _ffprobe(self, cmd: List[str]) -> Tuple[int, str, List[str]]:
+        in_file = cmd[1]
+        if not os.path.exists(in_file):
+            return 1, '', [f'{in_file}: No such file or directory']
+
+        if '-count_packets' in cmd:
+            return 0, f'{self._source_frames(in_file)[0]}\n', []
+
+        if 'packet=pts_time,flags' in cmd:
+            frames, rate = self._source_frames(in_file)
+            return 0, ''.join(f'{num / rate:.6f},{"K" if num % self.keyframe_interval == 0 else "_"}__\n'
+                              for num in range(frames)), []
+
+        probe = self._probe(in_file)
+        if probe is None:
+            return 1, '', [f'{in_file}: Invalid data found when processing input']
+        return 0, json.dumps(probe), []
+
+    def _ffmpeg(self, cmd: List[str]) -> Tuple[int, str, List[str]]:
+        options = {}
+        inputs = []
+        outputs = []
+        args = iter(cmd[1:])
+        for arg in args:
+            if arg in _no_value:
+                continue
+            if arg.startswith('-'):
+                options[arg] = next(args, '')
+                if arg == '-i':
+                    inputs.append(options[arg])
+                continue
+            # -f null writes nothing
+            if options.get('-f') != 'null':
+                outputs.append(arg)
+
+        for in_file in inputs:
+            if not os.path.exists(in_file):
+                return 1, '', [f'{in_file}: No such file or directory']
+
+        stderr_lines = []
+        command_line = ' '.join(cmd)
+        if 'cropdetect' in command_line and self.crop:
+            stderr_lines.append(f'[Parsed_cropdetect_0 @ 0x0] x1:0 x2:1919 y1:140 y2:939 '
+                                f'w:1920 h:800 x:0 y:140 pts:0 t:0.000000 crop={self.crop}')
+        if 'print_format=json' in command_line:
+            applied = command_line.count('measured_I=')
+            output_lra = self.output_lra[min(applied, len(self.output_lra) - 1)]
+            stderr_lines += _loudnorm_json.format(output_lra=output_lra).splitlines()
+        if options.get('-pass') == '1':
+            Path(f"{options['-passlogfile']}-0.log").write_text('stub first pass statistics\n')
+
+        frames = self._output_frames(inputs, options)
+        for out_file in outputs:
+            if out_file.startswith(_no_file):
+                continue
+            if not Path(out_file).parent.is_dir():
+                return 1, '', [f'{out_file}: No such file or directory']
+            Path(out_file).write_bytes(b'\0' * self.output_bytes)
+            with self._lock:
+                self._frames[os.path.realpath(out_file)] = frames
+
+        return 0, '', stderr_lines
+
+    def _output_frames(self, inputs: List[str], options: Dict[str, str]) -> int:
+        """Video frames written from the first input, within
+        the -ss and -t window, or the sum of a concat list.
+        """
+        if not inputs:
+            return 0
+
+        if options.get('-f') == 'concat':
+            with open(inputs[0]) as concat_list:
+                chunk_files = [line.strip()[len("file '"):-1] for line in concat_list if line.strip()]
+            return sum(self._source_frames(chunk_file)[0] for chunk_file in chunk_files)
+
+        frames, rate = self._source_frames(inputs[0])
+        if not rate:
+            return frames
+
+        start = float(options.get('-ss', 0))
+        end = start + float(options['-t']) if '-t' in options else frames / rate
+        return sum(1 for num in range(frames) if start <= num / rate < end)
@@ -1,10 +1,13 @@
-import sys
 import tvdb_api
 import api_keys
+import metadata_cache
 
-from typing import NoReturn
+import threading
+from typing import List, NoReturn, Tuple
 from tvdb_api import tvdb_shownotfound, tvdb_seasonnotfound, tvdb_episodenotfound
 
+_local = threading.local()
+
 
 def display_episode(title: str, s_num: str, ep_num: str, episode: dict) -> NoReturn:
     print(f'\nEpisode Info:')
@@ -15,30 +18,51 @@ def display_episode(title: str, s_num: str, ep_num: str, episode: dict) -> NoRet
     print(f"Episode Summary: {episode['overview']}")
 
 
-def get_show(title: str) -> dict:
-    tvdb = tvdb_api.Tvdb(apikey=api_keys.thetvdb_key, interactive=True)
+def get_tvdb() -> tvdb_api.Tvdb:
+    """Return this thread's client. Clients never prompt,
+    and all of them send requests through the shared
+    metadata cache session.
+    """
+    if not hasattr(_local, 'tvdb'):
+        _local.tvdb = tvdb_api.Tvdb(apikey=api_keys.thetvdb_key,
+                                    interactive=False,
+                                    cache=metadata_cache.session())
+    return _local.tvdb
+
 
+def search_show(title: str) -> List[dict]:
+    """Return the series matching title, in TheTVDB's
+    order, empty if there are none.
+
+    Parameters:
+    title - series title for query
+    """
     try:
-        show = tvdb[title]
+        return get_tvdb().search(title)
     except tvdb_shownotfound:
-        print(f"Show '{title}' not found. Please enter a valid show title:'")
-        show_input = input()
+        return []
+
 
-        show_title = get_show(show_input)
-        return(show_title)
+def load_show(series_id: int) -> dict:
+    """Return the series with every episode loaded.
 
-    return show
+    Parameters:
+    series_id - TheTVDB id, from search_show
+    """
+    return get_tvdb()[int(series_id)]
 
 
-def get_file_metadata(show: dict, s_num: str, ep_num: str) -> str:
+def get_file_metadata(show: dict, s_num: str, ep_num: str,
+                      display: bool = True) -> Tuple[str, str]:
     try:
         episode = show[int(s_num)][int(ep_num)]
     except tvdb_seasonnotfound:
-        sys.exit("TV Season '{s_num}' not found. Try modifying the season with the --season flag.")
+        raise LookupError(f"TV Season '{s_num}' not found. Try modifying the season with the --season flag.")
     except tvdb_episodenotfound:
-        sys.exit("TV Episode '{ep_num}' not found. Try modifying the episode with the --episode flag.")
+        raise LookupError(f"TV Episode '{ep_num}' not found. Try modifying the episode with the --episode flag.")
 
-    display_episode(show['seriesName'], s_num, ep_num, episode)
+    if display:
+        display_episode(show['seriesName'], s_num, ep_num, episode)
 
     return (f"{show['seriesName']} - S{s_num}E{ep_num} - {episode['episodeName']}",
             episode['overview'])
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import itertools
+import threading
+import contextvars
+from pathlib import PurePath
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+
+enabled = False
+"""When True, spans and counters are recorded for a trace
+event file, viewable in chrome://tracing or Perfetto.
+Set by start, see --trace."""
+
+_events = []
+_lock = threading.Lock()
+_origin = time.monotonic()
+_job = contextvars.ContextVar('timeline_job', default=0)
+_job_ids = itertools.count(1)
+_run_ids = itertools.count(1)
+_threads: Dict[Tuple[int, int], int] = {}
+
+
+def _now() -> float:
+    # trace timestamps are microseconds
+    return (time.monotonic() - _origin) * 1e6
+
+
+def _emit(event: Dict) -> None:
+    with _lock:
+        _events.append(event)
+
+
+def _metadata(name: str, pid: int, tid: int, value: str) -> Dict:
+    return {'ph': 'M', 'name': name, 'pid': pid, 'tid': tid, 'args': {'name': value}}
+
+
+def _tid(lane: str) -> int:
+    """Return the track of the calling thread within the
+    current job, named after the first span opened on it.
+    """
+    pid = _job.get()
+    key = (pid, threading.get_ident())
+    with _lock:
+        if key not in _threads:
+            _threads[key] = len([other for other in _threads if other[0] == pid]) + 1
+            _events.append(_metadata('thread_name', pid, _threads[key], lane))
+        return _threads[key]
+
+
+def start() -> None:
+    """Start recording, discarding anything recorded before."""
+    global enabled, _origin
+    with _lock:
+        _events.clear()
+        _threads.clear()
+        _events.append(_metadata('process_name', 0, 0, 'webmify batch'))
+        _origin = time.monotonic()
+    enabled = True
+
+
+@contextmanager
+def job(name: str) -> Iterator[int]:
+    """Record everything within, including threads started
+    from a copied context, on the job's own track group.
+
+    Parameters:
+    name - job name, ex. the input filename
+    """
+    if not enabled:
+        yield 0
+        return
+
+    pid = next(_job_ids)
+    _emit(_metadata('process_name', pid, 0, name))
+    token = _job.set(pid)
+    try:
+        yield pid
+    finally:
+        _job.reset(token)
+
+
+@contextmanager
+def span(name: str, category: str = 'stage', **args) -> Iterator[None]:
+    """Record the time spent within as a span on the calling
+    thread's track.
+
+    Parameters:
+    name - span name, ex. 'VP9 Encode'
+    category - trace category
+    args - shown with the span
+    """
+    if not enabled:
+        yield
+        return
+
+    tid = _tid(name)
+    start = _now()
+    try:
+        yield
+    finally:
+        _emit({'ph': 'X', 'name': name, 'cat': category, 'pid': _job.get(), 'tid': tid,
+               'ts': start, 'dur': _now() - start, 'args': args})
+
+
+def begin_run(name: str, cmd: list) -> int:
+    """Record the start of a process, which may overlap
+    others on the same thread. Returns the id for end_run.
+
+    Parameters:
+    name - run title, ex. 'VP9 First Pass'
+    cmd - command run
+    """
+    if not enabled:
+        return 0
+
+    run_id = next(_run_ids)
+    _emit({'ph': 'b', 'name': name, 'cat': 'process', 'id': run_id, 'pid': _job.get(),
+           'ts': _now(), 'args': {'cmd': ' '.join(cmd)}})
+    return run_id
+
+
+def end_run(name: str, run_id: int, **args) -> None:
+    """Record the end of a process started with begin_run."""
+    if not enabled:
+        return
+
+    _emit({'ph': 'e', 'name': name, 'cat': 'process', 'id': run_id, 'pid': _job.get(),
+           'ts': _now(), 'args': args})
+
+
+def counter(name: str, value: float) -> None:
+    """Record a sample of a counter of the current job,
+    ex. encoder fps.
+    """
+    if not enabled:
+        return
+
+    _emit({'ph': 'C', 'name': name, 'pid': _job.get(), 'ts': _now(),
+           'args': {'value': value}})
+
+
+def write(trace_file: PurePath) -> None:
+    """Write every event recorded so far."""
+    with _lock:
+        events = list(_events)
+
+    tmp_file = f'{trace_file}.part'
+    with open(tmp_file, 'w') as trace:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+    os.replace(tmp_file, trace_file)
+    print(f'Trace: {trace_file}')
@@ -1,5 +1,5 @@
-import sys
 import api_keys
+import metadata_cache
 import tmdbsimple as tmdb
 
 from typing import List, NoReturn, Tuple
@@ -8,30 +8,6 @@ from typing import List, NoReturn, Tuple
 tmdb.API_KEY = api_keys.tmdb_key
 
 
-def get_choice(search_response: dict) -> dict:
-    """Obtain user choice for multiple search results.
-    Return specified result.
-
-    Parameters:
-    search_response -- raw search return from TMDb
-    """
-    print('\nMultiple matches found. Select from:')
-
-    for index, result in enumerate(search_response['results']):
-        try:
-            print(f"[{index}]: {result['name']}, "
-                  f"{result['first_air_date'][:4]} "
-                  f"(https://www.themoviedb.org/tv/{result['id']})")
-        except KeyError:
-            print(f"[{index}]: {result['title']}, "
-                  f"{result['release_date'][:4]} "
-                  f"(https://www.themoviedb.org/movie/{result['id']})")
-
-    user_choice = input('Result number: ')
-
-    return search_response['results'][int(user_choice)]
-
-
 def find_movie(title: str) -> dict:
     """TMDb movie specific search.
     Returns unprocessed api return.
@@ -39,10 +15,27 @@ def find_movie(title: str) -> dict:
     Parameters:
     title - movie title for query
     """
+    tmdb.REQUESTS_SESSION = metadata_cache.session()
     search = tmdb.Search()
     return search.movie(query=title)
 
 
+def search_movies(title: str) -> List[dict]:
+    """Return the movies matching title, in TMDb's
+    order, empty if there are none.
+
+    Parameters:
+    title - movie title for query
+    """
+    return find_movie(title)['results']
+
+
+def movie_metadata(movie_info: dict) -> Tuple[str, str]:
+    """Return (file title, summary) for a TMDb movie result."""
+    return (f"{movie_info['title']} ({movie_info['release_date'][0:4]})",
+            movie_info['overview'])
+
+
 def display_movie(movie_info: dict) -> NoReturn:
     """Display movie information"""
     print(f"\nMovie URL:\nhttps://www.themoviedb.org/movie/{movie_info['id']}")
@@ -51,20 +44,3 @@ def display_movie(movie_info: dict) -> NoReturn:
     print(f"Release Date: {movie_info['release_date']}")
     print(f"Synopsis: {movie_info['overview']}")
 
-
-def get_movie_info(title: str) -> Tuple[str, str, str]:
-    search_response = find_movie(title)
-
-    if search_response['total_results'] == 0:
-        sys.exit('No match found. Try modifying the title flag.')
-    elif search_response['total_results'] == 1:
-        movie_info = search_response['results'][0]
-    else:
-        movie_info = get_choice(search_response)
-
-    title = f"{movie_info['title']} ({movie_info['release_date'][0:4]})"
-
-    display_movie(movie_info)
-
-    return (title,
-            movie_info['overview'])
@@ -1,18 +1,107 @@
 #!/usr/bin/python3
-import tmdb_lookup
+import artifact_cache
 import input_parser
+import journal
+import library_scan
+import metadata_cache
+import passlog_cache
+import planner
+import profiler
+import probe_cache
+import scheduler
+import settings
 import stream_helpers
-import thetvdb_lookup
+import timeline
 import wrapper
 
 import re
 import sys
+import atexit
+import json
+import time
 from pathlib import Path
 from optparse import OptionParser, OptionGroup
 
 
+def cache_main(args):
+    parser = OptionParser(usage='%prog cache [list | prune | clear] [options]')
+
+    parser.add_option('--max-size',
+                      action='store', type='int', dest='max_size',
+                      default=settings.artifact_cache_max_bytes,
+                      help='prune the artifact cache to this many bytes, '
+                           f'default = {settings.artifact_cache_max_bytes}')
+
+    (options, args) = parser.parse_args(args)
+    command = args[0] if args else 'list'
+
+    if command == 'list':
+        entries = artifact_cache.entries()
+        for entry in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['accessed']))
+            print(f"{entry['key'][:12]}  {entry['size'] / 2**20:10.1f} MiB  "
+                  f"{last_used}  {entry['description']}")
+        total = sum(entry['size'] for entry in entries)
+        print(f'\n{len(entries)} stages, {total / 2**30:.2f} GiB in {settings.artifact_cache_dir}')
+    elif command == 'prune':
+        removed = artifact_cache.evict(max_bytes=options.max_size)
+        print(f'Removed {removed} stages from {settings.artifact_cache_dir}')
+    elif command == 'clear':
+        removed = artifact_cache.evict(max_bytes=0)
+        print(f'Removed {removed} stages from {settings.artifact_cache_dir}')
+    else:
+        parser.error(f'unknown cache command: {command}')
+
+
+def scan_main(args):
+    parser = OptionParser(usage='%prog scan <library directories> [options]')
+
+    parser.add_option('--index',
+                      action='store', type='string', dest='index_file',
+                      default='',
+                      help='write a JSON index of movies, shows, seasons and episodes')
+
+    parser.add_option('--list',
+                      action='store_true', dest='list_files',
+                      default=False,
+                      help='print one source file per line, default = false')
+
+    (options, args) = parser.parse_args(args)
+    if not args:
+        parser.error('no library directory given')
+
+    start = time.perf_counter()
+    entries = [entry for root in args for entry in library_scan.scan(root)]
+    elapsed = time.perf_counter() - start
+
+    if options.list_files:
+        for entry in entries:
+            print(entry.file)
+
+    library_index = library_scan.index(entries)
+    if options.index_file:
+        with open(options.index_file, 'w') as index_file:
+            json.dump(library_index, index_file, indent=2)
+
+    episodes = sum(len(season) for show in library_index['shows'].values()
+                   for season in show.values())
+    print(f"\n{len(library_index['movies'])} movies, {len(library_index['shows'])} shows, "
+          f"{episodes} episodes, {library_index['bytes'] / 2**30:.2f} GiB, "
+          f'scanned in {elapsed:.2f}s', file=sys.stderr)
+
+
 def main():
-    parser = OptionParser(usage='%prog <input files, can batch using *> [options]')
+    if sys.argv[1:2] == ['cache']:
+        cache_main(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ['scan']:
+        scan_main(sys.argv[2:])
+        return
+
+    parser = OptionParser(usage='%prog <input files, can batch using *> [options]\n'
+                                '       %prog cache [list | prune | clear] [options]\n'
+                                '       %prog scan <library directories> [options]')
 
     ffmpeg_opts = OptionGroup(parser,
                               'Encoding Options',
@@ -33,11 +122,25 @@ def main():
                            default=0,
                            help='Apply bm3d filter at specified strength')
 
+    ffmpeg_opts.add_option('--direct-mux',
+                           action='store_true', dest='direct_mux',
+                           default=False,
+                           help='mux audio and subtitles during the final VP9 '
+                                'write instead of remuxing afterwards; chromecast '
+                                'encodes always remux, so x264 starts without '
+                                'waiting for the audio, default = false')
+
     ffmpeg_opts.add_option('--external-subs',
                            action='store_true', dest='ext_subs',
                            default=False,
                            help='include external subtitles with shared base name, srt format')
 
+    ffmpeg_opts.add_option('--filter-once',
+                           action='store_true', dest='filter_once',
+                           default=False,
+                           help='render VP9 video filters once to a lossless '
+                                'intermediate shared by both passes, default = false')
+
     ffmpeg_opts.add_option('--no-subs',
                            action='store_true', dest='no_subs',
                            default=False,
@@ -48,6 +151,12 @@ def main():
                            default='19',
                            help='set encoding quality, default = 19')
 
+    ffmpeg_opts.add_option('--segments',
+                           action='store', type='int', dest='segments',
+                           default=0,
+                           help='split VP9 encodes at keyframes into this many '
+                                'chunks encoded in parallel, default = 0 (off)')
+
     ffmpeg_opts.add_option('--sub-id',
                            action='store', type='string', dest='sub_id',
                            default='0',
@@ -55,8 +164,9 @@ def main():
 
     ffmpeg_opts.add_option('--threads',
                            action='store', type='string', dest='thread_count',
-                           default='16',
-                           help='number of cpu threads, default = 16')
+                           default=settings.cpu_threads,
+                           help='total cpu threads shared by all encodes, '
+                                f'default = {settings.cpu_threads}')
 
     parser.add_option_group(ffmpeg_opts)
 
@@ -70,6 +180,16 @@ def main():
                          default='',
                          help='tv series episode number')
 
+    tmdb_opts.add_option('--non-interactive',
+                         action='store_true', dest='non_interactive',
+                         default=False,
+                         help='never prompt, take the top ranked match, default = false')
+
+    tmdb_opts.add_option('--offline',
+                         action='store_true', dest='offline',
+                         default=False,
+                         help='use only cached metadata, however old, default = false')
+
     tmdb_opts.add_option('--season',
                          action='store', type='string', dest='season_num',
                          default='',
@@ -82,6 +202,12 @@ def main():
 
     parser.add_option_group(tmdb_opts)
 
+    parser.add_option('--cache',
+                      action='store_true', dest='cache',
+                      default=False,
+                      help='store and reuse encode stage outputs, '
+                           'see: webmify cache, default = false')
+
     parser.add_option('--delete',
                       action='store_true', dest='del_orig',
                       default=False,
@@ -92,11 +218,61 @@ def main():
                       default=False,
                       help='prefer dvd episode order, default = false')
 
+    parser.add_option('--ffmpeg',
+                      action='store', type='string', dest='ffmpeg_bin',
+                      default=settings.ffmpeg_bin,
+                      help=f'ffmpeg executable, default = {settings.ffmpeg_bin}')
+
+    parser.add_option('--ffprobe',
+                      action='store', type='string', dest='ffprobe_bin',
+                      default=settings.ffprobe_bin,
+                      help=f'ffprobe executable, default = {settings.ffprobe_bin}')
+
+    parser.add_option('-j', '--jobs',
+                      action='store', type='int', dest='jobs',
+                      default=1,
+                      help='number of files encoded at once, default = 1')
+
     parser.add_option('-o', '--output', '--out',
                       action='store', type='string', dest='out_file',
                       default='',
                       help='output filename')
 
+    parser.add_option('--profile',
+                      action='store_true', dest='profile',
+                      default=False,
+                      help='report time, cpu, memory and i/o of every stage, '
+                           f'written to {settings.profile_dir}, default = false')
+
+    parser.add_option('--refresh-probe',
+                      action='store_true', dest='refresh_probe',
+                      default=False,
+                      help='ignore cached probe and crop results, default = false')
+
+    parser.add_option('--restart',
+                      action='store_true', dest='restart',
+                      default=False,
+                      help='discard the journals of interrupted encodes and '
+                           'encode every stage again, default = false')
+
+    parser.add_option('--scan',
+                      action='append', type='string', dest='scan_dirs',
+                      default=[],
+                      help='queue every source found below this library directory, '
+                           'may be repeated, see: webmify scan')
+
+    parser.add_option('--scratch',
+                      action='store', type='string', dest='scratch_dir',
+                      default=settings.scratch_dir,
+                      help='directory for intermediate files, ex. on tmpfs or '
+                           'local NVMe, default = beside the output')
+
+    parser.add_option('--trace',
+                      action='store', type='string', dest='trace_file',
+                      default='',
+                      help='write a trace event timeline of the batch to this file, '
+                           'for chrome://tracing or Perfetto')
+
     parser.add_option('--test',
                       action='store_true', dest='test_run_bool',
                       default=False,
@@ -104,111 +280,152 @@ def main():
 
     (options, args) = parser.parse_args()
 
+    settings.ffmpeg_bin = options.ffmpeg_bin
+    settings.ffprobe_bin = options.ffprobe_bin
+    probe_cache.refresh = options.refresh_probe
+    artifact_cache.enabled = options.cache
+    metadata_cache.offline = options.offline
+    profiler.enabled = options.profile
+    if options.trace_file:
+        timeline.start()
+        atexit.register(timeline.write, options.trace_file)
+    probe_cache.evict()
+    passlog_cache.evict()
+
     work_list = [Path(file) for file in args]
+    for scan_dir in options.scan_dirs:
+        work_list += [entry.file for entry in library_scan.scan(scan_dir)]
 
-    orig_out_file = options.out_file
-    prev_file = None
+    plans = []
+    sub_files = {}
     for file in work_list:
-        print('\n\nX        NEW ENCODE        X\n\n')
+        media_info = stream_helpers.probe(file)
+        eng_subs = [stream for stream in media_info.subtitle_streams
+                    if stream.language == 'eng']
 
         if options.ext_subs:
-            sub_file = file.with_suffix('.srt')
+            sub_files[file] = file.with_suffix('.srt')
         elif options.no_subs:
-            sub_file = ''
-        elif (stream_helpers.get_sub_stream(file) and
-              stream_helpers.get_sub_type(file, options.sub_id) != 'hdmv_pgs_subtitle'):
-            sub_file = file
+            sub_files[file] = ''
+        elif (eng_subs and
+              int(options.sub_id) < len(media_info.subtitle_streams) and
+              media_info.subtitle(options.sub_id).codec_name != 'hdmv_pgs_subtitle'):
+            sub_files[file] = file
         else:
-            sub_file = ''
+            sub_files[file] = ''
+
+        plan = planner.FilePlan(file=file,
+                                media_info=media_info,
+                                title=options.media_title or input_parser.get_title(file),
+                                is_movie=input_parser.is_movie(file))
+        if not plan.is_movie:
+            plan.season = options.season_num or input_parser.get_season(file)
+            plan.episode = options.episode_num or input_parser.get_episode(file)
+        plans.append(plan)
+
+    # every title is resolved, and every question asked,
+    # before the first encode starts
+    with timeline.span('Metadata Lookup', category='metadata'):
+        planner.resolve(plans, interactive=not options.non_interactive)
+
+    unresolved = [plan for plan in plans if plan.error]
+    for plan in unresolved:
+        print(f'\nSkipping {plan.file}: {plan.error}')
 
-        if not input_parser.is_batch_repeat(prev_file, file):
-            if not options.media_title:
-                title = input_parser.get_title(file)
-            else:
-                title = options.media_title
-
-        if input_parser.is_movie(file):
-            file_title, file_summary = tmdb_lookup.get_movie_info(title)
-
-            wrapper.ChromecastWrapper(in_file=file,
-                                      out_file=options.out_file,
-                                      file_title=file_title,
-                                      file_summary=file_summary,
-                                      crf=options.crf,
-                                      crop=options.crop,
-                                      denoise=options.denoise,
-                                      sub_file=sub_file)
+    orig_out_file = options.out_file
+    jobs = []
+    for plan in plans:
+        if plan.error:
+            continue
+
+        file = plan.file
+        media_info = plan.media_info
+        sub_file = sub_files[file]
+        file_title = plan.file_title
+        file_summary = plan.file_summary
+
+        if plan.is_movie:
+            wrapper_class = wrapper.ChromecastWrapper
         else:
-            if options.season_num:
-                tv_season = options.season_num
-            else:
-                tv_season = input_parser.get_season(file)
-
-            if options.episode_num:
-                tv_episode = options.episode_num
-            else:
-                tv_episode = input_parser.get_episode(file)
-
             if options.out_file:
-                options.out_file = Path(orig_out_file).with_suffix(f'.s{tv_season}e{tv_episode}.webm')
+                options.out_file = Path(orig_out_file).with_suffix(f'.s{plan.season}e{plan.episode}.webm')
 
-            if not input_parser.is_batch_repeat(prev_file, file):
-                show = thetvdb_lookup.get_show(title)
-                file_title = show['seriesName']
-
-            file_title, file_summary = thetvdb_lookup.get_file_metadata(show,
-                                                                        tv_season,
-                                                                        tv_episode)
-
-            if int(stream_helpers.get_audio_ch(in_file=file, audio_id='0')) > 2:
+            if media_info.audio('0').channels > 2:
                 if options.burn_subs or not sub_file:
-                    wrapper.TVMultiChannelWrapper(in_file=file,
-                                                  out_file=options.out_file,
-                                                  file_title=file_title,
-                                                  file_summary=file_summary,
-                                                  burn_subs=options.burn_subs,
-                                                  crf=options.crf,
-                                                  crop=options.crop,
-                                                  denoise=options.denoise,
-                                                  sub_file=sub_file)
+                    wrapper_class = wrapper.TVMultiChannelWrapper
                 else:
-                    wrapper.TVMultiChannelSubtitleWrapper(in_file=file,
-                                                          out_file=options.out_file,
-                                                          file_title=file_title,
-                                                          file_summary=file_summary,
-                                                          crf=options.crf,
-                                                          crop=options.crop,
-                                                          denoise=options.denoise,
-                                                          sub_file=sub_file)
+                    wrapper_class = wrapper.TVMultiChannelSubtitleWrapper
             else:
                 if options.burn_subs or not sub_file:
-                    wrapper.TVStereoWrapper(in_file=file,
-                                            out_file=options.out_file,
-                                            file_title=file_title,
-                                            file_summary=file_summary,
-                                            burn_subs=options.burn_subs,
-                                            crf=options.crf,
-                                            crop=options.crop,
-                                            denoise=options.denoise,
-                                            sub_file=sub_file)
+                    wrapper_class = wrapper.TVStereoWrapper
                 else:
-                    wrapper.TVStereoSubtitleWrapper(in_file=file,
-                                                    out_file=options.out_file,
-                                                    file_title=file_title,
-                                                    file_summary=file_summary,
-                                                    crf=options.crf,
-                                                    crop=options.crop,
-                                                    denoise=options.denoise,
-                                                    sub_file=sub_file)
+                    wrapper_class = wrapper.TVStereoSubtitleWrapper
+
+        out_dir = Path(options.out_file).parent if options.out_file else file.parent
+        if options.scratch_dir:
+            scratch_dir = Path(options.scratch_dir)
+            scratch_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            scratch_dir = out_dir
+        # the muxed part_file is written beside the output
+        with_output = not out_dir.exists() or scratch_dir.stat().st_dev == out_dir.stat().st_dev
+
+        # direct mux and segments apply to the VP9 encodes only
+        is_vp9 = wrapper_class is not wrapper.ChromecastWrapper
+        scratch_bytes = stream_helpers.estimate_scratch_bytes(media_info,
+                                                              filter_once=options.filter_once,
+                                                              direct_mux=is_vp9 and options.direct_mux,
+                                                              segments=options.segments if is_vp9 else 0,
+                                                              with_output=with_output)
+
+        out_journal = journal.Journal(journal.output_path(options.out_file or file))
+        if options.restart:
+            out_journal.remove()
+        elif out_journal.entries:
+            print(f'\nResuming interrupted encode of {file}, journal: {out_journal.path}')
+
+        job = scheduler.Job(in_file=file,
+                            wrapper_class=wrapper_class,
+                            scratch_dir=scratch_dir,
+                            scratch_bytes=scratch_bytes,
+                            wrapper_args=dict(out_file=options.out_file,
+                                              file_title=file_title,
+                                              file_summary=file_summary,
+                                              burn_subs=options.burn_subs,
+                                              crf=options.crf,
+                                              crop=options.crop,
+                                              denoise=options.denoise,
+                                              direct_mux=options.direct_mux,
+                                              filter_once=options.filter_once,
+                                              scratch_dir=options.scratch_dir,
+                                              segments=options.segments,
+                                              sub_file=sub_file,
+                                              media_info=media_info,
+                                              journal=out_journal))
 
         if options.del_orig:
             if options.ext_subs:
-                print(f'Deleting external subtitle file: {sub_file}')
-                sub_file.unlink()
-            print(f'Deleting input file: {file}')
-            file.unlink()
-
-        prev_file = file
+                job.delete_files.append(sub_file)
+            job.delete_files.append(file)
+
+        jobs.append(job)
+
+    failed = scheduler.run_jobs(jobs,
+                                max_jobs=options.jobs,
+                                cpu_threads=options.thread_count)
+    for job in jobs:
+        if job not in failed:
+            job.wrapper_args['journal'].remove()
+
+    errors = []
+    if failed:
+        errors.append(f"{len(failed)} of {len(jobs)} encodes failed: "
+                      f"{', '.join(str(job.in_file) for job in failed)}")
+    if unresolved:
+        errors.append(f"{len(unresolved)} files skipped, no metadata: "
+                      f"{', '.join(str(plan.file) for plan in unresolved)}")
+    if errors:
+        sys.exit('\n' + '\n'.join(errors))
 
 
 if __name__ == '__main__':
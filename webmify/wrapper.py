@@ -1,9 +1,21 @@
 import settings
+import profiler
+import timeline
+import probe_cache
 import encode_object
-
-import subprocess
+import ffmpeg_runner
+import stream_helpers
+from journal import Journal, stage_key
+from media_info import MediaInfo
+
+import os
+import hashlib
+import threading
+import contextvars
+from functools import partial
 from pathlib import Path, PurePath
-from typing import List, NoReturn, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NoReturn, Tuple
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 
@@ -12,6 +24,33 @@ from dataclasses import dataclass, field
 class WrapperObject(ABC):
     """Abstract Wrapper for accumulating and
     constructing mkvmerge parameters.
+
+    The source is probed once, here, and the resulting
+    media_info is shared by every encode stage.
+
+    By default every stage writes an intermediate file and
+    wrap() copies them into out_file. With direct_mux, the
+    video stage's final write produces out_file itself,
+    taking the finished audio and subtitle intermediates as
+    extra inputs, so the video is written only once. Only
+    the VP9 wrappers honor it, as their first pass overlaps
+    the audio stages.
+
+    journal is shared with every stage. A wrapper whose
+    output was recorded by an earlier run is skipped.
+
+    Stages write their intermediates to a subdirectory of
+    scratch_dir named by a hash of out_file, so outputs of
+    the same name in a batch never share intermediates, or
+    beside out_file if scratch_dir is None. The muxed file is written
+    to a hidden part_file beside out_file and renamed into
+    place once complete, so out_file is never partial.
+
+    cancel is shared with every stage and set once any
+    stage fails, stopping the others' ffmpeg runs early.
+
+    With profiler enabled, every stage and the mux are
+    profiled and a report is written per out_file.
     """
 
     in_file: PurePath
@@ -19,17 +58,29 @@ class WrapperObject(ABC):
     file_title: str
     file_summary: str
     wrap_cmd: List[str] = field(default_factory=list)
+    wrap_title: str = ''
 
     burn_subs: bool = False
+    cpu_threads: str = settings.cpu_threads
     crf: 'str' = '19'
     crop: bool = False
     denoise: bool = False
+    direct_mux: bool = False
+    filter_once: bool = False
+    scratch_dir: PurePath = settings.scratch_dir
+    segments: int = 0
     sub_file: PurePath = ''
+    media_info: MediaInfo = None
+    journal: Journal = None
+    cancel: threading.Event = field(default_factory=threading.Event)
 
     def __post_init__(self):
         if not isinstance(self.in_file, PurePath):
             self.in_file = Path(self.in_file)
 
+        if self.media_info is None:
+            self.media_info = stream_helpers.probe(self.in_file)
+
         if not self.out_file:
             # self.out_file = Path('.') / (self.in_file.stem + '.out.mkv')
             self.out_file = self.in_file
@@ -40,10 +91,175 @@ class WrapperObject(ABC):
         if not isinstance(self.sub_file, PurePath):
             self.sub_file = Path(self.sub_file)
 
+    def _set_files(self) -> None:
+        """Set stage_file, the name stages derive their
+        intermediates from, and part_file, once out_file has
+        its final suffix.
+        """
+        if self.scratch_dir:
+            out_hash = hashlib.sha256(str(Path(self.out_file).resolve()).encode()).hexdigest()
+            scratch_dir = Path(self.scratch_dir) / out_hash[:16]
+        else:
+            scratch_dir = self.out_file.parent
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+
+        self.stage_file = scratch_dir / self.out_file.name
+        self.part_file = self.out_file.with_name(f'.{self.out_file.stem}.part{self.out_file.suffix}')
+
+    def _run(self, stages: Dict[str, Callable]) -> None:
+        """Run the stages and mux their outputs, unless
+        the journal shows out_file is already complete.
+        """
+        if self.journal is not None:
+            wrap_key = stage_key(type(self).__name__,
+                                 probe_cache.file_key(self.in_file),
+                                 str(self.out_file), self.file_title, self.file_summary,
+                                 self.burn_subs, self.crf, self.crop, self.denoise,
+                                 str(self.sub_file))
+            if self.journal.is_done(wrap_key):
+                print(f'\n\nSkipping: {self.out_file}, finished by an earlier run')
+                return
+
+        with profiler.title(self.out_file.name) as title_profile:
+            try:
+                self._run_stages(stages)
+                self._finish()
+            finally:
+                if title_profile is not None:
+                    profiler.write_report(title_profile)
+
+        if self.journal is not None:
+            self.journal.record(wrap_key, [self.out_file])
+
+    def _run_stages(self, stages: Dict[str, Callable]) -> None:
+        """Run independent encode stages concurrently and
+        assign each finished stage to the attribute it is
+        keyed by. Every stage is joined before returning.
+        If any stage fails, the first failure is re-raised.
+        Failed stages remove their own partial outputs;
+        finished stages keep theirs when the journal has
+        recorded them, for the next run to resume from.
+
+        Parameters:
+        stages - attribute name: callable returning an EncodeObject
+        """
+        self._stages_submitted = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            # stages keep this thread's context, for the profiler
+            self._stage_futures = {name: executor.submit(contextvars.copy_context().run, stage)
+                                   for name, stage in stages.items()}
+            self._stages_submitted.set()
+            for future in self._stage_futures.values():
+                future.add_done_callback(self._cancel_on_failure)
+        futures = self._stage_futures
+
+        # stages stopped by cancel are reported after the cause
+        failures = sorted((future.exception() for future in futures.values()
+                           if future.exception() is not None),
+                          key=lambda error: isinstance(error, encode_object.EncodeCancelled))
+
+        if failures:
+            for future in futures.values():
+                if future.exception() is not None:
+                    continue
+                stage = future.result()
+                if self.journal is not None and self.journal.is_done(stage.stage_key):
+                    continue
+                for out_file in stage.outputs():
+                    if out_file.exists():
+                        print(f'Deleting unused output: {out_file}')
+                        out_file.unlink()
+            if self.part_file.exists():
+                print(f'Deleting partial output: {self.part_file}')
+                self.part_file.unlink()
+            raise failures[0]
+
+        for name, future in futures.items():
+            setattr(self, name, future.result())
+
+    def _cancel_on_failure(self, future) -> None:
+        if future.exception() is not None:
+            self.cancel.set()
+
+    def _mux_args(self) -> Tuple[List[str], List[str]]:
+        """Handed to the video stage when direct_mux is set.
+        Waits for every other stage, then returns the input
+        and output flags adding their renditions to the video
+        stage's final write.
+        """
+        self._stages_submitted.wait()
+        for name, future in self._stage_futures.items():
+            if name != 'video_stream':
+                setattr(self, name, future.result())
+
+        input_flags = []
+        output_flags = []
+        for num, mux_input in enumerate(self._mux_inputs(), start=1):
+            input_flags += ['-i', mux_input]
+            output_flags += ['-map', f'{num}:0']
+
+        return input_flags, output_flags + self._mux_flags()
+
     @abstractmethod
-    def wrap(self) -> NoReturn:
+    def _mux_inputs(self) -> List[PurePath]:
+        """Rendition files muxed after the video, in order."""
         pass
 
+    @abstractmethod
+    def _mux_flags(self) -> List[str]:
+        """Output flags for the muxed file, other than the
+        video codec.
+        """
+        pass
+
+    def _finish(self) -> None:
+        if not self.direct_mux:
+            with profiler.stage(self.wrap_title, lambda: [self.part_file]):
+                with timeline.span(self.wrap_title):
+                    self.wrap()
+        else:
+            print('\n\nClean-up:')
+            with timeline.span('Clean-up'):
+                for mux_input in self._mux_inputs():
+                    print(f'Deleting intermediate file: {mux_input}')
+                    mux_input.unlink()
+
+        print(f'Moving into place: {self.out_file}')
+        os.replace(self.part_file, self.out_file)
+
+        if self.scratch_dir:
+            try:
+                self.stage_file.parent.rmdir()
+            except OSError:
+                # left in place while anything remains in it
+                pass
+
+    def wrap(self) -> NoReturn:
+        mux_files = [self.video_stream.out_file] + self._mux_inputs()
+
+        self.wrap_cmd = [settings.ffmpeg_bin, '-y']
+        for mux_file in mux_files:
+            self.wrap_cmd += ['-i', mux_file]
+        for num in range(len(mux_files)):
+            self.wrap_cmd += ['-map', f'{num}:0']
+        self.wrap_cmd += ['-c:v', 'copy'] + self._mux_flags() + [self.part_file]
+
+        print(f'\n\nRunning: {self.wrap_title}')
+        print(f"Command: {' '.join(str(element) for element in self.wrap_cmd)}\n")
+        self.run_result = ffmpeg_runner.run(self.wrap_cmd,
+                                            title=self.wrap_title,
+                                            progress=True,
+                                            timeout=settings.encode_timeout)
+        if self.run_result.returncode != 0:
+            raise encode_object.EncodeError(f'{self.wrap_title} failed for {self.in_file} '
+                                            f'(ffmpeg exit status {self.run_result.returncode})')
+
+        print('\n\nClean-up:')
+        with timeline.span('Clean-up'):
+            for mux_file in mux_files:
+                print(f'Deleting intermediate file: {mux_file}')
+                mux_file.unlink()
+
 
 @dataclass
 class ChromecastWrapper(WrapperObject):
@@ -54,40 +270,41 @@ class ChromecastWrapper(WrapperObject):
         self.crop = True
         if self.sub_file:
             self.burn_subs = True
+        # x264 has no first pass to overlap the audio with,
+        # muxing directly would hold it until the audio is done
+        self.direct_mux = False
         super().__post_init__()
 
+        self.wrap_title = 'Chromecast Wrapper'
         self.out_file = self.out_file.with_suffix('.chromecast.mp4')
-        self.video_stream = encode_object.ChromecastEncode(in_file=self.in_file,
-                                                           out_file=self.out_file,
-                                                           burn_subs=self.burn_subs,
-                                                           crf=self.crf,
-                                                           crop=self.crop,
-                                                           denoise=self.denoise,
-                                                           sub_file=self.sub_file)
-        self.audio_stream = encode_object.AACNormalizedDownmixEncode(in_file=self.in_file,
-                                                                     out_file=self.out_file)
-
-        self.wrap()
-
-    def wrap(self):
-        self.wrap_cmd = [settings.ffmpeg_bin,
-                         '-i', self.video_stream.out_file,
-                         '-i', self.audio_stream.out_file,
-                         '-map', '0:0', '-map', '1:0',
-                         '-c:v', 'copy', '-c:a', 'copy',
-                         '-metadata', f'title={self.file_title} - Streaming Version',
-                         '-metadata', f'summary={self.file_summary}',
-                         '-movflags', '+faststart', self.out_file]
-
-        print('\n\nRunning: Chromecast Wrapper')
-        print(f"Command: {' '.join(str(element) for element in self.wrap_cmd)}\n")
-        self.comp_proc = subprocess.run(self.wrap_cmd)
-
-        print('\n\nClean-up:')
-        print(f'Deleting video file: {self.video_stream.out_file}')
-        self.video_stream.out_file.unlink()
-        print(f'Deleting audio file: {self.audio_stream.out_file}')
-        self.audio_stream.out_file.unlink()
+        self._set_files()
+        self._run({'video_stream': partial(encode_object.ChromecastEncode,
+                                           in_file=self.in_file,
+                                           out_file=self.stage_file,
+                                           burn_subs=self.burn_subs,
+                                           cpu_threads=self.cpu_threads,
+                                           crf=self.crf,
+                                           crop=self.crop,
+                                           denoise=self.denoise,
+                                           sub_file=self.sub_file,
+                                           media_info=self.media_info,
+                                           journal=self.journal,
+                                           cancel=self.cancel),
+                   'audio_stream': partial(encode_object.AACNormalizedDownmixEncode,
+                                           in_file=self.in_file,
+                                           out_file=self.stage_file,
+                                           media_info=self.media_info,
+                                           journal=self.journal,
+                                           cancel=self.cancel)})
+
+    def _mux_inputs(self):
+        return [self.audio_stream.out_file]
+
+    def _mux_flags(self):
+        return ['-c:a', 'copy',
+                '-metadata', f'title={self.file_title} - Streaming Version',
+                '-metadata', f'summary={self.file_summary}',
+                '-movflags', '+faststart']
 
 
 @dataclass
@@ -99,157 +316,119 @@ class TVWrapper(WrapperObject, ABC):
         super().__post_init__()
 
         self.out_file = self.out_file.with_suffix('.webm')
-        self.video_stream = encode_object.VP9Encode(in_file=self.in_file,
-                                                    out_file=self.out_file,
-                                                    crf=self.crf,
-                                                    crop=self.crop,
-                                                    burn_subs=self.burn_subs,
-                                                    denoise=self.denoise,
-                                                    sub_file=self.sub_file)
-        self.audio_stream = encode_object.OpusEncode(in_file=self.in_file,
-                                                     out_file=self.out_file)
+        self._set_files()
+        self._run(self._stages())
+
+    def _stages(self) -> Dict[str, Callable]:
+        """Encode stages for this wrapper, extended by subclasses."""
+        return {'video_stream': partial(encode_object.VP9Encode,
+                                        in_file=self.in_file,
+                                        out_file=self.stage_file,
+                                        cpu_threads=self.cpu_threads,
+                                        crf=self.crf,
+                                        crop=self.crop,
+                                        burn_subs=self.burn_subs,
+                                        denoise=self.denoise,
+                                        filter_once=self.filter_once,
+                                        segments=self.segments,
+                                        sub_file=self.sub_file,
+                                        media_info=self.media_info,
+                                        mux=self._mux_args if self.direct_mux else None,
+                                        mux_file=self.part_file,
+                                        journal=self.journal,
+                                        cancel=self.cancel),
+                'audio_stream': partial(encode_object.OpusEncode,
+                                        in_file=self.in_file,
+                                        out_file=self.stage_file,
+                                        media_info=self.media_info,
+                                        journal=self.journal,
+                                        cancel=self.cancel)}
+
+    def _mux_flags(self):
+        return ['-c:a', 'copy',
+                '-metadata', f'title={self.file_title}',
+                '-metadata', f'summary={self.file_summary}']
 
 
 @dataclass
 class TVMultiChannelWrapper(TVWrapper):
-    downmix_stream: encode_object.OpusNormalizedDownmixEncode = None
-
-    def __post_init__(self):
-        super().__post_init__()
-
-        self.downmix_stream = encode_object.OpusNormalizedDownmixEncode(in_file=self.in_file,
-                                                                        out_file=self.out_file)
-
-        self.wrap()
-
-    def wrap(self):
-        self.wrap_cmd = [settings.ffmpeg_bin,
-                         '-i', self.video_stream.out_file,
-                         '-i', self.audio_stream.out_file,
-                         '-i', self.downmix_stream.out_file,
-                         '-map', '0:0', '-map', '1:0', '-map', '2:0',
-                         '-c:v', 'copy', '-c:a', 'copy',
-                         '-metadata', f'title={self.file_title}',
-                         '-metadata', f'summary={self.file_summary}',
-                         self.out_file]
-
-        print('\n\nRunning: TV - Surround Wrapper')
-        print(f"Command: {' '.join(str(element) for element in self.wrap_cmd)}\n")
-        self.comp_proc = subprocess.run(self.wrap_cmd)
-
-        print('\n\nClean-up:')
-        print(f'Deleting video file: {self.video_stream.out_file}')
-        self.video_stream.out_file.unlink()
-        print(f'Deleting surround file: {self.audio_stream.out_file}')
-        self.audio_stream.out_file.unlink()
-        print(f'Deleting downmix file: {self.downmix_stream.out_file}')
-        self.downmix_stream.out_file.unlink()
+    downmix_stream: encode_object.SurroundOpusNormalizedDownmixEncode = None
+    wrap_title: str = 'TV - Surround Wrapper'
+
+    def _stages(self):
+        # the surround rendition is written alongside the downmix
+        stages = super()._stages()
+        del stages['audio_stream']
+        stages['downmix_stream'] = partial(encode_object.SurroundOpusNormalizedDownmixEncode,
+                                           in_file=self.in_file,
+                                           out_file=self.stage_file,
+                                           media_info=self.media_info,
+                                           journal=self.journal,
+                                           cancel=self.cancel)
+        return stages
+
+    def _mux_inputs(self):
+        return [self.downmix_stream.surround_file,
+                self.downmix_stream.out_file]
 
 
 @dataclass
 class TVMultiChannelSubtitleWrapper(TVWrapper):
-    downmix_stream: encode_object.OpusNormalizedDownmixEncode = None
+    downmix_stream: encode_object.SurroundOpusNormalizedDownmixEncode = None
     sub_stream: encode_object.WebVTTEncode = None
-
-    def __post_init__(self):
-        super().__post_init__()
-
-        self.downmix_stream = encode_object.OpusNormalizedDownmixEncode(in_file=self.in_file,
-                                                                        out_file=self.out_file)
-        self.sub_stream = encode_object.WebVTTEncode(in_file=self.sub_file,
-                                                     out_file=self.out_file)
-
-        self.wrap()
-
-    def wrap(self):
-        self.wrap_cmd = [settings.ffmpeg_bin,
-                         '-i', self.video_stream.out_file,
-                         '-i', self.audio_stream.out_file,
-                         '-i', self.downmix_stream.out_file,
-                         '-i', self.sub_stream.out_file,
-                         '-map', '0:0', '-map', '1:0',
-                         '-map', '2:0', '-map', '3:0',
-                         '-c:v', 'copy', '-c:a', 'copy', '-c:s', 'copy',
-                         '-metadata', f'title={self.file_title}',
-                         '-metadata', f'summary={self.file_summary}',
-                         '-disposition:s:0', '0',
-                         self.out_file]
-
-        print('\n\nRunning: TV - Surround - Subtitles Wrapper')
-        print(f"Command: {' '.join(str(element) for element in self.wrap_cmd)}\n")
-        self.comp_proc = subprocess.run(self.wrap_cmd)
-
-        print('\n\nClean-up:')
-        print(f'Deleting video file: {self.video_stream.out_file}')
-        self.video_stream.out_file.unlink()
-        print(f'Deleting surround file: {self.audio_stream.out_file}')
-        self.audio_stream.out_file.unlink()
-        print(f'Deleting downmix file: {self.downmix_stream.out_file}')
-        self.downmix_stream.out_file.unlink()
-        print(f'Deleting subtitle file: {self.sub_stream.out_file}')
-        self.sub_stream.out_file.unlink()
+    wrap_title: str = 'TV - Surround - Subtitles Wrapper'
+
+    def _stages(self):
+        # the surround rendition is written alongside the downmix
+        stages = super()._stages()
+        del stages['audio_stream']
+        stages['downmix_stream'] = partial(encode_object.SurroundOpusNormalizedDownmixEncode,
+                                           in_file=self.in_file,
+                                           out_file=self.stage_file,
+                                           media_info=self.media_info,
+                                           journal=self.journal,
+                                           cancel=self.cancel)
+        stages['sub_stream'] = partial(encode_object.WebVTTEncode,
+                                       in_file=self.sub_file,
+                                       out_file=self.stage_file,
+                                       journal=self.journal,
+                                       cancel=self.cancel)
+        return stages
+
+    def _mux_inputs(self):
+        return [self.downmix_stream.surround_file,
+                self.downmix_stream.out_file,
+                self.sub_stream.out_file]
+
+    def _mux_flags(self):
+        return super()._mux_flags() + ['-c:s', 'copy', '-disposition:s:0', '0']
 
 
 @dataclass
 class TVStereoWrapper(TVWrapper):
-    def __post_init__(self):
-        super().__post_init__()
+    wrap_title: str = 'TV - Stereo Wrapper'
 
-        self.wrap()
-
-    def wrap(self):
-        self.wrap_cmd = [settings.ffmpeg_bin,
-                         '-i', self.video_stream.out_file,
-                         '-i', self.audio_stream.out_file,
-                         '-map', '0:0', '-map', '1:0',
-                         '-c:v', 'copy', '-c:a', 'copy',
-                         '-metadata', f'title={self.file_title}',
-                         '-metadata', f'summary={self.file_summary}',
-                         self.out_file]
-
-        print('\n\nRunning: TV - Stereo Wrapper')
-        print(f"Command: {' '.join(str(element) for element in self.wrap_cmd)}\n")
-        self.comp_proc = subprocess.run(self.wrap_cmd)
-
-        print('\n\nClean-up:')
-        print(f'Deleting video file: {self.video_stream.out_file}')
-        self.video_stream.out_file.unlink()
-        print(f'Deleting audio file: {self.audio_stream.out_file}')
-        self.audio_stream.out_file.unlink()
+    def _mux_inputs(self):
+        return [self.audio_stream.out_file]
 
 
 @dataclass
 class TVStereoSubtitleWrapper(TVWrapper):
     sub_stream: encode_object.WebVTTEncode = None
-
-    def __post_init__(self):
-        super().__post_init__()
-
-        self.sub_stream = encode_object.WebVTTEncode(in_file=self.sub_file,
-                                                     out_file=self.out_file)
-
-        self.wrap()
-
-    def wrap(self):
-        self.wrap_cmd = [settings.ffmpeg_bin,
-                         '-i', self.video_stream.out_file,
-                         '-i', self.audio_stream.out_file,
-                         '-i', self.sub_stream.out_file,
-                         '-map', '0:0', '-map', '1:0', '-map', '2:0',
-                         '-c:v', 'copy', '-c:a', 'copy', '-c:s', 'copy',
-                         '-metadata', f'title={self.file_title}',
-                         '-metadata', f'summary={self.file_summary}',
-                         '-disposition:s:0', '0',
-                         self.out_file]
-
-        print('\n\nRunning: TV - Stereo - Subtitles Wrapper')
-        print(f"Command: {' '.join(str(element) for element in self.wrap_cmd)}\n")
-        self.comp_proc = subprocess.run(self.wrap_cmd)
-
-        print('\n\nClean-up:')
-        print(f'Deleting video file: {self.video_stream.out_file}')
-        self.video_stream.out_file.unlink()
-        print(f'Deleting audio file: {self.audio_stream.out_file}')
-        self.audio_stream.out_file.unlink()
-        print(f'Deleting subtitle file: {self.sub_stream.out_file}')
-        self.sub_stream.out_file.unlink()
+    wrap_title: str = 'TV - Stereo - Subtitles Wrapper'
+
+    def _stages(self):
+        stages = super()._stages()
+        stages['sub_stream'] = partial(encode_object.WebVTTEncode,
+                                       in_file=self.sub_file,
+                                       out_file=self.stage_file,
+                                       journal=self.journal,
+                                       cancel=self.cancel)
+        return stages
+
+    def _mux_inputs(self):
+        return [self.audio_stream.out_file,
+                self.sub_stream.out_file]
+
+    def _mux_flags(self):
+        return super()._mux_flags() + ['-c:s', 'copy', '-disposition:s:0', '0']